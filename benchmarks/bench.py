@@ -0,0 +1,304 @@
+#! /usr/bin/env python
+#
+# End-to-end binding benchmarks.
+#
+#   python benchmarks/bench.py                       # the default matrix
+#   python benchmarks/bench.py --pages=10,100 --kinds=bitonal --configs=djvu-cjb2
+#   python benchmarks/bench.py --list
+#
+# Every case runs binding.pipeline.Pipeline, the code Binder.run() runs
+# (analysis, optional OCR, encoding), without the GUI, in a child process of
+# its own so that the peak memory figures belong to that case alone. Results are appended to the
+# history file (--history=, by default benchmarks.json in Bindery's cache
+# directory) together with the Bindery version and git revision.
+
+import os, sys, json, time, shutil, tempfile, threading, subprocess, resource, platform
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'binding'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synth
+
+from djvubind import dependencies
+
+# Kept out of the source tree, next to the tool registry.
+HISTORY = os.path.join(os.path.dirname(dependencies.cache_file()), 'benchmarks.json')
+
+PAGES = [10, 100, 500, 2000]
+
+# Options as the GUI fills them in with its default settings.
+DEFAULTS = {
+  'title': 'Benchmark',
+  'author': 'Bindery',
+  'subject': '',
+  'keywords': '',
+  'tesseract_options': '-l eng',
+  'cuneiform_options': '',
+  'c44_options': '',
+  'cjb2_options': '-lossy',
+  'cpaldjvu_options': '',
+  'csepdjvu_options': '',
+  'minidjvu_options': '--match -pages-per-dict 100',
+  'djvu_output': 'bundled',
+  'page_layout': 'SinglePage',
+  'pages_per_dict': 15,
+  'binarization_threshold': 188,
+  'max_indexed_colors': 4,
+  'linearize': False
+}
+
+CONFIGS = {
+  'djvu-cjb2':       {'output_format': 'djvu', 'bitonal_encoder': 'cjb2', 'color_encoder': 'csepdjvu'},
+  'djvu-cjb2-c44':   {'output_format': 'djvu', 'bitonal_encoder': 'cjb2', 'color_encoder': 'c44'},
+  'djvu-minidjvu':   {'output_format': 'djvu', 'bitonal_encoder': 'minidjvu', 'color_encoder': 'c44'},
+  'pdf-jbig2-jpeg':  {'output_format': 'pdf', 'pdf_engine': 'native', 'foreground_encoder': 'JBIG2', 'background_encoder': 'JPEG'},
+  'pdf-g4-png':      {'output_format': 'pdf', 'pdf_engine': 'native', 'foreground_encoder': 'G4', 'background_encoder': 'PNG'},
+  'pdf-pdfbeads':    {'output_format': 'pdf', 'pdf_engine': 'pdfbeads', 'foreground_encoder': 'JBIG2', 'background_encoder': 'JPEG'}
+}
+
+OCR = ['none', 'tesseract', 'cuneiform']
+
+def argument(name, default=None):
+  for value in sys.argv[1:]:
+    if value.startswith(name + '='):
+      return value[len(name) + 1:]
+
+  return default
+
+def listed(name, default):
+  value = argument(name)
+
+  return default if value is None else [item for item in value.split(',') if item]
+
+def directory_size(path):
+  total = 0
+
+  for directory, folders, files in os.walk(path):
+    for name in files:
+      try:
+        total += os.lstat(os.path.join(directory, name)).st_size
+      except OSError:
+        pass
+
+  return total
+
+class DiskSampler(threading.Thread):
+  # Polls the size of a directory tree and remembers the largest value seen.
+  def __init__(self, path, interval=0.25):
+    super(DiskSampler, self).__init__()
+
+    self.daemon = True
+    self.path = path
+    self.interval = interval
+    self.peak = 0
+    self.finished = threading.Event()
+
+  def run(self):
+    while not self.finished.is_set():
+      self.peak = max(self.peak, directory_size(self.path))
+      self.finished.wait(self.interval)
+
+  def stop(self):
+    self.finished.set()
+    self.join()
+    self.peak = max(self.peak, directory_size(self.path))
+
+    return self.peak
+
+def version():
+  with open(os.path.join(ROOT, 'main.py')) as handle:
+    for line in handle:
+      if line.strip().startswith('version ='):
+        return line.split('=', 1)[1].strip().strip('\'"')
+
+  return None
+
+def revision():
+  try:
+    return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.STDOUT).decode('utf8').strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+def case_name(case):
+  return '{kind}/{pages}/{config}/{ocr}'.format(**case)
+
+def bind(case):
+  # Runs inside the child process: the pipeline Binder.run() runs, without
+  # the GUI around it.
+  from djvubind import imaging, ocrcache, utils
+
+  from binding import organizer
+  from binding.pipeline import Pipeline
+
+  options = dict(DEFAULTS)
+  options.update(CONFIGS[case['config']])
+  options['ocr'] = case['ocr'] != 'none'
+  options['ocr_engine'] = case['ocr']
+  options['output_file'] = case['output']
+
+  # A cache of its own, which starts empty, so that every run measures the
+  # engine; it sits next to the temporary directory, out of the disk figures.
+  cache = ocrcache.OCRCache(os.path.join(os.path.dirname(case['tmp']), 'ocr-cache'))
+
+  # Intermediate files go where the disk sampler is looking, as the binder
+  # puts them in its job directory.
+  pipeline = Pipeline()
+  pipeline.prepare([organizer.Page(path) for path in case['paths']], options, case['tmp'], utils.CancelToken(), cache)
+  pipeline.bind()
+
+  # Workers are only counted in RUSAGE_CHILDREN once they have been reaped.
+  imaging.shutdown()
+
+def run_case(case):
+  # Child process side: bind once and print the measurements as JSON.
+  tempfile.tempdir = case['tmp']
+
+  sampler = DiskSampler(case['tmp'])
+  sampler.start()
+
+  started = time.time()
+  error = None
+
+  try:
+    bind(case)
+  except Exception as exception:
+    error = '{0}: {1}'.format(type(exception).__name__, exception)
+
+  elapsed = time.time() - started
+
+  from djvubind import accounting
+
+  result = {
+    'seconds': elapsed,
+    'pages_per_second': len(case['paths']) / elapsed if elapsed else None,
+    'peak_rss_kb': accounting.maxrss(resource.getrusage(resource.RUSAGE_SELF)),
+    'peak_child_rss_kb': accounting.maxrss(resource.getrusage(resource.RUSAGE_CHILDREN)),
+    'peak_temp_bytes': sampler.stop(),
+    'output_bytes': os.path.getsize(case['output']) if os.path.isfile(case['output']) else None,
+    'error': error
+  }
+
+  sys.stdout.write(json.dumps(result) + '\n')
+
+  return 0 if error is None else 1
+
+def measure(case, workdir):
+  # Parent side: prepare the scratch directories and run the case in a child.
+  scratch = os.path.join(workdir, 'run')
+  shutil.rmtree(scratch, ignore_errors=True)
+  os.makedirs(os.path.join(scratch, 'tmp'))
+
+  case = dict(case)
+  case['tmp'] = os.path.join(scratch, 'tmp')
+  case['output'] = os.path.join(scratch, 'book.' + CONFIGS[case['config']]['output_format'])
+
+  environment = dict(os.environ)
+  environment['TMPDIR'] = case['tmp']
+
+  process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run-case=' + json.dumps(case)],
+                             cwd=scratch, env=environment, stdout=subprocess.PIPE)
+  output = process.communicate()[0].decode('utf8').strip().splitlines()
+
+  try:
+    result = json.loads(output[-1])
+  except (IndexError, ValueError):
+    result = {'error': 'benchmark process exited with status {0}'.format(process.returncode)}
+
+  shutil.rmtree(scratch, ignore_errors=True)
+
+  return result
+
+def load_history(path):
+  if not os.path.isfile(path):
+    return []
+
+  with open(path) as handle:
+    return json.load(handle)
+
+def previous(history, name):
+  for entry in reversed(history):
+    if name in entry['results'] and not entry['results'][name].get('error'):
+      return entry['results'][name]
+
+  return None
+
+def change(old, new, key):
+  if not old or old.get(key) in (None, 0) or new.get(key) is None:
+    return ''
+
+  return '{0:+.0f}%'.format(100.0 * (new[key] - old[key]) / old[key])
+
+def main():
+  if argument('--run-case') is not None:
+    return run_case(json.loads(argument('--run-case')))
+
+  if '--list' in sys.argv:
+    sys.stdout.write('kinds:   {0}\n'.format(', '.join(synth.KINDS + ['mixed-book'])))
+    sys.stdout.write('configs: {0}\n'.format(', '.join(sorted(CONFIGS))))
+    sys.stdout.write('ocr:     {0}\n'.format(', '.join(OCR)))
+    return 0
+
+  kinds = listed('--kinds', synth.KINDS)
+  pages = [int(count) for count in listed('--pages', PAGES)]
+  configs = listed('--configs', sorted(CONFIGS))
+  engines = listed('--ocr', ['none'])
+  workdir = argument('--workdir', os.path.join(tempfile.gettempdir(), 'bindery-benchmarks'))
+
+  history_file = argument('--history', HISTORY)
+  history = load_history(history_file)
+  entry = {
+    'version': version(),
+    'revision': revision(),
+    'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'platform': platform.platform(),
+    'python': platform.python_version(),
+    'results': {}
+  }
+
+  header = '{0:<40} {1:>9} {2:>8} {3:>10} {4:>10} {5:>10}'
+  row = '{0:<40} {1:>9.2f} {2:>8} {3:>10.1f} {4:>10.1f} {5:>10.1f}'
+
+  sys.stdout.write(header.format('case', 'pages/s', 'change', 'rss (MB)', 'temp (MB)', 'out (MB)') + '\n')
+
+  for kind in kinds:
+    for count in pages:
+      # A page set is reused by every configuration that binds it.
+      paths = synth.page_set(os.path.join(workdir, '{0}-{1}'.format(kind, count)), kind, count)
+
+      for config in configs:
+        for engine in engines:
+          case = {'kind': kind, 'pages': count, 'config': config, 'ocr': engine, 'paths': paths}
+          name = case_name(case)
+
+          result = measure(case, workdir)
+          entry['results'][name] = result
+
+          if result.get('error'):
+            sys.stdout.write('{0:<40} failed: {1}\n'.format(name, result['error']))
+            continue
+
+          sys.stdout.write(row.format(
+            name,
+            result['pages_per_second'],
+            change(previous(history, name), result, 'pages_per_second'),
+            max(result['peak_rss_kb'], result['peak_child_rss_kb']) / 1024.0,
+            result['peak_temp_bytes'] / 1048576.0,
+            (result['output_bytes'] or 0) / 1048576.0
+          ) + '\n')
+          sys.stdout.flush()
+
+  history.append(entry)
+
+  if not os.path.isdir(os.path.dirname(os.path.abspath(history_file))):
+    os.makedirs(os.path.dirname(os.path.abspath(history_file)))
+
+  with open(history_file, 'w') as handle:
+    json.dump(history, handle, indent=2, sort_keys=True)
+
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
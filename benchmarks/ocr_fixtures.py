@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+#
+# Records the fixtures of the OCR micro-benchmarks (benchmarks/ocr_micro.py).
+#
+#   python benchmarks/ocr_fixtures.py record                  # the pages below
+#   python benchmarks/ocr_fixtures.py record <image> <name>   # a scan of your own
+#
+# Runs the installed engines over a page and stores their raw output under
+# benchmarks/fixtures/ocr/: tesseract's box file and plain text as <name>.box
+# and <name>.txt, cuneiform's hOCR as <name>.hocr (0.8, one span per
+# character) or <name>.cinfo.hocr (1.0, x_bboxes lines), whichever dialect the
+# installed version writes. Engines that are not installed are skipped. When
+# the tesseract program is missing, the box file and text are taken from
+# libtesseract through tesserocr, whose GetBoxText() and GetUTF8Text() are
+# what the program's makebox and text outputs write.
+#
+# Without an image, the pages in PAGES are rendered at 300 dpi with Pillow
+# and recorded; the rendered images are not kept.
+
+import os, sys, shutil, subprocess, tempfile, textwrap
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ocr')
+
+FONTS = [
+  '/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf',
+  '/usr/share/fonts/dejavu/DejaVuSerif.ttf',
+  '/Library/Fonts/Georgia.ttf',
+  'C:\\Windows\\Fonts\\georgia.ttf'
+]
+
+TEXT = '''Bookbinding is the process of physically assembling a book from a
+number of folded or unfolded sheets of paper. The sheets are stacked in
+groups called signatures, sewn or glued along one edge, and attached to a
+cover of board, cloth or leather. Before the nineteenth century most books
+were sold unbound, and a buyer took the sheets to a binder of their choice,
+which is why the books of one library often share a single style of binding
+whatever their printers were.
+
+A scanned book reverses much of that work. Each page becomes an image of
+about 2550 by 3300 pixels at 300 dpi, some 8.4 million of them per page, and
+the images are bound again into a single file: a DjVu document, which keeps
+text and pictures in separate layers, or a PDF, which most readers can open.
+Optical character recognition adds a hidden layer of text so that the book
+can be searched, copied from and read aloud. "Hidden" means the words are
+drawn without ink, exactly over the letters in the scan; a reader that
+selects a line of the image is really selecting that text.
+
+The layer is only as good as the recognition. Ligatures such as fi and fl,
+long dashes, small capitals and the letters rn and m, l and 1, O and 0 are
+the usual sources of mistakes, and so are page numbers (12, 37, 104),
+footnote markers & marginal notes. Checking a few pages by hand is still
+worthwhile before a long book is bound.'''
+
+# Page name -> paragraphs of TEXT, point size. Paragraphs run round TEXT
+# again when there are more than it has, until the page is full.
+PAGES = {
+  'sparse': (1, 11),
+  'typical': (3, 11),
+  'dense': (12, 8)
+}
+
+WIDTH, HEIGHT, DPI = 2550, 3300, 300
+
+def render(name, path):
+  from PIL import Image, ImageDraw, ImageFont
+
+  paragraphs, points = PAGES[name]
+  size = points * DPI // 72
+  font = None
+
+  for candidate in FONTS:
+    if os.path.isfile(candidate):
+      font = ImageFont.truetype(candidate, size)
+      break
+
+  if font is None:
+    font = ImageFont.load_default(size)
+
+  image = Image.new('L', (WIDTH, HEIGHT), 255)
+  draw = ImageDraw.Draw(image)
+  y = 300
+
+  texts = TEXT.split('\n\n')
+
+  for number in range(paragraphs):
+    for line in textwrap.wrap(' '.join(texts[number % len(texts)].split()), 68 * 11 // points):
+      if y + size > HEIGHT - 300:
+        break
+
+      draw.text((300, y), line, font=font, fill=0)
+      y += size * 3 // 2
+
+    y += size
+
+  image.convert('1').save(path, dpi=(DPI, DPI))
+
+def tesseract(image, workdir):
+  # (box file, text), or None when neither the program nor tesserocr is
+  # installed.
+  if shutil.which('tesseract'):
+    output = os.path.join(workdir, 'tesseract')
+
+    subprocess.check_call(['tesseract', image, output + '_box', 'batch', 'makebox'])
+    subprocess.check_call(['tesseract', image, output + '_txt', 'batch'])
+
+    # tesseract-3.00 changed the .txt extension of box files to .box.
+    box = output + '_box.box'
+    if not os.path.exists(box):
+      box = output + '_box.txt'
+
+    with open(box, encoding='utf8') as handle:
+      boxfile = handle.read()
+    with open(output + '_txt.txt', encoding='utf8') as handle:
+      text = handle.read()
+
+    return boxfile, text
+
+  try:
+    import tesserocr
+  except ImportError:
+    return None
+
+  # pip installs tessdata next to the interpreter rather than where the
+  # library looks by default.
+  path = os.environ.get('TESSDATA_PREFIX') or os.path.join(sys.prefix, 'share', 'tessdata')
+
+  options = {'path': path} if os.path.isdir(path) else {}
+
+  with tesserocr.PyTessBaseAPI(lang='eng', **options) as api:
+    api.SetImageFile(image)
+
+    return api.GetBoxText(0), api.GetUTF8Text()
+
+def cuneiform(image, workdir):
+  # (extension, hOCR), or None when cuneiform is not installed.
+  if not shutil.which('cuneiform'):
+    return None
+
+  output = os.path.join(workdir, 'cuneiform.hocr')
+  subprocess.check_call(['cuneiform', '-f', 'hocr', '-o', output, image], cwd=workdir)
+
+  with open(output, encoding='utf8') as handle:
+    hocr = handle.read()
+
+  return '.cinfo.hocr' if 'ocr_cinfo' in hocr else '.hocr', hocr
+
+def write(name, extension, data):
+  if not os.path.isdir(FIXTURES):
+    os.makedirs(FIXTURES)
+
+  with open(os.path.join(FIXTURES, name + extension), 'w', encoding='utf8') as handle:
+    handle.write(data)
+
+  sys.stdout.write('{0}{1}\n'.format(name, extension))
+
+def record(image, name):
+  workdir = tempfile.mkdtemp(prefix='bindery-fixtures-')
+
+  try:
+    if image is None:
+      image = os.path.join(workdir, name + '.png')
+      render(name, image)
+
+    result = tesseract(image, workdir)
+
+    if result is not None:
+      write(name, '.box', result[0])
+      write(name, '.txt', result[1])
+
+    result = cuneiform(image, workdir)
+
+    if result is not None:
+      write(name, result[0], result[1])
+  finally:
+    shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+  if len(sys.argv) == 2 and sys.argv[1] == 'record':
+    for name in sorted(PAGES):
+      record(None, name)
+  elif len(sys.argv) == 4 and sys.argv[1] == 'record':
+    record(sys.argv[2], sys.argv[3])
+  else:
+    sys.stderr.write('usage: ocr_fixtures.py record [<image> <name>]\n')
+    return 1
+
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,150 @@
+#! /usr/bin/env python
+#
+# Micro-benchmarks for the pure-Python OCR post-processing.
+#
+#   python benchmarks/ocr_micro.py [--repeat=N] [--fixtures=sparse,typical,dense]
+#
+# Runs Tesseract._correct_boxfile, hocrParser (both cuneiform dialects),
+# translate and djvuPageBox.encode over the recorded engine outputs in
+# benchmarks/fixtures/ocr/ (see ocr_fixtures.py) and reports, per function
+# and fixture, the best and median time of N runs and the peak and retained
+# memory allocated by one run according to tracemalloc. No OCR engine is
+# needed; functions without a fixture for their engine are listed as skipped.
+
+import os, sys, copy, time, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'binding'))
+
+from djvubind import ocr
+
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures', 'ocr')
+
+def argument(name, default=None):
+  for value in sys.argv[1:]:
+    if value.startswith(name + '='):
+      return value[len(name) + 1:]
+
+  return default
+
+def read(name, extension):
+  path = os.path.join(FIXTURES, name + extension)
+
+  if not os.path.isfile(path):
+    return None
+
+  with open(path, encoding='utf8') as handle:
+    return handle.read()
+
+def parse_box(boxfile):
+  # The same parsing Tesseract.analyze() applies before reconciling.
+  data = []
+
+  for line in boxfile.split('\n'):
+    if line == '':
+      continue
+
+    line = line.split()
+    data.append({'char': line[0], 'xmin': int(line[1]), 'ymin': int(line[2]), 'xmax': int(line[3]), 'ymax': int(line[4])})
+
+  return data
+
+def parse_hocr(data):
+  parser = ocr.hocrParser()
+  parser.parse(data)
+
+  return parser.boxing
+
+def cases(name):
+  # Yields (function, setup) pairs. setup() returns fresh arguments for one
+  # call so that functions which modify their input are measured fairly.
+  box, text = read(name, '.box'), read(name, '.txt')
+  boxing = []
+
+  if box is not None and text is not None:
+    # Engines are not installed here, so skip Tesseract.__init__.
+    tesseract = object.__new__(ocr.Tesseract)
+    boxdata = parse_box(box)
+
+    yield 'Tesseract._correct_boxfile', lambda: (tesseract._correct_boxfile, (copy.deepcopy(boxdata), text))
+
+    boxing = tesseract._merge(copy.deepcopy(boxdata), text, name)
+
+  for extension, label in [('.hocr', 'hocrParser (0.8)'), ('.cinfo.hocr', 'hocrParser (1.0)')]:
+    hocr = read(name, extension)
+
+    if hocr is None:
+      # Shown in the report, so that a missing engine is not mistaken for a
+      # function that was measured.
+      yield label, None
+    else:
+      yield label, (lambda hocr: lambda: (parse_hocr, (hocr,)))(hocr)
+
+      # Either engine's boxing carries the word and line breaks translate()
+      # needs; tesseract's is used when there is one.
+      if not boxing:
+        boxing = parse_hocr(hocr)
+
+  if boxing:
+    yield 'translate', lambda: (ocr.translate, (boxing,))
+
+    from binding.ocr import translate
+    page = translate(boxing, False)
+
+    yield 'djvuPageBox.encode', lambda: (page.encode, ())
+
+def measure(setup, repeat):
+  times = []
+
+  for run in range(repeat):
+    function, arguments = setup()
+
+    started = time.perf_counter()
+    function(*arguments)
+    times.append(time.perf_counter() - started)
+
+  function, arguments = setup()
+
+  tracemalloc.start()
+  result = function(*arguments)
+  current, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  del result
+
+  times.sort()
+
+  return {'best': times[0], 'median': times[len(times) // 2], 'peak': peak, 'retained': current}
+
+def main():
+  repeat = int(argument('--repeat', 20))
+  available = sorted(set(name.split('.')[0] for name in os.listdir(FIXTURES))) if os.path.isdir(FIXTURES) else []
+  names = [name for name in argument('--fixtures', ','.join(available)).split(',') if name]
+
+  if not names:
+    sys.stderr.write('No fixtures found; run benchmarks/ocr_fixtures.py record first.\n')
+    return 1
+
+  header = '{0:<28} {1:<10} {2:>10} {3:>10} {4:>10} {5:>10}'
+  row = '{0:<28} {1:<10} {2:>10.2f} {3:>10.2f} {4:>10.1f} {5:>10.1f}'
+
+  sys.stdout.write(header.format('function', 'fixture', 'best (ms)', 'med (ms)', 'peak (KB)', 'kept (KB)') + '\n')
+
+  for name in names:
+    for label, setup in cases(name):
+      if setup is None:
+        sys.stdout.write('{0:<28} {1:<10} skipped: no hOCR fixture\n'.format(label, name))
+        continue
+
+      result = measure(setup, repeat)
+
+      sys.stdout.write(row.format(label, name, result['best'] * 1000, result['median'] * 1000,
+                                  result['peak'] / 1024.0, result['retained'] / 1024.0) + '\n')
+      sys.stdout.flush()
+
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,96 @@
+import os, random, shutil
+
+try:
+  from djvubind import utils
+except:
+  from binding.djvubind import utils
+
+# Synthetic scans at 300 dpi, letter size by default. Only a small pool of
+# unique pages is rendered per kind; larger books cycle through the pool so
+# that a 2000 page set does not take longer to build than to bind.
+
+KINDS = ['bitonal', 'grayscale', 'color', 'mixed']
+
+WORDS = '''lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod
+tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam quis
+nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat'''.split()
+
+def paragraph(rng, lines, width=60):
+  text = []
+
+  for line in range(lines):
+    words = []
+
+    while len(' '.join(words)) < width:
+      words.append(rng.choice(WORDS))
+
+    text.append(' '.join(words))
+
+  return '\n'.join(text)
+
+def text_arguments(rng, width, height):
+  arguments = ['-fill', 'black', '-pointsize', str(height // 110)]
+
+  for block in range(3):
+    arguments += ['-annotate', '+{0}+{1}'.format(width // 12, height // 10 + block * height // 3.5), paragraph(rng, 14)]
+
+  return arguments
+
+def render(kind, seed, path, width=2550, height=3300, dpi=300):
+  rng = random.Random(seed)
+  density = ['-density', str(dpi), '-units', 'PixelsPerInch']
+
+  if kind == 'bitonal':
+    command = ['convert', '-size', '{0}x{1}'.format(width, height), 'xc:white'] + text_arguments(rng, width, height) + ['-monochrome'] + density + ['-compress', 'Group4', path]
+  elif kind == 'grayscale':
+    command = ['convert', '-size', '{0}x{1}'.format(width, height), '-seed', str(seed), 'plasma:gray60-gray95', '-colorspace', 'Gray'] + text_arguments(rng, width, height) + density + [path]
+  elif kind == 'color':
+    command = ['convert', '-size', '{0}x{1}'.format(width, height), '-seed', str(seed), 'plasma:fractal', '-blur', '0x4'] + density + [path]
+  elif kind == 'mixed':
+    photo = ['(', '-size', '{0}x{1}'.format(width * 2 // 3, height // 3), '-seed', str(seed), 'plasma:fractal', ')', '-geometry', '+{0}+{1}'.format(width // 6, height // 3), '-composite']
+    command = ['convert', '-size', '{0}x{1}'.format(width, height), 'xc:white'] + text_arguments(rng, width, height) + photo + density + [path]
+  else:
+    raise ValueError('Unknown page kind "{0}".'.format(kind))
+
+  utils.execute(command)
+
+  return path
+
+def page_set(directory, kind, pages, unique=20, **size):
+  # Returns `pages` paths named page_0001.tif... in directory. Pages are
+  # copies (hard links where possible) of `unique` rendered originals.
+  pool = os.path.join(directory, 'pool')
+
+  if not os.path.isdir(pool):
+    os.makedirs(pool)
+
+  kinds = KINDS if kind == 'mixed-book' else [kind]
+  originals = {}
+
+  for name in kinds:
+    originals[name] = []
+
+    for index in range(min(unique, pages)):
+      path = os.path.join(pool, '{0}_{1:03d}.tif'.format(name, index))
+
+      if not os.path.exists(path):
+        render(name, index, path, **size)
+
+      originals[name].append(path)
+
+  paths = []
+
+  for number in range(pages):
+    name = kinds[number % len(kinds)]
+    source = originals[name][number // len(kinds) % len(originals[name])]
+    path = os.path.join(directory, 'page_{0:04d}.tif'.format(number + 1))
+
+    if not os.path.exists(path):
+      try:
+        os.link(source, path)
+      except OSError:
+        shutil.copy(source, path)
+
+    paths.append(path)
+
+  return paths
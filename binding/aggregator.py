@@ -0,0 +1,151 @@
+import time, threading, collections
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+def duration(seconds):
+  seconds = int(round(seconds))
+
+  if seconds >= 3600:
+    return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+  return '{0}:{1:02d}'.format(seconds // 60, seconds % 60)
+
+class ProgressAggregator(QObject):
+  # Collects progress from the binding threads and hands it to the GUI in
+  # batches at a fixed rate: however many pages finish in between, the GUI
+  # gets at most one progress update and one set of row backgrounds per tick.
+  rate = 20
+
+  # Seconds of history the throughput is measured over.
+  window = 10.0
+
+  def __init__(self, parent = None):
+    super(ProgressAggregator, self).__init__(parent)
+
+    self.lock = threading.Lock()
+
+    self.timer = QTimer(self)
+    self.timer.setInterval(1000 // self.rate)
+    self.connect(self.timer, SIGNAL('timeout()'), self.flush)
+
+    self.reset()
+
+  def reset(self):
+    self.name = ''
+    self.total = 0
+    self.done = 0
+    self.base = 0
+    self.span = 100
+    self.percent = 0
+    self.samples = collections.deque()
+    self.backgrounds = {}
+    self.changed = False
+    self.finished = False
+
+  def start(self):
+    # Called on the GUI thread, which the timer belongs to.
+    with self.lock:
+      self.reset()
+
+    self.timer.start()
+
+  def stop(self):
+    self.timer.stop()
+
+    with self.lock:
+      self.reset()
+
+  def stage(self, name, total, base, span):
+    # A stage takes the progress bar from base to base + span percent as its
+    # pages get done.
+    with self.lock:
+      self.name = name
+      self.total = total
+      self.done = 0
+      self.base = base
+      self.span = span
+      self.percent = base
+      self.samples = collections.deque([(time.time(), 0)])
+      self.changed = True
+
+  def page(self, row, color, percent=None, done=None):
+    # Thread-safe; a later colour for the same row replaces the earlier one.
+    # Each call is one page finished, unless done says how many pages are.
+    with self.lock:
+      now = time.time()
+
+      if done is None:
+        self.done += 1
+      else:
+        self.done = max(self.done, min(done, self.total) if self.total else done)
+
+      self.samples.append((now, self.done))
+
+      while len(self.samples) > 2 and self.samples[1][0] < now - self.window:
+        self.samples.popleft()
+
+      if percent is None and self.total:
+        percent = self.base + self.span * min(self.done, self.total) / float(self.total)
+
+      if percent is not None:
+        self.percent = percent
+
+      if row is not None:
+        self.backgrounds[row] = color
+
+      self.changed = True
+
+  def finish(self):
+    with self.lock:
+      self.finished = True
+
+  def throughput(self):
+    # Pages per second over the window, or None until there is enough to go
+    # on.
+    if len(self.samples) < 2:
+      return None
+
+    (start, first), (end, last) = self.samples[0], self.samples[-1]
+
+    if end - start < 0.5 or last == first:
+      return None
+
+    return (last - first) / (end - start)
+
+  def message(self):
+    message = self.name
+
+    if self.total:
+      message += ' ({0}/{1})'.format(min(self.done + 1, self.total), self.total)
+
+    rate = self.throughput()
+
+    if rate is not None:
+      message += ', {0:.1f} pages/s'.format(rate)
+
+      if self.total > self.done:
+        message += ', {0} left'.format(duration((self.total - self.done) / rate))
+
+    return message
+
+  def flush(self):
+    with self.lock:
+      backgrounds, self.backgrounds = self.backgrounds, {}
+      changed, self.changed = self.changed, False
+      finished = self.finished
+
+      percent = int(self.percent)
+      message = self.message()
+
+    if backgrounds:
+      self.emit(SIGNAL('updateBackgrounds(PyQt_PyObject)'), backgrounds)
+
+    if changed:
+      self.emit(SIGNAL('updateProgress(int, QString)'), percent, message)
+
+    # Delivered after the last batch, so that nothing arrives once the GUI
+    # has been told the job is over.
+    if finished:
+      self.stop()
+      self.emit(SIGNAL('finished()'))
@@ -1,43 +1,54 @@
-import os, time, shutil, glob, sys, tempfile
+import os, shutil, tempfile
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
-import djvubind.ocr
+from djvubind import accounting, tracing, utils
 
-from . import organizer, ocr
+from .aggregator import ProgressAggregator
+from .pipeline import Pipeline
 
-from .encoders.djvu import DjVuEncoder
-from .encoders.pdf import PDFEncoder
-
-class Binder(QThread):
+class Binder(Pipeline, QThread):
   def __init__(self, parent = None):
     super(Binder, self).__init__(parent)
+    
+    # Pages are reported to the aggregator from this thread; the GUI hears
+    # from it at a steady rate instead of once per page and stage.
+    self.progress = ProgressAggregator(self)
+    self.connect(self.progress, SIGNAL('finished()'), self.progressFinished)
   
   def initialize(self, pages, options):
-    self.pages = pages
-    self.options = options
-    self.book = organizer.Book()
+    self.die = False
     
-    if self.options['output_format'] == 'djvu':
-      self.enc = DjVuEncoder(self.options)
-    elif self.options['output_format'] == 'pdf':
-      self.enc = PDFEncoder(self.options)
-
-    if self.options['ocr']:
-      if self.options['ocr_engine'] == 'tesseract':
-        self.ocr = djvubind.ocr.Tesseract(self.options)
-      elif self.options['ocr_engine'] == 'cuneiform':
-        self.ocr = djvubind.ocr.Cuneiform(self.options)
-    else:
-      self.ocr = False
+    # Every intermediate file of the job is made in here, so that it goes
+    # away with the job however the job ends.
+    self.prepare(pages, options, tempfile.mkdtemp(prefix='bindery-job-'), utils.CancelToken())
     
-    self.connect(self.enc, SIGNAL('updateProgress(int, int)'), self.updateProgress)
+    self.connect(self.enc, SIGNAL('updateProgress(int, int, PyQt_PyObject)'), self.updateProgress, Qt.DirectConnection)
     self.connect(self.enc, SIGNAL('error(QString)'), self.error)
+    self.connect(self.enc, SIGNAL('encoderEvent(PyQt_PyObject)'), self.encoderEvent)
   
   def error(self, message):
+    self.cancel()
     self.emit(SIGNAL('error(QString)'), message)
-    self.terminate()
+  
+  def cancel(self):
+    # The job stops at its next check, between pages or tool runs; the tool
+    # running at the moment is killed together with its children.
+    self.die = True
+    self.token.cancel()
+  
+  def start(self):
+    self.progress.start()
+    super(Binder, self).start()
+  
+  def stop(self):
+    self.cancel()
+    self.wait()
+    self.progress.stop()
+  
+  def encoderEvent(self, event):
+    self.emit(SIGNAL('encoderEvent(PyQt_PyObject)'), event)
   
   def add_file(self, filename, category='page'):
     if category == 'page':
@@ -47,107 +58,87 @@ class Binder(QThread):
 
     return self.book.pages[-1]
   
-  def analyze(self):
-    self.queue = self.book.pages[:]
-    self.quit = False
-    self.total = len(self.queue)
-    base_percent = 25 + 25 * (not self.options['ocr'])
+  def stage(self, name, total, base, span):
+    self.progress.stage(name, total, base, span)
+  
+  def analyzed(self, row):
+    self.progress.page(row, QColor(210, 255, 210, 120))
+  
+  def recognized(self, row):
+    self.progress.page(row, QColor(190, 255, 190, 120))
+  
+  def ocr_finished(self):
+    self.emit(SIGNAL('ocrFinished'))
+  
+  def updateProgress(self, percent, done, rows):
+    # Called on the thread the encoder runs on, which reports how many pages
+    # it has finished, as often as it likes, and the rows of the pages it
+    # finished since, in whatever order it encodes them.
+    color = QColor(170, 255, 170, 120)
     
-    while not self.quit:
-      if len(self.queue) == 0:
-        self.quit = True
-        break
-
-      self.emit(
-        SIGNAL('updateProgress(int, QString)'),
-        int(base_percent * (1 - float(len(self.queue)) / float(self.total))),
-        'Analyzing ({number}/{total})'.format(
-          number=len(self.book.pages) - len(self.queue) + 1,
-          total=len(self.book.pages)
-        )
-      )
-      
-      page = self.queue.pop()
-      page.is_bitonal()
-      page.get_dpi()
-      page.get_size()
-      
-      if page.grayscale and not page.bitonal:
-        utils.simple_exec('convert "{0}" -type Grayscale "{0}.grayscale"'.format(page.path))
-        page.path += '.grayscale'
-      
-      self.emit(SIGNAL('updateBackground(int, QColor)'), len(self.book.pages) - len(self.queue) - 1, QColor(210, 255, 210, 120))
-      
-    return None
+    for row in rows:
+      self.progress.page(row, color, percent, done)
+    
+    if not rows:
+      self.progress.page(None, color, percent, done)
   
-  def updateProgress(self, percent, item):
-    self.emit(SIGNAL('updateProgress(int, QString)'), int(percent), 'Binding the book')
-    self.emit(SIGNAL('updateBackground(int, QColor)'), int(item), QColor(170, 255, 170, 120))
+  def finish(self):
+    report = accounting.stop()
     
-    if int(percent) == 100:
-      os.remove(self.metadata.name)
+    if report is not None:
+      if self.options.get('tool_report'):
+        report.save(self.options['tool_report'])
       
-      time.sleep(0.5)
-      self.emit(SIGNAL('finishedBinding'))
+      self.emit(SIGNAL('toolReport(QString)'), report.table())
+    
+    if self.options.get('trace_file'):
+      tracing.export(self.options['trace_file'])
+      tracing.disable()
+    
+    self.progress.finish()
   
-  def get_ocr(self):
-    self.queue = self.book.pages[:]
-    self.total = len(self.queue)
-    self.quit = False
+  def progressFinished(self):
+    self.emit(SIGNAL('finishedBinding'))
+  
+  def cleanup(self):
+    shutil.rmtree(self.tempdir, ignore_errors=True)
     
-    while not self.quit:
-      if len(self.queue) == 0:
-        self.quit = True
-        break
-      
-      self.emit(
-        SIGNAL('updateProgress(int, QString)'),
-        25 + int(25 * (1 - float(len(self.queue)) / float(self.total))),
-        'Performing OCR ({number}/{total})'.format(
-          number=len(self.book.pages) - len(self.queue) + 1,
-          total=len(self.book.pages)
-        )
-      )
+    if self.die:
+      accounting.stop()
+      tracing.disable()
       
-      page = self.queue.pop()
-      
-      if self.options['ocr']:
-        page.text = djvubind.ocr.translate(self.ocr.analyze(page.path))
-      
-      self.emit(SIGNAL('updateBackground(int, QColor)'), len(self.book.pages) - len(self.queue) - 1, QColor(190, 255, 190, 120))
-    
-    return None
+      # A partly written book is of no use.
+      if os.path.isfile(self.options['output_file']):
+        os.remove(self.options['output_file'])
   
   def run(self):
-    self.die = False
-    self.book.pages = self.pages[:]
+    accounting.start(self.options['output_file'])
+    
+    if self.options.get('trace_file'):
+      tracing.enable()
     
     if os.path.isfile(self.options['output_file']):
       os.remove(self.options['output_file'])
     
-    if not self.die:
-      self.analyze()
-    
-    if not self.die:
-      self.book.get_dpi()
-    
-    self.metadata = tempfile.NamedTemporaryFile(delete=False)
-    
-    for prop in ['Title', 'Author', 'Subject', 'Keywords']:
-      self.metadata.write('{prop}{sep} "{value}"\n'.format(
-        prop=prop,
-        sep=':' if self.options['output_format'] == 'pdf' else '',
-        value=self.options[prop.lower()].replace('\\', '\\\\').replace('"', '\\"')
-      ).encode())
-    
-    self.metadata.close()
-    
-    self.book.suppliments['metadata'] = self.metadata.name
-  
-    if self.options['ocr'] and not self.die:
-      self.get_ocr()
-      self.emit(SIGNAL('ocrFinished'))
+    # The encoder runs on this thread, so that the job is over, and its
+    # files can go, as soon as run() returns.
+    try:
+      self.bind()
+    except utils.Cancelled:
+      self.die = True
+    except SystemExit:
+      # djvubind gives up this way when a tool fails; it has said why on
+      # stderr.
+      self.die = True
+      self.emit(SIGNAL('error(QString)'), 'The encoder stopped with an error.')
+    except Exception as message:
+      # A tool that failed (utils.run with check=True) or a file that could
+      # not be read or written. The GUI stops the bind when it hears of it,
+      # as it does when the user stops it.
+      self.die = True
+      self.emit(SIGNAL('error(QString)'), 'The book could not be bound: {0}'.format(message))
+    finally:
+      self.cleanup()
     
     if not self.die:
-      self.enc.book = self.book
-      self.enc.start()
+      self.finish()
@@ -0,0 +1,163 @@
+#! /usr/bin/env python3
+
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc.
+"""
+Per-command time and resource accounting for external tools.
+
+utils.run() hands every finished command to record().  While a report is
+active (see start()), each command is stored with the page that was being
+worked on by the calling thread, so that a slow bind can be traced back to the
+tool responsible.
+"""
+
+import json
+import os
+import sys
+import threading
+
+_active = None
+_local = threading.local()
+
+
+class Record(object):
+    """
+    A single external command.  Times are in seconds, maxrss in kilobytes.
+    """
+
+    def __init__(self, tool, page, status, wall, user, system, maxrss):
+        self.tool = tool
+        self.page = page
+        self.status = status
+        self.wall = wall
+        self.user = user
+        self.system = system
+        self.maxrss = maxrss
+
+    def as_dict(self):
+        return {'tool':self.tool, 'page':self.page, 'status':self.status, 'wall':self.wall,
+                'user':self.user, 'system':self.system, 'maxrss':self.maxrss}
+
+
+class Report(object):
+    """
+    All commands run while binding one book.
+    """
+
+    def __init__(self, book=None):
+        self.book = book
+        self.records = []
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+        return None
+
+    def summary(self):
+        """
+        Totals per tool: calls, wall, user and system time, and the largest
+        resident set size seen.
+        """
+
+        tools = {}
+        with self.lock:
+            records = list(self.records)
+
+        for record in records:
+            entry = tools.setdefault(record.tool, {'calls':0, 'failures':0, 'wall':0.0, 'user':0.0, 'system':0.0, 'maxrss':0})
+            entry['calls'] = entry['calls'] + 1
+            entry['failures'] = entry['failures'] + (record.status != 0)
+            entry['wall'] = entry['wall'] + record.wall
+            entry['user'] = entry['user'] + (record.user or 0.0)
+            entry['system'] = entry['system'] + (record.system or 0.0)
+            entry['maxrss'] = max(entry['maxrss'], record.maxrss or 0)
+
+        return tools
+
+    def as_dict(self):
+        with self.lock:
+            records = [record.as_dict() for record in self.records]
+
+        return {'book':self.book, 'summary':self.summary(), 'commands':records}
+
+    def save(self, filename):
+        with open(filename, 'w') as handle:
+            json.dump(self.as_dict(), handle, indent=2)
+        return None
+
+    def table(self):
+        """
+        The summary as a plain text table, slowest tool first.
+        """
+
+        rows = sorted(self.summary().items(), key=lambda item: item[1]['wall'], reverse=True)
+        lines = ['{0:<12} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10}'.format('tool', 'calls', 'wall (s)', 'user (s)', 'sys (s)', 'rss (MB)')]
+        for tool, entry in rows:
+            lines.append('{0:<12} {1:>6} {2:>10.2f} {3:>10.2f} {4:>10.2f} {5:>10.1f}'.format(
+                tool, entry['calls'], entry['wall'], entry['user'], entry['system'], entry['maxrss'] / 1024.0))
+        return '\n'.join(lines)
+
+
+def start(book=None):
+    """
+    Begin collecting commands into a new report and return it.
+    """
+
+    global _active
+    _active = Report(book)
+    return _active
+
+def stop():
+    """
+    Stop collecting and return the finished report (None if none was active).
+    """
+
+    global _active
+    report, _active = _active, None
+    return report
+
+def set_page(page):
+    """
+    Attribute the calling thread's following commands to page.
+    """
+
+    _local.page = page
+    return None
+
+def maxrss(usage):
+    """
+    Peak resident set size from a resource usage structure, in kilobytes.
+    """
+
+    # ru_maxrss is in bytes on OS X but in kilobytes elsewhere.
+    if sys.platform == 'darwin':
+        return usage.ru_maxrss // 1024
+    return usage.ru_maxrss
+
+def record(result):
+    """
+    Store a finished utils.CommandResult in the active report, if any.
+    """
+
+    report = _active
+    if report is None:
+        return None
+
+    page = getattr(_local, 'page', None)
+    if page is not None:
+        page = os.path.basename(page)
+
+    report.add(Record(os.path.basename(result.argv[0]), page, result.status, result.wall, result.user, result.system, result.maxrss))
+    return None
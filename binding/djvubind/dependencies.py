@@ -0,0 +1,262 @@
+#! /usr/bin/env python3
+
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc.
+"""
+Registry of the external tools used for binding.
+
+Every tool is looked up once: its path, version string and a few capability
+flags are resolved by resolve() and kept for the rest of the session.  The
+result is also stored on disk and reused by later runs for as long as PATH,
+the modification times of its directories and of the resolved binaries stay
+the same, so that starting Bindery does not run a dozen "--version" probes.
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+
+from . import utils
+
+# Tool -> arguments that make it print a version string.  None for tools
+# without a version option.
+TOOLS = {
+    'identify': ['-version'],
+    'convert': ['-version'],
+    'tesseract': ['--version'],
+    'cuneiform': None,
+    'cjb2': None,
+    'c44': None,
+    'cpaldjvu': None,
+    'csepdjvu': None,
+    'djvm': None,
+    'djvused': None,
+    'bzz': None,
+    'minidjvu': None,
+    'jbig2': ['--version'],
+    'pdfbeads': ['--version'],
+    'qpdf': ['--version']
+}
+
+_lock = threading.RLock()
+_key = None
+_tools = {}
+
+
+class Tool(object):
+    """
+    A resolved external tool.
+
+        Attributes:
+            * name (string): Command name.
+            * path (string): Absolute path of the executable, None if not installed.
+            * mtime (float): Modification time of the executable.
+            * version (string): First line of its version output, None if unknown.
+            * capabilities (dictionary): Feature flags, see capabilities().
+    """
+
+    def __init__(self, name, path=None, mtime=None, version=None, capabilities=None):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.version = version
+        self.capabilities = capabilities or {}
+
+    def version_tuple(self):
+        """
+        The leading numeric part of the version string, e.g. (3, 2), or ().
+        """
+
+        match = re.search(r'(\d+)\.(\d+)(?:\.(\d+))?', self.version or '')
+        if match is None:
+            return ()
+        return tuple(int(part) for part in match.groups() if part is not None)
+
+    def as_dict(self):
+        return {'name':self.name, 'path':self.path, 'mtime':self.mtime, 'version':self.version, 'capabilities':self.capabilities}
+
+
+def cache_file():
+    """
+    Location of the on-disk registry.
+    """
+
+    if sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'bindery', 'tools.json')
+
+def environment_key():
+    """
+    PATH together with the modification time of each of its directories.  A
+    directory's mtime changes when a program is installed into or removed from
+    it, which invalidates the registry.
+    """
+
+    directories = []
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        try:
+            directories.append([path, os.stat(path).st_mtime])
+        except OSError:
+            directories.append([path, None])
+    return directories
+
+def capabilities(tool):
+    """
+    Feature flags derived from the version of a tool.
+    """
+
+    version = tool.version_tuple()
+
+    if tool.name == 'tesseract':
+        # hOCR output appeared in 3.01, 3.00 renamed box files from .txt to .box,
+        # 3.03 accepts a file listing several images in place of an image.
+        return {'hocr':(version >= (3, 1)), 'box_extension':('.box' if (not version or version >= (3, 0)) else '.txt'),
+                'filelist':(version >= (3, 3))}
+    elif tool.name == 'cuneiform':
+        return {'hocr':True}
+    return {}
+
+def probe(name):
+    """
+    Resolve a single tool, running its version option if it has one.
+    """
+
+    path = utils.find_executable(name)
+    if path is None:
+        return Tool(name)
+
+    tool = Tool(name, path, os.stat(path).st_mtime)
+    arguments = TOOLS.get(name)
+
+    if arguments is not None:
+        try:
+            result = utils.run([path] + arguments, check=False, timeout=10)
+        except (OSError, ValueError):
+            result = None
+
+        if result is not None:
+            output = (result.stdout or b'') + b'\n' + (result.stderr or b'')
+            lines = [line.strip() for line in output.decode('utf8', 'replace').splitlines() if line.strip()]
+            if lines:
+                tool.version = lines[0]
+
+    tool.capabilities = capabilities(tool)
+    return tool
+
+def _load(key):
+    """
+    Tools from the on-disk registry, or {} if it is missing or stale.
+    """
+
+    try:
+        with open(cache_file()) as handle:
+            data = json.load(handle)
+    except (IOError, OSError, ValueError):
+        return {}
+
+    if data.get('key') != key:
+        return {}
+
+    tools = {}
+    for entry in data.get('tools', []):
+        tool = Tool(entry['name'], entry['path'], entry['mtime'], entry['version'])
+        # Derived from the version, so registries written before a flag was
+        # added still get it.
+        tool.capabilities = capabilities(tool)
+        if tool.path is not None:
+            try:
+                if os.stat(tool.path).st_mtime != tool.mtime:
+                    continue
+            except OSError:
+                continue
+        tools[tool.name] = tool
+    return tools
+
+def _save(key, tools):
+    filename = cache_file()
+
+    try:
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename + '.tmp', 'w') as handle:
+            json.dump({'key':key, 'tools':[tool.as_dict() for tool in tools.values()]}, handle, indent=2)
+        os.rename(filename + '.tmp', filename)
+    except (IOError, OSError):
+        pass
+    return None
+
+def _current():
+    """
+    The in-memory registry, emptied whenever PATH has changed.
+    """
+
+    global _key
+
+    key = os.environ.get('PATH', '')
+    if key != _key:
+        _key = key
+        _tools.clear()
+    return _tools
+
+def resolve(names=None, persistent=True):
+    """
+    Resolve the given tools (all known tools by default), reusing the on-disk
+    registry where it is still valid.  Returns a dictionary of Tool objects.
+    """
+
+    names = list(TOOLS) if names is None else list(names)
+
+    with _lock:
+        tools = _current()
+        missing = [name for name in names if name not in tools]
+
+        if missing and persistent:
+            key = environment_key()
+            for name, tool in _load(key).items():
+                tools.setdefault(name, tool)
+            missing = [name for name in names if name not in tools]
+
+            if missing:
+                for name in missing:
+                    tools[name] = probe(name)
+                _save(key, dict((name, tool) for name, tool in tools.items() if name in TOOLS))
+        else:
+            for name in missing:
+                tools[name] = probe(name)
+
+        return dict((name, tools[name]) for name in names)
+
+def get(name):
+    """
+    The Tool for name, resolving it on first use.  Tools that are not in TOOLS
+    are only located, not probed, and are not written to disk.
+    """
+
+    with _lock:
+        tools = _current()
+        if name not in tools:
+            if name in TOOLS:
+                return resolve([name])[name]
+            tools[name] = Tool(name, utils.find_executable(name))
+        return tools[name]
+
+def path(name):
+    return get(name).path
+
+def capability(name, flag, default=None):
+    return get(name).capabilities.get(flag, default)
@@ -23,11 +23,12 @@ import os
 import shutil
 import sys
 import re
+import struct
 import tempfile
 import time
 import subprocess
 
-from . import utils
+from . import accounting, imaging, tracing, utils
 
 
 class Encoder:
@@ -40,8 +41,30 @@ class Encoder:
 
         self.dep_check()
     
-    def progress(self):
+    def progress(self, rows=()):
+      # rows are the indices in book.pages of the pages just finished.
       pass
+
+    def scratch(self, name):
+        """
+        Path of a fixed-name intermediate file: inside the job's temporary
+        directory if it has one, the working directory otherwise.
+        """
+
+        return os.path.join(self.opts.get('temp_dir') or '', name)
+
+    def execute(self, cmd, capture=False, check=True):
+        """
+        Run an argument list, honouring the job's cancel token if there is one.
+        Returns captured stdout (capture=True) or the exit status.
+        """
+
+        result = utils.run(cmd, capture=capture, check=check, token=self.opts.get('cancel_token'))
+
+        if capture:
+            return result.stdout
+        else:
+            return result.status
     
     def _c44(self, infile, outfile, dpi):
         """
@@ -50,13 +73,13 @@ class Encoder:
 
         # Make sure that the image is in a format acceptable for c44
         extension = infile.split('.')[-1]
+        temp = self.scratch('temp.ppm')
         if extension not in ['pgm', 'ppm', 'jpg', 'jpeg']:
-            utils.execute('convert {0} {1}'.format(infile, 'temp.ppm'))
-            infile = 'temp.ppm'
+            imaging.convert(infile, temp, format='PPM')
+            infile = temp
 
         # Encode
-        cmd = 'c44 -dpi {0} {1} "{2}" "{3}"'.format(dpi, self.opts['c44_options'], infile, outfile)
-        utils.execute(cmd)
+        self.execute(['c44', '-dpi', dpi] + utils.split_options(self.opts['c44_options']) + [infile, outfile])
 
         # Check that the outfile has been created.
         if not os.path.isfile(outfile):
@@ -65,8 +88,8 @@ class Encoder:
             sys.exit(1)
 
         # Cleanup
-        if (infile == 'temp.ppm') and (os.path.isfile('temp.ppm')):
-            os.remove('temp.ppm')
+        if (infile == temp) and (os.path.isfile(temp)):
+            os.remove(temp)
 
         return None
 
@@ -74,7 +97,7 @@ class Encoder:
         """
         Encode files with cjb2.
         """
-        utils.execute('cjb2 -dpi {0} {1} "{2}" "{3}"'.format(dpi, self.opts['cjb2_options'], infile, outfile))
+        self.execute(['cjb2', '-dpi', dpi] + utils.split_options(self.opts['cjb2_options']) + [infile, outfile])
 
         # Check that the outfile has been created.
         if not os.path.isfile(outfile):
@@ -92,12 +115,13 @@ class Encoder:
         # Make sure that the image is in a format acceptable for cpaldjvu
         extension = infile.split('.')[-1]
         
+        temp = self.scratch('temp.ppm')
         if extension not in ['ppm']:
-            utils.execute('convert {0} {1}'.format(infile, 'temp.ppm'))
-            infile = 'temp.ppm'
+            imaging.convert(infile, temp, format='PPM')
+            infile = temp
 
         # Encode
-        utils.execute('cpaldjvu -dpi {0} {1} "{2}" "{3}"'.format(dpi, self.opts['cpaldjvu_options'], infile, outfile))
+        self.execute(['cpaldjvu', '-dpi', dpi] + utils.split_options(self.opts['cpaldjvu_options']) + [infile, outfile])
 
         # Check that the outfile has been created.
         if not os.path.isfile(outfile):
@@ -106,8 +130,8 @@ class Encoder:
             sys.exit(1)
 
         # Cleanup
-        if (infile == 'temp.ppm') and (os.path.isfile('temp.ppm')):
-            os.remove('temp.ppm')
+        if (infile == temp) and (os.path.isfile(temp)):
+            os.remove(temp)
 
         return None
 
@@ -116,33 +140,33 @@ class Encoder:
         Encode files with csepdjvu.
         """
         
-        temp_graphics1 = tempfile.NamedTemporaryFile(delete=False, suffix='.tif')
-        temp_graphics2 = tempfile.NamedTemporaryFile(delete=False, suffix='.ppm')
+        temp_graphics1 = tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False, suffix='.tif')
+        temp_graphics2 = tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False, suffix='.ppm')
         
         temp_graphics1.close()
         temp_graphics2.close()
         
-        temp_textual1 = tempfile.NamedTemporaryFile(delete=False, suffix='.tif')
-        temp_textual2 = tempfile.NamedTemporaryFile(delete=False, suffix='.rle')
+        temp_textual1 = tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False, suffix='.tif')
+        temp_textual2 = tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False, suffix='.rle')
         
         temp_textual1.close()
         temp_textual2.close()
         
         # Separate the bitonal text (scantailor's mixed mode) from everything else.
-        utils.execute('convert -opaque black "{0}" "{1}"'.format(infile, temp_graphics1.name))
-        utils.execute('convert +opaque black "{0}" "{1}"'.format(infile, temp_textual1.name))
+        self.execute(['convert', '-opaque', 'black', infile, temp_graphics1.name])
+        self.execute(['convert', '+opaque', 'black', infile, temp_textual1.name])
         
-        enc_bitonal_out = tempfile.NamedTemporaryFile(delete=False, suffix='.djvu')
+        enc_bitonal_out = tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False, suffix='.djvu')
         enc_bitonal_out.close()
         
         # Encode the bitonal image.
         self._cjb2(temp_textual1.name, enc_bitonal_out.name, dpi)
 
         # Encode with color with bitonal via csepdjvu
-        utils.execute('ddjvu -format=rle -v "{0}" "{1}"'.format(enc_bitonal_out.name, re.sub('\.tif$', '.rle', temp_textual2.name)))
-        utils.execute('convert "{0}" "{1}"'.format(temp_graphics1.name, temp_graphics2.name))
+        self.execute(['ddjvu', '-format=rle', '-v', enc_bitonal_out.name, re.sub('\.tif$', '.rle', temp_textual2.name)])
+        imaging.convert(temp_graphics1.name, temp_graphics2.name, format='PPM')
         
-        temp_merge = tempfile.NamedTemporaryFile(delete=False, suffix='.mix')
+        temp_merge = tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False, suffix='.mix')
         temp_merge.close()
         
         with open(temp_merge.name, 'wb') as mix:
@@ -157,15 +181,15 @@ class Encoder:
                     mix.write(buffer)
                     buffer = ppm.read(1024)
         
-        temp_final = tempfile.NamedTemporaryFile(delete=False)
+        temp_final = tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False)
         temp_final.close()
 
-        utils.execute('csepdjvu -d {0} {1} "{2}" "{3}"'.format(dpi, self.opts['csepdjvu_options'], temp_merge.name, temp_final.name))
+        self.execute(['csepdjvu', '-d', dpi] + utils.split_options(self.opts['csepdjvu_options']) + [temp_merge.name, temp_final.name])
 
         if not os.path.isfile(outfile):
             shutil.copy(temp_final.name, outfile)
         else:
-            utils.execute('djvm -i {0} "{1}"'.format(outfile, temp_final.name))
+            self.execute(['djvm', '-i', outfile, temp_final.name])
         
         for temp in [temp_graphics1, temp_graphics2, temp_textual1, temp_textual2, enc_bitonal_out, temp_merge, temp_final]:
           os.remove(temp.name)
@@ -181,19 +205,19 @@ class Encoder:
         """
 
         # Specify filenames that will be used.
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.djvu')
+        temp_file = tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False, suffix='.djvu')
         temp_file.close()
 
         # Minidjvu has to worry about the length of the command since all the filenames are
         # listed.
-        cmds = utils.split_cmd('minidjvu -d {0} {1}'.format(dpi, self.opts['minidjvu_options']), infiles, temp_file.name)
+        cmds = utils.split_cmd(['minidjvu', '-d', str(dpi)] + utils.split_options(self.opts['minidjvu_options']), infiles, [temp_file.name])
 
         # Execute each command, adding each result into a single, multipage djvu.
         for cmd in cmds:
-            utils.execute(cmd)
+            self.execute(cmd)
             self.djvu_insert(temp_file.name, outfile)
 
-        os.remove(tempfile.name)
+        os.remove(temp_file.name)
 
         return None
 
@@ -210,6 +234,10 @@ class Encoder:
             msg = 'err: encoder "{0}" is not installed.'.format(self.opts['color_encoder'])
             utils.error(msg)
             sys.exit(1)
+        if (self.opts.get('djvu_output') == 'indirect') and (not utils.is_executable('bzz')):
+            msg = 'err: "bzz" (part of djvulibre) is needed for indirect output but is not installed.'
+            utils.error(msg)
+            sys.exit(1)
 
         return None
 
@@ -221,39 +249,42 @@ class Encoder:
         if (not os.path.isfile(djvufile)):
             shutil.copy(infile, djvufile)
         elif page_num is None:
-            utils.execute('djvm -i "{0}" "{1}"'.format(djvufile, infile))
+            self.execute(['djvm', '-i', djvufile, infile])
         else:
-            utils.execute('djvm -i "{0}" "{1}" {2}'.format(djvufile, infile, int(page_num)))
+            self.execute(['djvm', '-i', djvufile, infile, int(page_num)])
 
-    def enc_book(self, book, outfile):
+    def _enc_bundled(self, book, outfile, temp_book):
         """
-        Encode pages, metadata, etc. contained within a organizer.Book() class.
+        Encode all pages and insert them into a single bundled djvu file.
         """
 
-        temp_book = tempfile.NamedTemporaryFile(delete=False, suffix='.djvu')
-        temp_book.close()
-
         # Encode bitonal images first, mainly because of minidjvu needing to do
         # them all at once.
         if self.opts['bitonal_encoder'] == 'minidjvu':
             bitonals = []
-            for page in book.pages:
+            rows = []
+            for row, page in enumerate(book.pages):
                 if page.bitonal:
                     bitonals.append(page.path)
+                    rows.append(row)
             if len(bitonals) > 0:
                 if self.opts['bitonal_encoder'] == 'minidjvu':
-                    self._minidjvu(bitonals, temp_book.name, book.dpi)
-                    self.djvu_insert(temp_book.name, outfile)
-                    utils.error('asd')
-                    os.remove(temp_book.name)
-                    self.progress()
+                    # One run for all of them; there is no single page to
+                    # put it down to.
+                    with tracing.span('encode pages', 'page', pages=len(bitonals)):
+                        self._minidjvu(bitonals, temp_book.name, book.dpi)
+                        self.djvu_insert(temp_book.name, outfile)
+                        os.remove(temp_book.name)
+                    self.progress(rows)
         elif self.opts['bitonal_encoder'] == 'cjb2':
-            for page in book.pages:
+            for number, page in enumerate(book.pages, 1):
                 if page.bitonal:
-                    self._cjb2(page.path, temp_book.name, page.dpi)
-                    self.djvu_insert(temp_book.name, outfile)
-                    os.remove(temp_book.name)
-                    self.progress()
+                    accounting.set_page(page.path)
+                    with tracing.span('encode page', 'page', page=number):
+                        self._cjb2(page.path, temp_book.name, page.dpi)
+                        self.djvu_insert(temp_book.name, outfile)
+                        os.remove(temp_book.name)
+                    self.progress([number - 1])
         else:
             for page in book.pages:
                 if not page.bitonal:
@@ -267,26 +298,32 @@ class Encoder:
             for page in book.pages:
                 if not page.bitonal:
                     page_number = book.pages.index(page) + 1
-                    self._csepdjvu(page.path, temp_book.name, page.dpi)
-                    self.djvu_insert(temp_book.name, outfile, page_number)
-                    os.remove(temp_book.name)
-                    self.progress()
+                    accounting.set_page(page.path)
+                    with tracing.span('encode page', 'page', page=page_number):
+                        self._csepdjvu(page.path, temp_book.name, page.dpi)
+                        self.djvu_insert(temp_book.name, outfile, page_number)
+                        os.remove(temp_book.name)
+                    self.progress([page_number - 1])
         elif self.opts['color_encoder'] == 'c44':
             for page in book.pages:
                 if not page.bitonal:
                     page_number = book.pages.index(page) + 1
-                    self._c44(page.path, temp_book.name, page.dpi)
-                    self.djvu_insert(temp_book.name, outfile, page_number)
-                    os.remove(temp_book.name)
-                    self.progress()
+                    accounting.set_page(page.path)
+                    with tracing.span('encode page', 'page', page=page_number):
+                        self._c44(page.path, temp_book.name, page.dpi)
+                        self.djvu_insert(temp_book.name, outfile, page_number)
+                        os.remove(temp_book.name)
+                    self.progress([page_number - 1])
         elif self.opts['color_encoder'] == 'cpaldjvu':
             for page in book.pages:
                 if not page.bitonal:
                     page_number = book.pages.index(page) + 1
-                    self._cpaldjvu(page.path, temp_book.name, page.dpi)
-                    self.djvu_insert(temp_book.name, outfile, page_number)
-                    os.remove(temp_book.name)
-                    self.progress()
+                    accounting.set_page(page.path)
+                    with tracing.span('encode page', 'page', page=page_number):
+                        self._cpaldjvu(page.path, temp_book.name, page.dpi)
+                        self.djvu_insert(temp_book.name, outfile, page_number)
+                        os.remove(temp_book.name)
+                    self.progress([page_number - 1])
         else:
             for page in book.pages:
                 if not page.bitonal:
@@ -295,51 +332,173 @@ class Encoder:
                     utils.error(msg)
                     break
 
-        # Add ocr data
-        if self.opts['ocr']:
-            for page in book.pages:
-                handle = open('ocr.txt', 'w', encoding="utf8")
-                handle.write(page.text)
-                handle.close()
-                page_number = book.pages.index(page) + 1
-                utils.simple_exec('djvused -e "select {0}; remove-txt; set-txt \'ocr.txt\'; save" "{1}"'.format(page_number, outfile))
-                os.remove('ocr.txt')
+        return None
+
+    def _enc_indirect(self, book, outfile):
+        """
+        Encode every page, and the covers, straight into component files of
+        their own next to outfile and write an indirect index once they all
+        exist, so that viewers can fetch pages on demand.  Nothing is bundled
+        along the way: djvm would turn the document into a bundled one.
+        """
+
+        directory, filename = os.path.split(os.path.abspath(outfile))
+        basename = os.path.splitext(filename)[0]
+
+        encoders = {'csepdjvu':self._csepdjvu, 'c44':self._c44, 'cpaldjvu':self._cpaldjvu}
+
+        # A page left out would put every later component out of step with
+        # the page numbers that OCR and titles are inserted by.
+        if (self.opts['color_encoder'] not in encoders) and (not all(page.bitonal for page in book.pages)):
+            msg = 'err: Invalid color encoder "{0}".'.format(self.opts['color_encoder'])
+            utils.error(msg)
+            sys.exit(1)
+
+        if self.opts['bitonal_encoder'] == 'minidjvu':
+            msg = 'wrn: minidjvu cannot produce single page components.  Bitonal pages will be encoded with cjb2.'
+            msg = utils.color(msg, 'red')
+            utils.error(msg)
+
+        def component(name):
+            path = os.path.join(directory, '{0}_{1}.djvu'.format(basename, name))
+            if os.path.isfile(path):
+                os.remove(path)
+            return path
+
+        components = []
 
-        # Insert front/back covers, metadata, and bookmarks
         if book.suppliments['cover_front'] is not None:
-            dpi = int(utils.execute('identify -ping -format %x "{0}"'.format(book.suppliments['cover_front']), capture=True).decode('ascii').split(' ')[0])
-            self._c44(book.suppliments['cover_front'], temp_book.name, dpi)
-            self.djvu_insert(temp_book.name, outfile, 1)
-            utils.execute('djvused -e "select 1; set-page-title cover; save" "{0}"'.format(outfile))
+            cover = book.suppliments['cover_front']
+            components.append(component('cover'))
+            self._c44(cover, components[-1], imaging.probe(cover)['dpi'])
+
+        for number, page in enumerate(book.pages, 1):
+            components.append(component('{0:04d}'.format(number)))
+
+            accounting.set_page(page.path)
+            with tracing.span('encode page', 'page', page=number):
+                if page.bitonal:
+                    self._cjb2(page.path, components[-1], page.dpi)
+                else:
+                    encoders[self.opts['color_encoder']](page.path, components[-1], page.dpi)
+
+            self.progress([number - 1])
+
         if book.suppliments['cover_back'] is not None:
-            dpi = int(utils.execute('identify -ping -format %x "{0}"'.format(book.suppliments['cover_back']), capture=True).decode('ascii').split(' ')[0])
-            self._c44(book.suppliments['cover_back'], temp_book.name, dpi)
-            self.djvu_insert(temp_book.name, outfile, -1)
-        if book.suppliments['metadata'] is not None:
-            utils.simple_exec('djvused -e "set-meta {0}; save" "{1}"'.format(book.suppliments['metadata'], outfile))
-        if book.suppliments['bookmarks'] is not None:
-            utils.simple_exec('djvused -e "set-outline {0}; save" "{1}"'.format(book.suppliments['bookmarks'], outfile))
-
-        script = ''
-        index = 1
-        if book.suppliments['cover_front'] is not None:
-            script += 'select '+str(index)+'; set-page-title "cover";\n'
-            index = index + 1
-        for page in book.pages:
-            if page.title is None:
-                index = index + 1
+            cover = book.suppliments['cover_back']
+            components.append(component('back'))
+            self._c44(cover, components[-1], imaging.probe(cover)['dpi'])
+
+        self.djvu_index(outfile, components)
+
+        return None
+
+    def djvu_index(self, outfile, components):
+        """
+        Write the index file of an indirect djvu document.  The component files
+        must be in the same directory as outfile.
+
+        The DIRM chunk holds a flag byte (version 1, not bundled), the number of
+        components and a BZZ compressed table of their sizes, flags and ids.
+        """
+
+        sizes = b''.join([struct.pack('>I', os.path.getsize(path))[1:] for path in components])
+        flags = b'\x01' * len(components)
+        ids = b''.join([os.path.basename(path).encode('utf8') + b'\x00' for path in components])
+
+        with tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False) as handle:
+            handle.write(sizes + flags + ids)
+
+        try:
+            self.execute(['bzz', '-e', handle.name, handle.name + '.bzz'])
+
+            with open(handle.name + '.bzz', 'rb') as bzz:
+                dirm = struct.pack('>BH', 1, len(components)) + bzz.read()
+        finally:
+            for path in [handle.name, handle.name + '.bzz']:
+                if os.path.isfile(path):
+                    os.remove(path)
+
+        chunk = b'DIRM' + struct.pack('>I', len(dirm)) + dirm
+        if len(dirm) % 2:
+            chunk = chunk + b'\x00'
+
+        with open(outfile, 'wb') as index:
+            index.write(b'AT&TFORM' + struct.pack('>I', len(chunk) + 4) + b'DJVM' + chunk)
+
+        return None
+
+    def enc_book(self, book, outfile):
+        """
+        Encode pages, metadata, etc. contained within a organizer.Book() class.
+        """
+
+        temp_book = tempfile.NamedTemporaryFile(dir=self.opts.get('temp_dir'), delete=False, suffix='.djvu')
+        temp_book.close()
+
+        indirect = (self.opts.get('djvu_output') == 'indirect')
+
+        with tracing.span('encode pages'):
+            if indirect:
+                self._enc_indirect(book, outfile)
             else:
-                script += 'select '+str(index)+'; set-page-title "'+str(page.title)+'";\n'
+                self._enc_bundled(book, outfile, temp_book)
+
+        # The indirect document already has its front cover in front of the
+        # pages; the bundled one only gets it below.
+        first = 2 if (indirect and book.suppliments['cover_front'] is not None) else 1
+
+        # Add ocr data
+        with tracing.span('ocr insertion'):
+            if self.opts['ocr']:
+                for page in book.pages:
+                    accounting.set_page(page.path)
+                    text = self.scratch('ocr.txt')
+                    handle = open(text, 'w', encoding="utf8")
+                    handle.write(page.text)
+                    handle.close()
+                    page_number = book.pages.index(page) + first
+                    self.execute(['djvused', '-e', "select {0}; remove-txt; set-txt '{1}'; save".format(page_number, text), outfile], check=False)
+                    os.remove(text)
+
+        # Insert front/back covers, metadata, and bookmarks
+        with tracing.span('supplements'):
+            if (book.suppliments['cover_front'] is not None) and (not indirect):
+                dpi = imaging.probe(book.suppliments['cover_front'])['dpi']
+                self._c44(book.suppliments['cover_front'], temp_book.name, dpi)
+                self.djvu_insert(temp_book.name, outfile, 1)
+                self.execute(['djvused', '-e', 'select 1; set-page-title cover; save', outfile])
+            if (book.suppliments['cover_back'] is not None) and (not indirect):
+                dpi = imaging.probe(book.suppliments['cover_back'])['dpi']
+                self._c44(book.suppliments['cover_back'], temp_book.name, dpi)
+                self.djvu_insert(temp_book.name, outfile, -1)
+            if book.suppliments['metadata'] is not None:
+                self.execute(['djvused', '-e', 'set-meta {0}; save'.format(book.suppliments['metadata']), outfile], check=False)
+            if book.suppliments['bookmarks'] is not None:
+                self.execute(['djvused', '-e', 'set-outline {0}; save'.format(book.suppliments['bookmarks']), outfile], check=False)
+
+        with tracing.span('titles'):
+            script = ''
+            index = 1
+            if book.suppliments['cover_front'] is not None:
+                script += 'select '+str(index)+'; set-page-title "cover";\n'
                 index = index + 1
-        if book.suppliments['cover_back'] is not None:
-            script += 'select '+str(index)+'; set-page-title "back cover";\n'
-        script += 'save'
-        with open('titles', 'w') as handle:
-            handle.write(script)
-        utils.simple_exec('djvused -f titles "{0}"'.format(outfile))
-        os.remove('titles')
+            for page in book.pages:
+                if page.title is None:
+                    index = index + 1
+                else:
+                    script += 'select '+str(index)+'; set-page-title "'+str(page.title)+'";\n'
+                    index = index + 1
+            if book.suppliments['cover_back'] is not None:
+                script += 'select '+str(index)+'; set-page-title "back cover";\n'
+            script += 'save'
+            titles = self.scratch('titles')
+            with open(titles, 'w') as handle:
+                handle.write(script)
+            self.execute(['djvused', '-f', titles, outfile], check=False)
+            os.remove(titles)
 
         if os.path.isfile(temp_book.name):
-            os.remove(temp_book)
+            os.remove(temp_book.name)
 
         return None
@@ -0,0 +1,204 @@
+#! /usr/bin/env python3
+
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc.
+"""
+Image probing and conversion through a pool of long-lived worker processes.
+
+Spawning identify/convert/mogrify costs a shell plus ImageMagick start-up for
+every call, which adds up to several of them per page.  When Pillow is
+available the jobs are sent over a pipe to a process pool that is started once
+and reused for the whole session.  Without Pillow every job falls back to a
+single ImageMagick invocation.
+"""
+
+import atexit
+import multiprocessing
+import os
+import threading
+
+from . import utils
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+_pool = None
+_lock = threading.Lock()
+_probes = {}
+
+
+def _probe(path):
+    """
+    Worker side of probe().  Runs inside a pool process.
+    """
+
+    image = Image.open(path)
+    width, height = image.size
+    dpi = int(round(image.info.get('dpi', (72, 72))[0])) or 72
+
+    if image.mode == '1':
+        bitonal, depth = True, 1
+    else:
+        colors = image.getcolors(2)
+        extremes = [(0, 0, 0), (255, 255, 255), 0, 255, (0, 0, 0, 255), (255, 255, 255, 255)]
+        bitonal = (colors is not None) and all(color in extremes for count, color in colors)
+        depth = 8
+
+    return {'width':width, 'height':height, 'dpi':dpi, 'bitonal':bitonal, 'depth':depth}
+
+def _convert(infile, outfile, mode, colors, format, quality):
+    """
+    Worker side of convert().  Runs inside a pool process.
+    """
+
+    image = Image.open(infile)
+    source_format = image.format
+
+    if colors == 2:
+        image = image.convert('1', dither=Image.NONE)
+    elif mode is not None:
+        image = image.convert(mode)
+
+    if format == 'PPM' and image.mode not in ['1', 'L', 'RGB']:
+        image = image.convert('RGB')
+    if format == 'JPEG' and image.mode not in ['L', 'RGB', 'CMYK']:
+        image = image.convert('RGB')
+
+    options = {}
+    if 'dpi' in image.info:
+        options['dpi'] = image.info['dpi']
+    if quality is not None:
+        options['quality'] = quality
+
+    image.save(outfile, format or source_format, **options)
+
+    return None
+
+def pool():
+    """
+    Returns the shared worker pool, starting it on first use.  Returns None
+    when Pillow is not installed.
+    """
+
+    global _pool
+
+    if Image is None:
+        return None
+
+    with _lock:
+        if _pool is None:
+            # Started from a worker thread of a process that already runs Qt
+            # and logging threads; a forked child could inherit a lock one
+            # of them was holding, so the workers are fresh interpreters.
+            _pool = multiprocessing.get_context('spawn').Pool(utils.cpu_count())
+            atexit.register(shutdown)
+
+    return _pool
+
+def shutdown():
+    """
+    Stop the worker processes.
+    """
+
+    global _pool
+
+    with _lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool = None
+
+    return None
+
+def probe(path):
+    """
+    Returns a dictionary with the width, height, dpi, bitonal state and depth of
+    an image.  Results are cached by path, size and modification time, so the
+    several questions asked about a page during analysis cost a single job.
+    """
+
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+
+    if key in _probes:
+        return _probes[key]
+
+    workers = pool()
+    info = None
+
+    if workers is not None:
+        try:
+            info = workers.apply(_probe, (path,))
+        except Exception:
+            info = None
+
+    if info is None:
+        output = utils.execute(['identify', '-format', '%w %h %x %z %[type]\\n', path], capture=True).decode('utf8')
+        fields = output.splitlines()[0].split()
+        info = {'width':int(fields[0]), 'height':int(fields[1]), 'dpi':int(float(fields[2])),
+                'depth':int(fields[-2]), 'bitonal':(fields[-1] == 'Bilevel')}
+
+    _probes[key] = info
+
+    return info
+
+def remember(path, info):
+    """
+    Seeds the probe cache with what an earlier session found out about an
+    image, so that probe() does not have to ask again while the file is
+    unchanged.
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    _probes[(path, stat.st_size, stat.st_mtime)] = dict(info)
+
+    return None
+
+def convert(infile, outfile, mode=None, colors=None, format=None, quality=None):
+    """
+    Convert an image.  mode is a Pillow mode ('L' for grayscale), colors=2
+    reduces to a bitonal image, format forces the output format ('PPM', 'JPEG',
+    ...) and quality applies to lossy formats.
+    """
+
+    workers = pool()
+
+    if workers is not None:
+        try:
+            return workers.apply(_convert, (infile, outfile, mode, colors, format, quality))
+        except Exception:
+            pass
+
+    arguments = []
+    if colors is not None:
+        arguments += ['-colors', int(colors)]
+    if mode == 'L':
+        arguments += ['-type', 'Grayscale']
+    elif mode == 'RGB':
+        arguments += ['-type', 'TrueColor']
+    if quality is not None:
+        arguments += ['-quality', int(quality)]
+
+    target = outfile
+    if format is not None:
+        target = '{0}:{1}'.format(format.lower(), outfile)
+
+    utils.execute(['convert', infile] + arguments + [target])
+
+    return None
@@ -18,18 +18,20 @@
 Perform OCR operations using various engines.
 """
 
+import abc
 import difflib
 import os
 import re
 import shutil
 import sys
+import tempfile
 
 try:
   from html.parser import HTMLParser
 except:
   from HTMLParser import HTMLParser
 
-from . import utils
+from . import dependencies, imaging, utils
 
 
 class BoundingBox(object):
@@ -229,23 +231,61 @@ class hocrParser(HTMLParser):
         return None
 
 
-class Cuneiform(object):
+class Engine(abc.ABC):
+    """
+    The interface of an OCR backend.  analyze() recognizes a single image,
+    analyze_batch() several; both return box data (see translate()).
+    Engines that can take many images in one run override analyze_batch() so
+    that the cost of starting the engine and loading its language data is
+    paid once per batch instead of once per page.
+
+        Attributes:
+            * batch_size (integer): The most pages analyze_batch() takes at once
+              to any advantage.  Callers choose how many to send up to this.
+    """
+
+    batch_size = 1
+
+    @abc.abstractmethod
+    def analyze(self, filename):
+        """
+        Performs OCR analysis on the image and returns its box data, or an
+        empty list when the engine fails on it.
+        """
+
+    def analyze_batch(self, filenames):
+        """
+        Performs OCR analysis on several images and returns their box data in
+        the same order.
+        """
+
+        return [self.analyze(filename) for filename in filenames]
+
+
+class Cuneiform(Engine):
     """
     Everything needed to work with the Cuneiform OCR engine.
     """
 
-    def __init__(self, options):
-        if not utils.is_executable('cuneiform'):
+    def __init__(self, options, token=None, tempdir=None):
+        if dependencies.path('cuneiform') is None:
             raise OSError('Cuneiform is either not installed or not in the configured path.')
 
         self.options = options
+        self.token = token
+        self.tempdir = tempdir
 
     def analyze(self, filename):
         """
         Performs OCR analysis on the image and returns a djvuPageBox object.
         """
 
-        status = utils.simple_exec('cuneiform -f hocr -o "{0}.hocr" {1} "{0}"'.format(filename, self.options))
+        if self.tempdir is None:
+            hocr = filename + '.hocr'
+        else:
+            hocr = os.path.join(self.tempdir, os.path.basename(filename) + '.hocr')
+
+        status = utils.simple_exec(['cuneiform', '-f', 'hocr', '-o', hocr] + utils.split_options(self.options) + [filename], token=self.token)
         if status != 0:
             if status == -6:
                 # Cuneiform seems to have a buffer flow on every other image, and even more without the --singlecolumn option.
@@ -261,7 +301,7 @@ class Cuneiform(object):
                 utils.error(msg)
             return []
 
-        with open('{0}.hocr'.format(filename), 'r', encoding='utf8') as handle:
+        with open(hocr, 'r', encoding='utf8') as handle:
             text = handle.read()
 
         # Clean up excess files.
@@ -270,14 +310,14 @@ class Cuneiform(object):
         basename = '.'.join(basename)
         if os.path.isdir(basename+'_files'):
             shutil.rmtree(basename+'_files')
-        os.remove(filename+'.hocr')
+        os.remove(hocr)
 
         parser = hocrParser()
         parser.parse(text)
 
         # Cuneiform hocr inverts the y-axis compared to what djvu expects.  The total height of the
         # image is needed to invert the values.
-        height = int(utils.execute('identify -format %H "{0}"'.format(filename), capture=True))
+        height = imaging.probe(filename)['height']
         for entry in parser.boxing:
             if entry not in ['space', 'newline']:
                 ymin, ymax = entry['ymin'], entry['ymax']
@@ -287,16 +327,23 @@ class Cuneiform(object):
         return parser.boxing
 
 
-class Tesseract(object):
+class Tesseract(Engine):
     """
     Everything needed to work with the Tesseract OCR engine.
     """
 
-    def __init__(self, options):
-        if not utils.is_executable('tesseract'):
+    def __init__(self, options, token=None, tempdir=None):
+        self.tool = dependencies.get('tesseract')
+        if self.tool.path is None:
             raise OSError('Tesseract is either not installed or not in the configured path.')
 
         self.options = options
+        self.token = token
+        self.tempdir = tempdir
+
+        # Versions that read a list of images do a whole batch in one run.
+        if self.tool.capabilities.get('filelist'):
+            self.batch_size = 64
 
     def _correct_boxfile(self, boxdata, text):
         """
@@ -389,41 +436,37 @@ class Tesseract(object):
 
         return boxdata
 
-    def analyze(self, filename):
+    def _run(self, source, output):
         """
-        Performs OCR analysis on the image and returns a djvuPageBox object.
+        Runs Tesseract twice over source, an image or a file listing images:
+        once for the character boxes and once for the text, which has the
+        spacing the boxes lack.  Returns the contents of both output files.
         """
 
-        basename = os.path.split(filename)[1].split('.')[0]
-        tesseractpath = utils.get_executable_path('tesseract')
-
-        utils.execute('{0} "{1}" "{2}_box" {3} batch makebox'.format(tesseractpath, filename, basename, self.options))
-        utils.execute('{0} "{1}" "{2}_txt" {3} batch'.format(tesseractpath, filename, basename, self.options))
+        options = utils.split_options(self.options)
+        utils.execute([self.tool.path, source, output + '_box'] + options + ['batch', 'makebox'], token=self.token)
+        utils.execute([self.tool.path, source, output + '_txt'] + options + ['batch'], token=self.token)
 
-        # tesseract-3.00 changed the .txt extension to .box so check which file was created.
-        if os.path.exists(basename + '_box.txt'):
-            boxfilename = basename + '_box.txt'
-        else:
-            boxfilename = basename + '_box.box'
+        # tesseract-3.00 changed the .txt extension to .box.
+        boxfilename = output + '_box' + self.tool.capabilities.get('box_extension', '.box')
+        if not os.path.exists(boxfilename):
+            boxfilename = output + '_box.txt'
 
         try:
             with open(boxfilename, 'r', encoding='utf8') as handle:
                 boxfile = handle.read()
-            with open(basename+'_txt.txt', 'r', encoding='utf8') as handle:
+            with open(output+'_txt.txt', 'r', encoding='utf8') as handle:
                 text = handle.read()
-        except:
-            msg = 'wrn: Could not read OCR data for {0} (probably a blank page). This page will have no OCR content.'.format(basename)
-            msg = utils.color(msg, 'red')
-            utils.error(msg)
-            os.remove(boxfilename)
-            os.remove(basename+'_txt.txt')
-            return []
+        finally:
+            for filename in [boxfilename, output+'_txt.txt']:
+                if os.path.exists(filename):
+                    os.remove(filename)
 
-        os.remove(boxfilename)
-        os.remove(basename+'_txt.txt')
+        return boxfile, text
 
+    def _parse_boxfile(self, lines):
         data = []
-        for line in boxfile.split('\n'):
+        for line in lines:
             if (line == ''):
                 continue
             line = line.split()
@@ -431,7 +474,18 @@ class Tesseract(object):
                 utils.error('err: ocr.boxfileParser.parse_box(): The format of the boxfile is not what was expected.')
                 sys.exit(1)
             data.append({'char':line[0], 'xmin':int(line[1]), 'ymin':int(line[2]), 'xmax':int(line[3]), 'ymax':int(line[4])})
-        boxfile = data
+        return data
+
+    def _merge(self, boxfile, text, filename):
+        """
+        Turns the box data and text of a page into djvubind's boxing
+        information.
+        """
+
+        # A page without boxes, a blank one in a batch say, has nothing to
+        # reconcile.
+        if (len(boxfile) == 0):
+            return []
 
         boxfile = self._correct_boxfile(boxfile, text)
         textfile = [text[x:x+1] for x in range(len(text))]
@@ -473,17 +527,72 @@ class Tesseract(object):
 
         return boxing
 
+    def analyze(self, filename):
+        """
+        Performs OCR analysis on the image and returns a djvuPageBox object.
+        """
+
+        basename = os.path.split(filename)[1].split('.')[0]
+
+        # Tesseract writes its output next to the given base name.
+        output = os.path.join(self.tempdir or '', basename)
 
-def engine(ocr_engine, options=''):
+        try:
+            boxfile, text = self._run(filename, output)
+        except (IOError, OSError, UnicodeError):
+            msg = 'wrn: Could not read OCR data for {0} (probably a blank page). This page will have no OCR content.'.format(basename)
+            msg = utils.color(msg, 'red')
+            utils.error(msg)
+            return []
+
+        return self._merge(self._parse_boxfile(boxfile.split('\n')), text, filename)
+
+    def analyze_batch(self, filenames):
+        """
+        Performs OCR analysis on several images in a single run of each
+        Tesseract pass.  Given a list of images, Tesseract numbers the pages in
+        the last column of the box file and ends the text of every page with a
+        form feed.
+        """
+
+        if (len(filenames) < 2) or (not self.tool.capabilities.get('filelist')):
+            return Engine.analyze_batch(self, filenames)
+
+        listing = tempfile.NamedTemporaryFile('w', dir=self.tempdir, suffix='.txt', delete=False, encoding='utf8')
+        with listing:
+            listing.write('\n'.join(filenames) + '\n')
+
+        try:
+            boxfile, text = self._run(listing.name, os.path.splitext(listing.name)[0])
+        except (IOError, OSError, ValueError):
+            # Some page stopped the run; each gets a run of its own instead.
+            return Engine.analyze_batch(self, filenames)
+        finally:
+            os.remove(listing.name)
+
+        pages = [[] for filename in filenames]
+        for line in boxfile.split('\n'):
+            fields = line.split()
+            if len(fields) == 6 and 0 <= int(fields[5]) < len(pages):
+                pages[int(fields[5])].append(line)
+
+        texts = text.split('\f')
+        if len(texts) < len(filenames):
+            return Engine.analyze_batch(self, filenames)
+
+        return [self._merge(self._parse_boxfile(lines), page_text, filename) for lines, page_text, filename in zip(pages, texts, filenames)]
+
+
+def engine(ocr_engine, options='', token=None, tempdir=None):
     """
     Provides an abstract factory to load the proper ocr engine class.  Any options
     would be the string equivalent to what could be used in a command line execution.
     """
 
     if ocr_engine == 'tesseract':
-        return Tesseract(options)
+        return Tesseract(options, token, tempdir)
     elif ocr_engine == 'cuneiform':
-        return Cuneiform(options)
+        return Cuneiform(options, token, tempdir)
     else:
         raise ValueError('The requested ocr engine ({0}) is not supported.'.format(ocr_engine))
 
@@ -520,3 +629,60 @@ def translate(boxing):
         return page.encode()
     else:
         return ''
+
+def unescape(char):
+    """
+    A character of box data as it appears on the page, without the escaping
+    added for djvused.
+    """
+
+    if (len(char) == 2) and (char[0] == '\\'):
+        return char[1]
+    return char
+
+def words(boxing):
+    """
+    Groups box data into words, the way translate() does, for formats other
+    than djvused.  Returns a list of (text, xmin, ymin, xmax, ymax) tuples in
+    image pixels with the origin at the bottom left.
+    """
+
+    result = []
+    word = djvuWordBox()
+
+    for entry in boxing + ['space']:
+        if entry in ['space', 'newline']:
+            if (word.children != []):
+                word.sanity_check()
+                result.append((''.join(unescape(char) for char in word.children), word.perimeter['xmin'], word.perimeter['ymin'], word.perimeter['xmax'], word.perimeter['ymax']))
+            word = djvuWordBox()
+        else:
+            word.add_character(entry)
+
+    return result
+
+def hocr(boxing, height):
+    """
+    Box data as a minimal hOCR document, one ocr_line per line and one
+    ocrx_word per word, for tools that read their text layer from hOCR.  hOCR
+    measures from the top of the image, so the page height is needed.
+    """
+
+    lines = [[]]
+    for entry in boxing:
+        if entry == 'newline':
+            lines.append([])
+        else:
+            lines[-1].append(entry)
+
+    body = []
+    for line in lines:
+        spans = []
+        for text, xmin, ymin, xmax, ymax in words(line):
+            text = text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            spans.append("<span class='ocrx_word' title='bbox {0} {1} {2} {3}'>{4}</span>".format(xmin, height - ymax, xmax, height - ymin, text))
+        if spans:
+            body.append("<span class='ocr_line'>{0}</span>".format(' '.join(spans)))
+
+    return ('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"/><meta name="ocr-capabilities" content="ocr_line ocrx_word"/></head>\n'
+            "<body><div class='ocr_page'>\n{0}\n</div></body>\n</html>\n").format('\n'.join(body))
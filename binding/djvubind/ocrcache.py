@@ -0,0 +1,262 @@
+#! /usr/bin/env python3
+
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc.
+"""
+On-disk cache of OCR results.
+
+OCR is by far the slowest step of a bind, and its result only depends on the
+image, the engine and the options it was run with.  Results are stored as box
+data (see ocr.translate()) under a key made of the image's content hash, the
+engine, the engine's version string and its options, so that binding the same
+scans again, to another format or with other encoder settings, skips the
+engine entirely.  The least recently used entries are removed once the cache
+grows past its size limit.
+
+The cache can be inspected and pruned from the command line:
+
+    python -m binding.djvubind.ocrcache --stats
+    python -m binding.djvubind.ocrcache --prune=100      # down to 100 MB
+    python -m binding.djvubind.ocrcache --clear
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from . import dependencies
+
+# Default size limit in bytes.
+LIMIT = 256 * 1024 * 1024
+
+_hashes = {}
+_lock = threading.Lock()
+
+
+def cache_dir():
+    """
+    Location of the cache, next to the tool registry.
+    """
+
+    return os.path.join(os.path.dirname(dependencies.cache_file()), 'ocr')
+
+def content_hash(path):
+    """
+    SHA-1 of an image's contents.  Remembered by path, size and modification
+    time, so that a file is read once per session.
+    """
+
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime)
+
+    with _lock:
+        if key in _hashes:
+            return _hashes[key]
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    with _lock:
+        _hashes[key] = digest.hexdigest()
+
+    return _hashes[key]
+
+def compact(boxing):
+    """
+    Box data as written to the cache: a space or a newline stays a one
+    character string, a character becomes [char, xmin, ymin, xmax, ymax].
+    """
+
+    data = []
+    for entry in boxing:
+        if entry == 'space':
+            data.append(' ')
+        elif entry == 'newline':
+            data.append('\n')
+        else:
+            data.append([entry['char'], entry['xmin'], entry['ymin'], entry['xmax'], entry['ymax']])
+    return data
+
+def expand(data):
+    """
+    The inverse of compact().
+    """
+
+    boxing = []
+    for entry in data:
+        if entry == ' ':
+            boxing.append('space')
+        elif entry == '\n':
+            boxing.append('newline')
+        else:
+            boxing.append({'char':entry[0], 'xmin':entry[1], 'ymin':entry[2], 'xmax':entry[3], 'ymax':entry[4]})
+    return boxing
+
+
+class OCRCache(object):
+    """
+    The cache directory.  Entries are single JSON files named after their key;
+    reading one touches it, which is what the eviction order goes by.
+
+        Attributes:
+            * directory (string): Where the entries are kept.
+            * limit (integer): Size in bytes above which entries are evicted.
+    """
+
+    def __init__(self, directory=None, limit=LIMIT):
+        self.directory = directory or cache_dir()
+        self.limit = limit
+        self.used = None
+        self.lock = threading.Lock()
+
+    def key(self, path, engine, options):
+        version = dependencies.get(engine).version
+        return hashlib.sha1(json.dumps([content_hash(path), engine, version, options]).encode('utf8')).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, path, engine, options):
+        """
+        The box data of an earlier run, or None.
+        """
+
+        try:
+            filename = self.filename(self.key(path, engine, options))
+            with open(filename, 'r', encoding='utf8') as handle:
+                entry = json.load(handle)
+            os.utime(filename, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        # Written by versions that also kept failed runs; the page is tried
+        # again.
+        if not entry.get('boxes'):
+            return None
+
+        return expand(entry['boxes'])
+
+    def put(self, path, engine, options, boxing):
+        """
+        Stores the box data of a page, evicting old entries if the cache has
+        grown too large.  A cache that cannot be written to is not an error.
+        Empty box data is not stored: the engines return it when they crash or
+        their output cannot be read, and such pages should be tried again.
+        """
+
+        if not boxing:
+            return None
+
+        try:
+            key = self.key(path, engine, options)
+        except OSError:
+            return None
+
+        filename = self.filename(key)
+        entry = {'engine':engine, 'version':dependencies.get(engine).version, 'options':options, 'boxes':compact(boxing)}
+
+        try:
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename + '.tmp', 'w', encoding='utf8') as handle:
+                json.dump(entry, handle, separators=(',', ':'))
+            size = os.path.getsize(filename + '.tmp')
+            os.replace(filename + '.tmp', filename)
+        except (IOError, OSError):
+            return None
+
+        with self.lock:
+            if self.used is None:
+                self.used = sum(entry[1] for entry in self.entries())
+            else:
+                self.used += size
+            over = self.used > self.limit
+
+        # Down to nine tenths of the limit, so that the next few pages do not
+        # each have to scan the directory again.
+        if over:
+            self.prune(self.limit * 9 // 10)
+
+        return None
+
+    def entries(self):
+        """
+        (modification time, size, filename) of every entry.
+        """
+
+        entries = []
+        for directory, folders, files in os.walk(self.directory):
+            for name in files:
+                filename = os.path.join(directory, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        return entries
+
+    def prune(self, limit=None):
+        """
+        Removes the least recently used entries until the cache takes at most
+        limit bytes.  Returns the number of entries removed.
+        """
+
+        limit = self.limit if limit is None else limit
+        entries = sorted(self.entries())
+        used = sum(entry[1] for entry in entries)
+        removed = 0
+
+        for mtime, size, filename in entries:
+            if used <= limit:
+                break
+            try:
+                os.remove(filename)
+            except OSError:
+                continue
+            used -= size
+            removed += 1
+
+        with self.lock:
+            self.used = used
+
+        return removed
+
+    def clear(self):
+        return self.prune(0)
+
+
+def main(arguments):
+    cache = OCRCache()
+
+    for argument in arguments:
+        if argument == '--stats':
+            entries = cache.entries()
+            sys.stdout.write('{0}: {1} pages, {2:.1f} MB\n'.format(cache.directory, len(entries), sum(entry[1] for entry in entries) / 1048576.0))
+        elif argument == '--prune' or argument.startswith('--prune='):
+            limit = int(float(argument.split('=', 1)[1]) * 1048576) if '=' in argument else cache.limit
+            sys.stdout.write('Removed {0} pages.\n'.format(cache.prune(limit)))
+        elif argument == '--clear':
+            sys.stdout.write('Removed {0} pages.\n'.format(cache.clear()))
+        else:
+            sys.stderr.write('Usage: ocrcache [--stats] [--prune[=MB]] [--clear]\n')
+            return 1
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:] or ['--stats']))
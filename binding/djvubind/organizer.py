@@ -20,7 +20,7 @@ Data structures to organize collect and abstract information.
 import os
 import sys
 
-from . import utils
+from . import imaging, utils
 
 class Book:
     """
@@ -76,8 +76,7 @@ class Page:
         Find the resolution of the image.
         """
 
-        dpi = utils.execute('identify -ping -format %x "{0}"'.format(self.path), capture=True).decode('ascii').split(' ')[0]
-        self.dpi = int(dpi)
+        self.dpi = imaging.probe(self.path)['dpi']
         return None
 
     def is_bitonal(self):
@@ -85,11 +84,12 @@ class Page:
         Check if the image is bitonal.
         """
         
-        if 'Bilevel' not in utils.execute('identify -ping "{0}"'.format(self.path), capture=True).decode('utf8'):
+        info = imaging.probe(self.path)
+        if not info['bitonal']:
             self.bitonal = False
         else:
-            if (utils.execute('identify -ping -format %z "{0}"'.format(self.path), capture=True).decode('utf8') != ('1' + os.linesep)):
+            if info['depth'] != 1:
                 print("msg: {0}: Bitonal image but with a depth greater than 1.  Modifying image depth.".format(os.path.split(self.path)[1]))
-                utils.execute('mogrify -colors 2 "{0}"'.format(self.path))
+                imaging.convert(self.path, self.path, colors=2)
             self.bitonal = True
         return None
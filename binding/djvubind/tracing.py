@@ -0,0 +1,130 @@
+#! /usr/bin/env python3
+
+#       This program is free software; you can redistribute it and/or modify
+#       it under the terms of the GNU General Public License as published by
+#       the Free Software Foundation; either version 3 of the License, or
+#       (at your option) any later version.
+#
+#       This program is distributed in the hope that it will be useful,
+#       but WITHOUT ANY WARRANTY; without even the implied warranty of
+#       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#       GNU General Public License for more details.
+#
+#       You should have received a copy of the GNU General Public License
+#       along with this program; if not, write to the Free Software
+#       Foundation, Inc.
+"""
+Lightweight span tracing with Chrome Trace Event export.
+
+    with tracing.span('ocr', page=path):
+        ...
+
+When tracing is disabled span() returns a shared do-nothing context manager,
+so instrumented code pays one global lookup and a function call.  The exported
+JSON can be opened in chrome://tracing or Perfetto.
+"""
+
+import json
+import os
+import threading
+import time
+
+_events = None
+_lock = threading.Lock()
+_threads = {}
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        complete(self.name, self.category, self.start, time.time(), **self.args)
+        return False
+
+
+def enable():
+    """
+    Start recording spans, discarding anything recorded earlier.
+    """
+
+    global _events
+    with _lock:
+        _events = []
+        _threads.clear()
+    return None
+
+def disable():
+    """
+    Stop recording spans.
+    """
+
+    global _events
+    with _lock:
+        _events = None
+    return None
+
+def is_enabled():
+    return _events is not None
+
+def span(name, category='stage', **args):
+    """
+    Context manager timing the enclosed block as one complete event.
+    """
+
+    if _events is None:
+        return _NULL
+    return _Span(name, category, args)
+
+def complete(name, category, start, end, **args):
+    """
+    Record an already finished block that ran from start to end (time.time()
+    values) on the calling thread.
+    """
+
+    if _events is None:
+        return None
+
+    thread = threading.current_thread()
+    event = {'name':name, 'cat':category, 'ph':'X', 'pid':os.getpid(), 'tid':thread.ident,
+             'ts':start * 1e6, 'dur':(end - start) * 1e6}
+    if args:
+        event['args'] = args
+
+    with _lock:
+        if _events is not None:
+            _events.append(event)
+            _threads[thread.ident] = thread.name
+    return None
+
+def export(filename):
+    """
+    Write the recorded spans as a Chrome Trace Event JSON file.
+    """
+
+    with _lock:
+        events = list(_events or [])
+        threads = dict(_threads)
+
+    for ident, name in threads.items():
+        events.append({'name':'thread_name', 'ph':'M', 'pid':os.getpid(), 'tid':ident, 'args':{'name':name}})
+
+    with open(filename, 'w') as handle:
+        json.dump({'traceEvents':events, 'displayTimeUnit':'ms'}, handle)
+    return None
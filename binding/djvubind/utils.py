@@ -17,15 +17,31 @@
 Common and simple functions that are used throughout everything else.
 """
 
+import logging
 import multiprocessing
 import os
+import re
+import shlex
+import signal
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+
+from . import accounting, tracing
+
+# Applications that want djvubind's messages attach a handler of their own;
+# without one they only go to stderr as before.
+logger = logging.getLogger('djvubind')
+logger.addHandler(logging.NullHandler())
 
 def error(message):
   sys.stderr.write(message + '\n')
 
+  text = re.sub('\033\\[[0-9;]*m', '', message).strip()
+  logger.log(logging.ERROR if text.startswith('err') else logging.WARNING, text)
+
 roman_numeral_map = (('m',  1000), ('cm', 900), ('d',  500),
                      ('cd', 400), ('c',  100), ('xc', 90),
                      ('ix', 9), ('v',  5), ('iv', 4), ('i',  1))
@@ -96,102 +112,310 @@ def replace_html_codes(text):
 
     return text
 
-def split_cmd(start, files, end=''):
+def split_cmd(start, files, end=None):
     """
     Rumor has it that Windows has a character limit of a little more than 32,000 for commands.[1]
     Linux seems to vary based on kernel settings and whatnot, but tends to be more in the millions.[2]
     Supposing the images are named 'page_0001.tif', we can hit the windows limit very quickly.  For the
     sake of being safe, we will split things up at the 32,000 mark.
 
+    start and end are argument lists; a list of complete argument lists is returned.
+
     [1] http://stackoverflow.com/questions/2381241/what-is-the-subprocess-popen-max-length-of-the-args-parameter
     [2] http://www.linuxjournal.com/article/6060
     """
 
-    cmds = []
-    start = start + ' '
-    end = ' ' + end
+    end = end or []
+    fixed = sum([len(arg) + 3 for arg in start + end])
 
-    buffer = start
-    while len(files) > 0:
-        if len(buffer) + len(files[0]) + len(end) + 3 < 32000:
-            buffer = buffer + ' "' + files.pop(0) + '"'
-        else:
-            buffer = buffer + end.rstrip()
-            cmds.append(buffer)
-            buffer = start
-    buffer = buffer + end.rstrip()
-    cmds.append(buffer)
+    cmds = []
+    buffer = []
+    length = fixed
+    for filename in files:
+        if (len(buffer) > 0) and (length + len(filename) + 3 >= 32000):
+            cmds.append(start + buffer + end)
+            buffer = []
+            length = fixed
+        buffer.append(filename)
+        length = length + len(filename) + 3
+    cmds.append(start + buffer + end)
 
     return cmds
 
 def separate_cmd(cmd):
     """
-    Convert a subprocess command string into a list, intelligently handling arguments
-    enclosed in single or double quotes.
-    """
-
-    cmd = list(cmd)
-    buffer = ''
-    out = []
-    switch = [False, '']
-
-    for x in range(len(cmd)):
-        char = cmd[x]
-        if char == ' ' and not switch[0]:
-            out.append(buffer)
-            buffer = ''
-        # Be wary of a single/double quote that is part of a filename and not part of an
-        # enclosing pair
-        elif (char == '"' or char == "'") and not switch[0]:
-            if (char in cmd[x+1:]) and (buffer == ''):
-                switch[0] = True
-                switch[1] = char
+    Convert a command string into an argument list, handling arguments enclosed
+    in single or double quotes the way a POSIX shell would.
+    """
+
+    return shlex.split(cmd)
+
+def split_options(options):
+    """
+    Split a user supplied option string (e.g. "-lossy -clean") into arguments.
+    """
+
+    if not options:
+        return []
+
+    return shlex.split(options)
+
+
+class Cancelled(Exception):
+    """
+    Raised when a command is started or running under a cancelled CancelToken.
+    """
+
+    pass
+
+
+def spawn(argv, **kwargs):
+    """
+    Start a command.  On POSIX it gets a process group of its own, so that kill()
+    also stops whatever the command started itself (ghostscript under convert,
+    the encoders under pdfbeads, ...).
+    """
+
+    if os.name == 'posix':
+        kwargs['start_new_session'] = True
+
+    return subprocess.Popen(argv, **kwargs)
+
+def kill(process):
+    """
+    Kill a process started by spawn(), together with its process group.
+    """
+
+    if process.returncode is not None:
+        return None
+
+    try:
+        if (os.name == 'posix') and (os.getpgid(process.pid) == process.pid):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        pass
+
+    return None
+
+
+class CancelToken(object):
+    """
+    A flag shared by everything working on one job.  Commands run with the token
+    are killed, with their process groups, as soon as it is cancelled, and no
+    new ones are started.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self.processes = set()
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            processes = list(self.processes)
+
+        for process in processes:
+            kill(process)
+
+        return None
+
+    def check(self):
+        """
+        Raise Cancelled if the token has been cancelled.
+        """
+
+        if self.cancelled:
+            raise Cancelled()
+
+        return None
+
+    def register(self, process):
+        with self.lock:
+            self.processes.add(process)
+            cancelled = self.cancelled
+
+        if cancelled:
+            kill(process)
+
+        return None
+
+    def unregister(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+        return None
+
+
+class CommandResult(object):
+    """
+    Outcome of a finished command.
+
+        Attributes:
+            * argv (list): The arguments the command was started with.
+            * status (int): Exit status, negative if killed by a signal.
+            * stdout, stderr (bytes): Captured output (stdout is None if not captured).
+            * wall (float): Elapsed seconds.
+            * user, system (float): CPU seconds used by the child (None where unavailable).
+            * maxrss (int): Peak resident set size of the child in kilobytes (None where unavailable).
+    """
+
+    def __init__(self, argv, status, stdout, stderr, wall, user=None, system=None, maxrss=None):
+        self.argv = argv
+        self.status = status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.wall = wall
+        self.user = user
+        self.system = system
+        self.maxrss = maxrss
+
+
+def _drain(stream, chunks):
+    for chunk in iter(lambda: stream.read(65536), b''):
+        chunks.append(chunk)
+    stream.close()
+
+def _wait(process, timeout, token):
+    """
+    Reap the child, collecting its resource usage where the platform allows.
+    Returns (status, rusage, killed), killing the child once timeout seconds
+    have passed.  A cancelled token kills its processes itself, so waiting
+    blocks rather than polls, and the child is reaped as soon as it exits.
+    """
+
+    expired = []
+    timer = None
+
+    if timeout is not None:
+        def expire():
+            expired.append(True)
+            kill(process)
+
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+
+    usage = None
+    try:
+        if hasattr(os, 'wait4'):
+            pid, status, usage = os.wait4(process.pid, 0)
+            if os.WIFSIGNALED(status):
+                process.returncode = -os.WTERMSIG(status)
             else:
-                buffer = buffer + char
-        elif char == switch[1] and switch[0]:
-            out.append(buffer)
-            buffer = ''
-            switch[0] = False
+                process.returncode = os.WEXITSTATUS(status)
         else:
-            buffer = buffer + char
-    out.append(buffer)
+            process.wait()
+    finally:
+        if timer is not None:
+            timer.cancel()
 
-    # Just in case there were multiple spaces.
-    while '' in out:
-        out.remove('')
+    killed = None
+    if (token is not None) and token.cancelled:
+        killed = 'cancelled'
+    elif expired:
+        killed = 'timeout'
 
-    return out
+    return process.returncode, usage, killed
 
-def simple_exec(cmd):
+def run(argv, capture=True, check=True, timeout=None, token=None, cwd=None):
+    """
+    Run a command from an argument list without a shell.  stdout (if captured)
+    and stderr are read on separate threads so that a chatty child can never
+    block on a full pipe.
+
+        Arguments:
+            * argv (list): Program and arguments.
+            * capture (bool): Keep stdout instead of discarding it.
+            * check (bool): Raise ValueError on a non-zero exit status.
+            * timeout (float): Seconds after which the command is killed.
+            * token (CancelToken): Kill the command when the token is cancelled.
+
+        Returns:
+            * CommandResult
+
+        Raises:
+            * Cancelled: The token was cancelled.
+            * ValueError: The command failed or timed out.
+    """
+
+    argv = [str(arg) for arg in argv]
+
+    if token is not None:
+        token.check()
+
+    start = time.time()
+    process = spawn(argv, cwd=cwd, stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+                    stderr=subprocess.PIPE)
+    if token is not None:
+        token.register(process)
+
+    stdout, stderr = [], []
+    readers = [threading.Thread(target=_drain, args=(process.stderr, stderr))]
+    if capture:
+        readers.append(threading.Thread(target=_drain, args=(process.stdout, stdout)))
+    for reader in readers:
+        reader.daemon = True
+        reader.start()
+
+    try:
+        status, usage, killed = _wait(process, timeout, token)
+        for reader in readers:
+            reader.join()
+    finally:
+        if token is not None:
+            token.unregister(process)
+
+    result = CommandResult(argv, status, b''.join(stdout) if capture else None, b''.join(stderr), time.time() - start)
+    if usage is not None:
+        result.user = usage.ru_utime
+        result.system = usage.ru_stime
+        result.maxrss = accounting.maxrss(usage)
+    accounting.record(result)
+    tracing.complete(os.path.basename(argv[0]), 'command', start, start + result.wall, status=status)
+
+    # Whatever the tool had to say ends up in the log; it only matters if the
+    # command failed.
+    if result.stderr.strip() and (killed is None):
+        logger.log(logging.DEBUG if status == 0 else logging.WARNING, '%s: %s', os.path.basename(argv[0]), result.stderr.decode('utf8', 'replace').strip())
+
+    if killed == 'cancelled':
+        raise Cancelled()
+    if killed == 'timeout':
+        raise ValueError('err: utils.run(): command timed out after {0} seconds.\ncmd = {1}'.format(timeout, ' '.join(argv)))
+    if check and (status != 0):
+        raise ValueError('err: utils.run(): command exited with bad status.\ncmd = {0}\nexit status = {1}\n{2}'.format(' '.join(argv), status, result.stderr.decode('utf8', 'replace').strip()))
+
+    return result
+
+def simple_exec(cmd, token=None):
     """
     Execute a simple command.  Any output disregarded and exit status is
     returned.
     """
 
-    with open(os.devnull, 'w') as void:
-        sub = subprocess.Popen(cmd, shell=False, stdout=void, stderr=void)
-        return int(sub.wait())
+    if not isinstance(cmd, list):
+        cmd = shlex.split(cmd)
 
-def execute(cmd, capture=False, shell=True):
+    return run(cmd, capture=False, check=False, token=token).status
+
+def execute(cmd, capture=False, token=None, timeout=None):
     """
     Execute a command line process.  Includes the option of capturing output,
-    and checks for successful execution.
+    and checks for successful execution.  cmd is an argument list; a string is
+    split like a shell would, but no shell is started.
     """
 
-    with open(os.devnull, 'w') as void:
-        if capture:
-            sub = subprocess.Popen(cmd, shell=shell, stdout=subprocess.PIPE, stderr=void)
-        else:
-            sub = subprocess.Popen(cmd, shell=shell, stdout=subprocess.PIPE, stderr=void)
-    status = sub.wait()
+    if not isinstance(cmd, list):
+        cmd = shlex.split(cmd)
 
-    # Exit if the command fails for any reason.
-    if status != 0:
-        raise ValueError('err: utils.execute(): command exited with bad status.\ncmd = {0}\nexit status = {1}'.format(cmd, status))
+    result = run(cmd, capture=capture, token=token, timeout=timeout)
 
     if capture:
-        text = sub.stdout.read()
-        return text
+        return result.stdout
     else:
         return None
 
@@ -238,6 +462,15 @@ def is_executable(command):
 def get_executable_path(command):
     """
     Checks if a given command is available and returns the path to the executable (if available).
+    Lookups are answered from the dependency registry, so PATH is only searched once per command.
+    """
+
+    from . import dependencies
+    return dependencies.path(command)
+
+def find_executable(command):
+    """
+    Searches PATH for a command and returns the path to the executable (if available).
     """
 
     # Add extension if on the windows platform.
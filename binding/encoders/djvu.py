@@ -12,16 +12,22 @@ class DjVuEncoder(QThread, encode.Encoder):
     
     self.opts = options
     
-    self.count = 0
     self.done = 0
   
-  def progress(self):
-    self.done += 1
-    self.sendProgress(100.0 * float(self.done) / len(self.book.pages))
+  def progress(self, rows=()):
+    # rows are the pages just finished: minidjvu does all bitonal pages in
+    # one go.
+    self.done += len(rows)
+    self.sendProgress(100.0 * float(self.done) / len(self.book.pages), rows)
+    
+    # Pages are the natural point to give up at when the bind is stopped.
+    if self.opts.get('cancel_token') is not None:
+      self.opts['cancel_token'].check()
 
-  def sendProgress(self, percent):
-    self.emit(SIGNAL('updateProgress(int, int)'), (percent * 0.50) + 50.0, self.count)
-    self.count += 1
+  def sendProgress(self, percent, rows=()):
+    # Carries the number of pages done as well as which pages they were,
+    # since pages are not encoded in book order.
+    self.emit(SIGNAL('updateProgress(int, int, PyQt_PyObject)'), (percent * 0.50) + 50.0, self.done, list(rows))
   
   def sendError(self, message):
     self.emit(SIGNAL('error(QString)'), message)
@@ -1,14 +1,16 @@
-import os, time, shutil, glob, sys, shlex, platform, struct
-from subprocess import Popen, PIPE, STDOUT
+import os, time, shutil, glob, sys, platform, struct, tempfile
+from subprocess import PIPE, STDOUT
 
 try:
-  from djvubind import organizer, utils
+  from djvubind import organizer, utils, imaging, accounting, tracing, ocr
 except:
-  from ..djvubind import organizer, utils
+  from ..djvubind import organizer, utils, imaging, accounting, tracing, ocr
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+from . import pdfwriter, progress
+
 class PDFEncoder(QThread):
   def __init__(self, options, parent = None):
     super(PDFEncoder, self).__init__(parent)
@@ -16,14 +18,25 @@ class PDFEncoder(QThread):
     self.done = 0
     self.total = 0
     
+    # Post-passes count as one more step so that 100% is only reached once
+    # the output file is really finished.
+    self.extra = 0
+    
     self.options = options
   
-  def progress(self, amount=1):
+  def progress(self, amount=1, rows=()):
+    # rows are the pages finished by this step, if any.
     self.done += amount
-    self.sendProgress(100.0 * float(self.done) / float(self.total))
+    self.sendProgress(100.0 * float(self.done) / float(self.total + self.extra), rows)
+    
+    if self.options.get('cancel_token') is not None:
+      self.options['cancel_token'].check()
 
-  def sendProgress(self, percent):
-    self.emit(SIGNAL('updateProgress(int, int)'), (percent * 0.50) + 50.0, int(self.done - 1))
+  def sendProgress(self, percent, rows=()):
+    # Carries the number of whole pages done, since pdfbeads reports pages in
+    # halves and linearizing comes on top of the pages, and which pages were
+    # finished.
+    self.emit(SIGNAL('updateProgress(int, int, PyQt_PyObject)'), (percent * 0.50) + 50.0, min(int(self.done), self.total), list(rows))
   
   def sendError(self, message):
     self.emit(SIGNAL('error(QString)'), message)
@@ -32,31 +45,199 @@ class PDFEncoder(QThread):
   def run(self):
     self.enc_book(self.book, self.options['output_file'])
   
+  def execute(self, command):
+    return utils.run(command, token=self.options.get('cancel_token'))
+  
   def _pdfbeads(self, command):
-    process = Popen(shlex.split(command), stdout=PIPE, stderr=STDOUT)
+    token = self.options.get('cancel_token')
+    started = time.time()
+    process = utils.spawn(command, stdout=PIPE, stderr=STDOUT)
     
-    count = 0
+    if token is not None:
+      token.register(process)
     
-    while True:
-      output = process.stdout.readline().decode()
-
-      if output == '' and process.poll() != None:
-        break
-
-      if output != '':
-        if output.strip().startswith('Prepared data for'):
-          self.progress(0.5)
+    reader = progress.StreamReader(process.stdout)
+    reader.start()
+    
+    log = progress.EventLog(self.options.get('event_log'), encoder='pdfbeads', output=self.options['output_file'])
+    
+    try:
+      for event in reader.events(progress.PdfbeadsParser()):
+        log.write(event)
+        self.emit(SIGNAL('encoderEvent(PyQt_PyObject)'), event)
         
-        if output.strip().startswith('Unable to open'):
+        # Each page is reported twice (prepared, then written); a page that
+        # cannot be opened is only reported once but still has to count.
+        if event.kind == progress.PREPARED:
           self.progress(0.5)
+        elif event.kind == progress.WRITTEN or (event.kind == progress.ERROR and event.page is not None):
+          self.progress(0.5, self._staged_row(event.page))
+    finally:
+      process.wait()
+      log.close()
+      
+      accounting.record(utils.CommandResult(command, process.returncode, None, b'', time.time() - started))
+      
+      if token is not None:
+        token.unregister(process)
+    
+    return process.returncode == 0
+  
+  def _encode_bitonal(self, pages, tempdir):
+    images = []
+    globals = None
+    
+    if not pages:
+      return images, globals
+    
+    if self.options['foreground_encoder'] == 'JBIG2' and utils.is_executable('jbig2'):
+      # Symbol mode with PDF-ready fragments: one shared dictionary for the
+      # chunk plus one generic region stream per page.
+      basename = os.path.join(tempdir, 'chunk')
+      
+      self.execute(['jbig2', '-s', '-p', '-T', self.options['binarization_threshold'], '-b', basename] + [page.path for page in pages])
+      
+      globals = basename + '.sym'
+      
+      for index, page in enumerate(pages):
+        images.append(pdfwriter.jbig2_image('{0}.{1:04d}'.format(basename, index), page.width, page.height))
+    else:
+      for index, page in enumerate(pages):
+        temp = os.path.join(tempdir, '{0}.tif'.format(index))
         
-        if output.strip().startswith('Processed'):
-          self.progress(0.5)
+        self.execute(['convert', page.path, '-monochrome', '-compress', 'Group4', '-define', 'tiff:rows-per-strip={0}'.format(page.height), temp])
+        images.append(pdfwriter.g4_image(temp))
+    
+    return images, globals
+  
+  def _encode_color(self, page, tempdir):
+    encoder = self.options['background_encoder']
+    
+    if encoder == 'JPEG':
+      temp = os.path.join(tempdir, 'page.jpg')
+      imaging.convert(page.path, temp, format='JPEG', quality=85)
+      
+      return pdfwriter.jpeg_image(temp)
+    elif encoder == 'JPEG2000':
+      temp = os.path.join(tempdir, 'page.jp2')
+      self.execute(['convert', page.path, '-quality', '40', temp])
+      
+      return pdfwriter.jpx_image(temp, page.width, page.height)
+    else:
+      temp = os.path.join(tempdir, 'page.pnm')
+      imaging.convert(page.path, temp, format='PPM')
+      
+      return pdfwriter.pnm_image(temp)
+  
+  def _native(self, book, outfile):
+    tempdir = tempfile.mkdtemp(prefix='bindery-', dir=self.options.get('temp_dir'))
+    writer = pdfwriter.PDFWriter(outfile)
+    
+    self.total = len(book.pages)
+    chunk_size = max(1, int(self.options['pages_per_dict']))
+    
+    try:
+      for start in range(0, len(book.pages), chunk_size):
+        chunk = book.pages[start:start + chunk_size]
+        images, globals = self._encode_bitonal([page for page in chunk if page.bitonal], tempdir)
+        
+        if globals is not None:
+          globals = writer.add_jbig2_globals(globals)
+        
+        for row, page in enumerate(chunk, start):
+          accounting.set_page(page.path)
+          
+          with tracing.span('encode page', 'page', page=os.path.basename(page.path)):
+            # OCR boxes become an invisible text layer over the image.
+            words = ocr.words(page.boxing) if getattr(page, 'boxing', None) else None
+            
+            if page.bitonal:
+              writer.add_page(images.pop(0), page.dpi, words=words, globals=globals)
+            else:
+              writer.add_page(self._encode_color(page, tempdir), page.dpi, words=words)
+          
+          self.progress(1, [row])
         
+        for filename in os.listdir(tempdir):
+          os.remove(os.path.join(tempdir, filename))
+      
+      writer.close({
+        'Title': self.options['title'],
+        'Author': self.options['author'],
+        'Subject': self.options['subject'],
+        'Keywords': self.options['keywords']
+      }, self.options['page_layout'].replace('(', '').replace(')', ''))
+    finally:
+      shutil.rmtree(tempdir, ignore_errors=True)
+    
+    return None
+  
+  def _linearize(self, outfile):
+    # Rewrites the finished file so the first page and the hint tables come
+    # first ("fast web view"), letting a reader display page one before the
+    # rest of the book has been downloaded.
+    if not utils.is_executable('qpdf'):
+      utils.error('wrn: qpdf is not installed, the PDF will not be linearized.')
+      return False
+    
+    temp = outfile + '.linearized'
+    
+    try:
+      self.execute(['qpdf', '--linearize', outfile, temp])
+    except ValueError:
+      # qpdf exits with status 3 when it succeeded with warnings.
+      if not os.path.isfile(temp):
+        raise
+    except utils.Cancelled:
+      if os.path.isfile(temp):
+        os.remove(temp)
+      
+      raise
+    
+    if not pdfwriter.is_linearized(temp):
+      os.remove(temp)
+      utils.error('wrn: qpdf did not produce a linearized file for "{0}".'.format(outfile))
+      return False
+    
+    shutil.move(temp, outfile)
+    
     return True
   
   def enc_book(self, book, outfile):
-    command = "pdfbeads "
+    self.extra = 1 if self.options.get('linearize') else 0
+    
+    with tracing.span('encode pages'):
+      if self.options.get('pdf_engine') == 'native':
+        self._native(book, outfile)
+      else:
+        self._enc_pdfbeads(book, outfile)
+    
+    if self.options.get('linearize'):
+      with tracing.span('linearize'):
+        self._linearize(outfile)
+      
+      self.progress()
+    
+    self.exit()
+    
+    return None
+  
+  def _staged_row(self, name):
+    # The page a staged file name stands for: _enc_pdfbeads puts the row in
+    # front of the name.
+    prefix = (name or '').split('_', 1)[0]
+    
+    return [int(prefix)] if prefix.isdigit() else []
+  
+  def _stage(self, source, target):
+    # Copies only where links are not available.
+    try:
+      os.symlink(os.path.abspath(source), target)
+    except (AttributeError, NotImplementedError, OSError):
+      shutil.copy(source, target)
+  
+  def _enc_pdfbeads(self, book, outfile):
+    command = ['pdfbeads']
     
     for option, parameter in [
       ('page_layout', '-P'),
@@ -66,31 +247,43 @@ class PDFEncoder(QThread):
       ('binarization_threshold', '-t'),
       ('max_indexed_colors', '-x'),
     ]:
-      command += ' {parameter} "{value}"'.format(
-        parameter=parameter,
-        value=self.options[option]
-      )
-    
-    command += ' -o "{}"'.format(outfile.replace(' ', '\\ '))
-    command += ' -M "{}"'.format(book.suppliments['metadata'])
+      command += [parameter, str(self.options[option])]
     
-    for page in book.pages:
-      command += ' "{}"'.format(page.path)
+    command += ['-o', outfile, '-M', book.suppliments['metadata']]
     
     self.total = len(book.pages)
-    self._pdfbeads(command)
     
-    for page in book.pages:
-      filepath, filename = os.path.split(page.path)
-      basename, extension = os.path.splitext(filename)
-      
-      jbig2 = os.path.join(filepath, basename + '.jbig2')
-      symfile = os.path.join(filepath, basename + '.sym')
-      
-      for path in [jbig2, symfile]:
-        if os.path.exists(path):
-          os.remove(path)
+    # pdfbeads reads the text layer from hOCR files named after the pages
+    # and leaves its JBIG2 files next to them, so it gets links to the pages
+    # in a directory of its own instead of the user's scans.
+    tempdir = tempfile.mkdtemp(prefix='bindery-', dir=self.options.get('temp_dir'))
     
-    self.exit()
+    try:
+      for number, page in enumerate(book.pages):
+        path = os.path.join(tempdir, '{0:05d}_{1}'.format(number, os.path.basename(page.path)))
+        
+        hocr = os.path.splitext(path)[0] + '.hocr'
+        
+        self._stage(page.path, path)
+        
+        # An hOCR file the user keeps next to a scan is still used when
+        # Bindery has no OCR of its own for the page.
+        if getattr(page, 'boxing', None):
+          with open(hocr, 'w', encoding='utf8') as handle:
+            handle.write(ocr.hocr(page.boxing, page.height))
+        elif os.path.isfile(os.path.splitext(page.path)[0] + '.hocr'):
+          self._stage(os.path.splitext(page.path)[0] + '.hocr', hocr)
+        
+        command.append(path)
+      
+      if not self._pdfbeads(command):
+        # Killed because the bind was stopped, or failed on its own; what it
+        # said has gone out as encoder events.
+        if self.options.get('cancel_token') is not None:
+          self.options['cancel_token'].check()
+        
+        raise ValueError('err: pdfbeads could not write "{0}".'.format(outfile))
+    finally:
+      shutil.rmtree(tempdir, ignore_errors=True)
     
     return None
@@ -0,0 +1,356 @@
+import time, zlib, struct, codecs, subprocess
+
+# A small PDF assembler. Objects are written to disk as soon as they are
+# produced and only their byte offsets are kept in memory, so the size of a
+# book is limited by the disk rather than by RAM.
+
+class Reference(object):
+  def __init__(self, number):
+    self.number = number
+
+  def __str__(self):
+    return '{0} 0 R'.format(self.number)
+
+class Name(object):
+  def __init__(self, name):
+    self.name = name
+
+  def __str__(self):
+    return '/' + self.name
+
+class Raw(object):
+  def __init__(self, value):
+    self.value = value
+
+  def __str__(self):
+    return self.value
+
+def pdf_string(text):
+  try:
+    data = text.encode('ascii')
+  except UnicodeError:
+    data = codecs.BOM_UTF16_BE + text.encode('utf-16-be')
+
+  return '<' + codecs.encode(data, 'hex').decode('ascii') + '>'
+
+def serialize(value):
+  if isinstance(value, bool):
+    return 'true' if value else 'false'
+  elif isinstance(value, int):
+    return str(value)
+  elif isinstance(value, float):
+    return '{0:.4f}'.format(value).rstrip('0').rstrip('.')
+  elif isinstance(value, dict):
+    return '<< ' + ' '.join('/{0} {1}'.format(key, serialize(item)) for key, item in value.items() if item is not None) + ' >>'
+  elif isinstance(value, (list, tuple)):
+    return '[' + ' '.join(serialize(item) for item in value) + ']'
+  elif isinstance(value, (Reference, Name, Raw)):
+    return str(value)
+  elif value is None:
+    return 'null'
+  else:
+    return pdf_string(value)
+
+def is_linearized(path):
+  # Asks qpdf to check the hint tables and offsets, not just that there is a
+  # linearization dictionary. qpdf exits with 0 for a file that is not
+  # linearized at all, so its verdict is read from the output.
+  try:
+    process = subprocess.Popen(['qpdf', '--check-linearization', path], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  except OSError:
+    return False
+
+  output = process.communicate()[0]
+
+  return process.returncode == 0 and b'no linearization errors' in output
+
+
+
+class PDFImage(object):
+  def __init__(self, width, height, data, filter=None, colorspace='DeviceGray', bits=8, parms=None, decode=None):
+    self.width = width
+    self.height = height
+    self.data = data
+    self.filter = filter
+    self.colorspace = colorspace
+    self.bits = bits
+    self.parms = parms
+    self.decode = decode
+    self.globals = None
+
+  def dictionary(self):
+    dictionary = {
+      'Type': Name('XObject'),
+      'Subtype': Name('Image'),
+      'Width': self.width,
+      'Height': self.height,
+      'BitsPerComponent': self.bits,
+      'Length': len(self.data)
+    }
+
+    # JPEG 2000 streams carry their own colour space.
+    if self.filter != 'JPXDecode':
+      dictionary['ColorSpace'] = Name(self.colorspace)
+
+    if self.filter:
+      dictionary['Filter'] = Name(self.filter)
+
+    parms = dict(self.parms or {})
+
+    if self.globals is not None:
+      parms['JBIG2Globals'] = self.globals
+
+    if parms:
+      dictionary['DecodeParms'] = parms
+
+    if self.decode:
+      dictionary['Decode'] = self.decode
+
+    return dictionary
+
+def jpeg_image(path):
+  with open(path, 'rb') as handle:
+    data = handle.read()
+
+  # Walk the marker segments until a start-of-frame header turns up.
+  position = 2
+
+  while position + 4 <= len(data) and data[position] == 0xFF:
+    marker = data[position + 1]
+    length, = struct.unpack('>H', data[position + 2:position + 4])
+
+    if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+      bits, height, width, components = struct.unpack('>BHHB', data[position + 4:position + 10])
+      colorspace = {1: 'DeviceGray', 3: 'DeviceRGB', 4: 'DeviceCMYK'}[components]
+
+      return PDFImage(width, height, data, 'DCTDecode', colorspace, bits)
+
+    position += 2 + length
+
+  raise ValueError('err: pdfwriter.jpeg_image(): "{0}" has no frame header.'.format(path))
+
+def jpx_image(path, width, height):
+  with open(path, 'rb') as handle:
+    return PDFImage(width, height, handle.read(), 'JPXDecode')
+
+def g4_image(path):
+  # Reads a single-strip, Group 4 compressed TIFF as written by
+  # `convert -compress Group4 -define tiff:rows-per-strip=<height>`.
+  with open(path, 'rb') as handle:
+    data = handle.read()
+
+  order = '<' if data[:2] == b'II' else '>'
+  offset, = struct.unpack(order + 'I', data[4:8])
+  count, = struct.unpack(order + 'H', data[offset:offset + 2])
+
+  tags = {}
+
+  for index in range(count):
+    entry = data[offset + 2 + index * 12:offset + 14 + index * 12]
+    tag, kind, number = struct.unpack(order + 'HHI', entry[:8])
+
+    if kind == 3 and number == 1:
+      value, = struct.unpack(order + 'H', entry[8:10])
+    else:
+      value, = struct.unpack(order + 'I', entry[8:12])
+
+    tags[tag] = (kind, number, value)
+
+  width = tags[256][2]
+  height = tags[257][2]
+
+  if tags.get(259, (0, 0, 1))[2] != 4:
+    raise ValueError('err: pdfwriter.g4_image(): "{0}" is not Group 4 compressed.'.format(path))
+
+  if tags[273][1] != 1:
+    raise ValueError('err: pdfwriter.g4_image(): "{0}" has more than one strip.'.format(path))
+
+  start, length = tags[273][2], tags[279][2]
+  black_is_1 = tags.get(262, (0, 0, 0))[2] == 1
+
+  return PDFImage(width, height, data[start:start + length], 'CCITTFaxDecode', bits=1, parms={
+    'K': -1,
+    'Columns': width,
+    'Rows': height,
+    'BlackIs1': black_is_1
+  })
+
+def jbig2_image(path, width, height):
+  with open(path, 'rb') as handle:
+    return PDFImage(width, height, handle.read(), 'JBIG2Decode', bits=1)
+
+def pnm_image(path):
+  with open(path, 'rb') as handle:
+    data = handle.read()
+
+  fields = []
+  position = 0
+
+  # Magic number, width, height and maxval, separated by whitespace and comments.
+  while len(fields) < 4:
+    while data[position:position + 1].isspace():
+      position += 1
+
+    if data[position:position + 1] == b'#':
+      position = data.index(b'\n', position) + 1
+      continue
+
+    end = position
+
+    while not data[end:end + 1].isspace():
+      end += 1
+
+    fields.append(data[position:end])
+    position = end
+
+  magic, width, height, maxval = fields[0], int(fields[1]), int(fields[2]), int(fields[3])
+
+  if magic not in (b'P5', b'P6') or maxval > 255:
+    raise ValueError('err: pdfwriter.pnm_image(): "{0}" is not an 8-bit binary PNM.'.format(path))
+
+  return PDFImage(width, height, zlib.compress(data[position + 1:], 6), 'FlateDecode', 'DeviceGray' if magic == b'P5' else 'DeviceRGB')
+
+
+
+class PDFWriter(object):
+  def __init__(self, path, version='1.5'):
+    self.handle = open(path, 'wb')
+    self.offsets = {}
+    self.count = 0
+    self.kids = []
+
+    self.write('%PDF-{0}\n%\xe2\xe3\xcf\xd3\n'.format(version).encode('latin-1'))
+
+    self.pages = self.reserve()
+    self.font = None
+
+  def write(self, data):
+    self.handle.write(data)
+
+  def reserve(self):
+    self.count += 1
+
+    return Reference(self.count)
+
+  def write_object(self, reference, value):
+    self.offsets[reference.number] = self.handle.tell()
+    self.write('{0} 0 obj\n{1}\nendobj\n'.format(reference.number, serialize(value)).encode('latin-1'))
+
+    return reference
+
+  def write_stream(self, reference, dictionary, data):
+    dictionary['Length'] = len(data)
+
+    self.offsets[reference.number] = self.handle.tell()
+    self.write('{0} 0 obj\n{1}\nstream\n'.format(reference.number, serialize(dictionary)).encode('latin-1'))
+    self.write(data)
+    self.write(b'\nendstream\nendobj\n')
+
+    return reference
+
+  def add_object(self, value):
+    return self.write_object(self.reserve(), value)
+
+  def add_stream(self, dictionary, data):
+    return self.write_stream(self.reserve(), dictionary, data)
+
+  def add_jbig2_globals(self, path):
+    with open(path, 'rb') as handle:
+      return self.add_stream({}, handle.read())
+
+  def text_layer(self, words, scale):
+    # Invisible (render mode 3) Helvetica text, one run per word, stretched
+    # horizontally so that it covers the word's bounding box.
+    if self.font is None:
+      self.font = self.add_object({
+        'Type': Name('Font'),
+        'Subtype': Name('Type1'),
+        'BaseFont': Name('Helvetica'),
+        'Encoding': Name('WinAnsiEncoding')
+      })
+
+    operations = ['BT', '3 Tr']
+
+    for text, xmin, ymin, xmax, ymax in words:
+      size = max(1.0, (ymax - ymin) * scale)
+      width = max(1.0, (xmax - xmin) * scale)
+      stretch = 100.0 * width / (0.5 * size * max(1, len(text)))
+
+      data = text.encode('cp1252', 'replace')
+
+      operations.append('/F1 {0} Tf {1} Tz 1 0 0 1 {2} {3} Tm <{4}> Tj'.format(
+        serialize(size),
+        serialize(stretch),
+        serialize(xmin * scale),
+        serialize(ymin * scale),
+        codecs.encode(data, 'hex').decode('ascii')
+      ))
+
+    operations.append('ET')
+
+    return '\n'.join(operations)
+
+  def add_page(self, image, dpi, words=None, globals=None):
+    scale = 72.0 / float(dpi or 72)
+    width = image.width * scale
+    height = image.height * scale
+
+    image.globals = globals
+    xobject = self.write_stream(self.reserve(), image.dictionary(), image.data)
+
+    operations = ['q {0} 0 0 {1} 0 0 cm /Im0 Do Q'.format(serialize(width), serialize(height))]
+    resources = {'XObject': {'Im0': xobject}}
+
+    if words:
+      operations.append(self.text_layer(words, scale))
+      resources['Font'] = {'F1': self.font}
+
+    contents = '\n'.join(operations).encode('latin-1')
+    contents = self.add_stream({'Filter': Name('FlateDecode')}, zlib.compress(contents))
+
+    self.kids.append(self.add_object({
+      'Type': Name('Page'),
+      'Parent': self.pages,
+      'MediaBox': [0, 0, width, height],
+      'Resources': resources,
+      'Contents': contents
+    }))
+
+    return self.kids[-1]
+
+  def close(self, info=None, layout=None):
+    self.write_object(self.pages, {
+      'Type': Name('Pages'),
+      'Kids': self.kids,
+      'Count': len(self.kids)
+    })
+
+    catalog = self.add_object({
+      'Type': Name('Catalog'),
+      'Pages': self.pages,
+      'PageLayout': Name(layout) if layout else None
+    })
+
+    info = dict((key, value) for key, value in (info or {}).items() if value)
+    info['Producer'] = 'Bindery'
+    info['CreationDate'] = time.strftime('D:%Y%m%d%H%M%S')
+    info = self.add_object(info)
+
+    # Cross-reference table. Reserved numbers that were never written are
+    # listed as free entries.
+    start = self.handle.tell()
+    self.write('xref\n0 {0}\n0000000000 65535 f \n'.format(self.count + 1).encode('latin-1'))
+
+    for number in range(1, self.count + 1):
+      if number in self.offsets:
+        self.write('{0:010d} 00000 n \n'.format(self.offsets[number]).encode('latin-1'))
+      else:
+        self.write(b'0000000000 00000 f \n')
+
+    self.write('trailer\n{0}\nstartxref\n{1}\n%%EOF\n'.format(serialize({
+      'Size': self.count + 1,
+      'Root': catalog,
+      'Info': info
+    }), start).encode('latin-1'))
+
+    self.handle.close()
@@ -0,0 +1,137 @@
+import os, time, json, threading
+
+try:
+  from queue import Queue
+except ImportError:
+  from Queue import Queue
+
+PREPARED = 'prepared'
+WRITTEN = 'written'
+WARNING = 'warning'
+ERROR = 'error'
+OUTPUT = 'output'
+
+class ProgressEvent(object):
+  def __init__(self, kind, page=None, message='', timestamp=None, duration=None):
+    self.kind = kind
+    self.page = page
+    self.message = message
+    self.timestamp = time.time() if timestamp is None else timestamp
+    self.duration = duration
+
+  def as_dict(self):
+    return {
+      'kind': self.kind,
+      'page': self.page,
+      'message': self.message,
+      'timestamp': self.timestamp,
+      'duration': self.duration
+    }
+
+  def __repr__(self):
+    return 'ProgressEvent({0!r}, {1!r})'.format(self.kind, self.page)
+
+
+
+class PdfbeadsParser(object):
+  # Maps pdfbeads' human-readable status lines onto typed events and keeps
+  # track of when each page was prepared so that its total time can be
+  # reported once it has been written.
+  prefixes = [
+    ('Prepared data for', PREPARED),
+    ('Processed', WRITTEN),
+    ('Unable to open', ERROR),
+    ('Warning', WARNING),
+    ('WARNING', WARNING),
+    ('Error', ERROR),
+    ('ERROR', ERROR)
+  ]
+
+  def __init__(self):
+    self.started = {}
+
+  def page_from(self, line, prefix):
+    remainder = line[len(prefix):].strip()
+
+    for word in ['processing', 'data for']:
+      if remainder.startswith(word):
+        remainder = remainder[len(word):].strip()
+
+    return os.path.basename(remainder.rstrip('.').strip('"\'')) or None
+
+  def parse(self, line, timestamp=None):
+    line = line.strip()
+
+    if not line:
+      return None
+
+    for prefix, kind in self.prefixes:
+      if line.startswith(prefix):
+        page = self.page_from(line, prefix) if kind in (PREPARED, WRITTEN) or prefix == 'Unable to open' else None
+        event = ProgressEvent(kind, page, line, timestamp)
+
+        if kind == PREPARED:
+          self.started[page] = event.timestamp
+        elif kind == WRITTEN and page in self.started:
+          event.duration = event.timestamp - self.started.pop(page)
+
+        return event
+
+    return ProgressEvent(OUTPUT, None, line, timestamp)
+
+
+
+class StreamReader(threading.Thread):
+  # Drains a pipe on its own thread so that the consumer never blocks on
+  # readline() and the child never stalls on a full pipe buffer.
+  def __init__(self, stream):
+    super(StreamReader, self).__init__()
+
+    self.daemon = True
+    self.stream = stream
+    self.lines = Queue()
+
+  def run(self):
+    # The end is always marked, even if reading fails, since events() waits
+    # for it.
+    try:
+      for line in iter(self.stream.readline, b''):
+        self.lines.put((time.time(), line.decode('utf8', 'replace')))
+    finally:
+      self.lines.put(None)
+
+  def events(self, parser):
+    # Sleeps until a line arrives rather than polling the queue.
+    while True:
+      item = self.lines.get()
+
+      if item is None:
+        return
+
+      event = parser.parse(item[1], item[0])
+
+      if event is not None:
+        yield event
+
+
+
+class EventLog(object):
+  # Appends one JSON object per event, suitable for feeding dashboards.
+  def __init__(self, path, **context):
+    self.handle = open(path, 'a') if path else None
+    self.context = context
+
+  def write(self, event):
+    if self.handle is None:
+      return
+
+    record = dict(self.context)
+    record.update(event.as_dict())
+
+    self.handle.write(json.dumps(record) + '\n')
+    self.handle.flush()
+
+  def close(self):
+    if self.handle is not None:
+      self.handle.close()
+      self.handle = None
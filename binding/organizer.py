@@ -1,5 +1,5 @@
 import os, tempfile
-from djvubind import utils, organizer
+from djvubind import utils, organizer, imaging
 
 class Book(organizer.Book):
   def __init__(self):
@@ -22,6 +22,11 @@ class Page(organizer.Page):
     
     self.temporary = False
     self.grayscale = False
+    
+    # OCR box data (see djvubind.ocr.translate()), and that of an earlier
+    # bind, which is used instead of running the engine again.
+    self.boxing = None
+    self.cached_boxing = None
   
   def delete(self):
     if not self.temporary:
@@ -30,19 +35,22 @@ class Page(organizer.Page):
     return os.remove(self.path)
   
   def get_size(self):
-    self.width, self.height = map(int, utils.execute('identify -ping -format %wx%h "{0}"'.format(self.path), capture=True).decode('ascii').split('x'))
+    info = imaging.probe(self.path)
+    self.width, self.height = info['width'], info['height']
     
     return self.width, self.height
 
-  def is_bitonal(self):
-    if utils.execute('identify -ping "{0}"'.format(self.path), capture=True).decode('utf8').find('Bilevel') == -1:
+  def is_bitonal(self, tempdir=None):
+    info = imaging.probe(self.path)
+    
+    if not info['bitonal']:
       self.bitonal = False
     else:
-      if utils.execute('identify -ping -format %z "{0}"'.format(self.path), capture=True).decode('utf8') != '1' + os.linesep:
-        temp = tempfile.NamedTemporaryFile(delete=False)
+      if info['depth'] != 1:
+        temp = tempfile.NamedTemporaryFile(dir=tempdir, delete=False, suffix='.tif')
         temp.close()
         
-        utils.execute('convert "{0}" -colors 2 "{1}"'.format(self.path, temp.name))
+        imaging.convert(self.path, temp.name, colors=2, format='TIFF')
         self.temporary = True
         self.path = temp.name
       
@@ -0,0 +1,191 @@
+import os, time, tempfile
+
+import djvubind.ocr
+from djvubind import accounting, imaging, ocrcache, tracing
+
+from . import organizer
+
+from .encoders.djvu import DjVuEncoder
+from .encoders.pdf import PDFEncoder
+
+class Pipeline(object):
+  # The headless part of a bind: analysis, OCR and encoding of one book, with
+  # every intermediate file made in the job's temporary directory. The Binder
+  # runs it on its thread and shows it in the GUI through the hooks at the
+  # end; the benchmarks run it as it is. Stops with utils.Cancelled once the
+  # token is cancelled.
+
+  # Seconds an OCR batch should take.
+  ocr_batch_time = 10.0
+
+  def prepare(self, pages, options, tempdir, token, ocr_cache=None):
+    self.pages = pages
+    self.options = options
+    self.book = organizer.Book()
+    self.tempdir = tempdir
+
+    # Shared by the OCR engine and the encoders so that stopping a bind also
+    # kills whatever external tool is running at the time.
+    self.token = token
+    self.options['cancel_token'] = token
+    self.options['temp_dir'] = tempdir
+
+    if self.options['output_format'] == 'djvu':
+      self.enc = DjVuEncoder(self.options)
+    elif self.options['output_format'] == 'pdf':
+      self.enc = PDFEncoder(self.options)
+
+    if self.options['ocr']:
+      if self.options['ocr_engine'] == 'tesseract':
+        self.ocr = djvubind.ocr.Tesseract(self.options['tesseract_options'], self.token, self.tempdir)
+      elif self.options['ocr_engine'] == 'cuneiform':
+        self.ocr = djvubind.ocr.Cuneiform(self.options['cuneiform_options'], self.token, self.tempdir)
+    else:
+      self.ocr = False
+
+    # Results outlive the job, so that binding the same scans again, to
+    # either format, does not run the engine.
+    self.ocr_cache = ocrcache.OCRCache() if ocr_cache is None else ocr_cache
+
+  def bind(self):
+    self.book.pages = self.pages[:]
+
+    with tracing.span('analyze'):
+      self.analyze()
+
+    self.book.get_dpi()
+
+    with tracing.span('metadata'):
+      self.write_metadata()
+
+    if self.options['ocr']:
+      with tracing.span('ocr'):
+        self.get_ocr()
+
+      self.ocr_finished()
+
+    self.token.check()
+
+    self.stage('Binding the book', len(self.book.pages), 50, 50)
+
+    self.enc.book = self.book
+    self.enc.run()
+
+    self.token.check()
+
+  def analyze(self):
+    queue = self.book.pages[:]
+
+    self.stage('Analyzing', len(queue), 0, 25 + 25 * (not self.options['ocr']))
+
+    while queue:
+      self.token.check()
+
+      page = queue.pop()
+      accounting.set_page(page.path)
+
+      with tracing.span('analyze page', 'page', page=os.path.basename(page.path)):
+        page.is_bitonal(self.tempdir)
+        page.get_dpi()
+        page.get_size()
+
+        if page.grayscale and not page.bitonal:
+          grayscale = os.path.join(self.tempdir, '{0}.grayscale.tif'.format(len(queue)))
+          imaging.convert(page.path, grayscale, mode='L', format='TIFF')
+          page.path = grayscale
+
+      self.analyzed(len(queue))
+
+    return None
+
+  def write_metadata(self):
+    metadata = tempfile.NamedTemporaryFile(dir=self.tempdir, delete=False)
+
+    for prop in ['Title', 'Author', 'Subject', 'Keywords']:
+      metadata.write('{prop}{sep} "{value}"\n'.format(
+        prop=prop,
+        sep=':' if self.options['output_format'] == 'pdf' else '',
+        value=self.options[prop.lower()].replace('\\', '\\\\').replace('"', '\\"')
+      ).encode())
+
+    metadata.close()
+
+    self.book.suppliments['metadata'] = metadata.name
+
+  def get_ocr(self):
+    pages = self.book.pages[:]
+
+    self.stage('Performing OCR', len(pages), 25, 25)
+
+    engine = self.options['ocr_engine']
+    options = self.options[engine + '_options']
+    pending = []
+
+    # Pages with known results are done first; the engine gets the rest.
+    for row, page in enumerate(pages):
+      self.token.check()
+
+      if page.cached_boxing is not None:
+        page.boxing = page.cached_boxing
+      else:
+        page.boxing = self.ocr_cache.get(page.path, engine, options)
+
+      if page.boxing is None:
+        pending.append((row, page))
+      else:
+        self.ocr_done(row, page)
+
+    # The first batch is a single page, which tells how long a page takes.
+    size = 1
+
+    while pending:
+      self.token.check()
+
+      batch, pending = pending[:size], pending[size:]
+      accounting.set_page(batch[0][1].path)
+      started = time.time()
+
+      with tracing.span('ocr batch', 'page', pages=len(batch), page=os.path.basename(batch[0][1].path)):
+        results = self.ocr.analyze_batch([page.path for row, page in batch])
+
+      for (row, page), boxing in zip(batch, results):
+        page.boxing = boxing
+
+        # An empty result is what the engines give when they fail on a page;
+        # it is not kept, so that the next bind tries the page again.
+        if boxing:
+          self.ocr_cache.put(page.path, engine, options, boxing)
+
+        self.ocr_done(row, page)
+
+      size = self.ocr_batch_size(len(batch), time.time() - started)
+
+    return None
+
+  def ocr_batch_size(self, size, elapsed):
+    # Batches of about ocr_batch_time seconds: long enough to spread the
+    # engine's start-up over many pages, short enough for the progress bar to
+    # keep moving.
+    seconds = max(elapsed / size, 0.01)
+
+    return max(1, min(self.ocr.batch_size, int(self.ocr_batch_time / seconds)))
+
+  def ocr_done(self, row, page):
+    # The DjVu encoder takes the djvused form, the PDF encoder the boxes.
+    page.text = djvubind.ocr.translate(page.boxing)
+
+    self.recognized(row)
+
+  # Hooks, called on the thread the pipeline runs on.
+
+  def stage(self, name, total, base, span):
+    pass
+
+  def analyzed(self, row):
+    pass
+
+  def recognized(self, row):
+    pass
+
+  def ocr_finished(self):
+    pass
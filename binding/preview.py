@@ -0,0 +1,144 @@
+import os, time, copy, shutil, tempfile, threading
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+from djvubind import imaging, utils
+
+from . import organizer
+
+from .encoders.djvu import DjVuEncoder
+from .encoders.pdf import PDFEncoder
+
+class PreviewEncoder(QThread):
+  # Encodes the selected page alone with the current options and renders the
+  # result back into an image, so that encoder settings can be compared
+  # against the original without binding the whole book.
+  def __init__(self, parent = None):
+    super(PreviewEncoder, self).__init__(parent)
+
+    self.request = None
+    self.token = None
+    self.lock = threading.Lock()
+    self.running = False
+
+  def encode(self, page, options, size):
+    # A newer request cancels the encode in progress.
+    with self.lock:
+      if self.token is not None:
+        self.token.cancel()
+
+      self.request = (copy.copy(page), dict(options), list(size))
+
+      if self.running:
+        return
+
+      self.running = True
+
+    self.wait()
+    self.start()
+
+  def stop(self):
+    with self.lock:
+      self.request = None
+
+      if self.token is not None:
+        self.token.cancel()
+
+    self.wait()
+
+  def run(self):
+    while True:
+      with self.lock:
+        if self.request is None:
+          self.running = False
+          break
+
+        page, options, size = self.request
+        self.request = None
+
+        self.token = options['cancel_token'] = utils.CancelToken()
+
+      tempdir = options['temp_dir'] = tempfile.mkdtemp(prefix='bindery-preview-')
+
+      try:
+        self.preview(page, options, size, tempdir)
+      except utils.Cancelled:
+        pass
+      except (ValueError, OSError) as message:
+        self.emit(SIGNAL('error(QString)'), str(message))
+      except SystemExit:
+        # The djvubind encoders exit when a tool is missing or misbehaves.
+        self.emit(SIGNAL('error(QString)'), 'The {0} encoder is not available.'.format(options['output_format'].upper()))
+      finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+  def preview(self, page, options, size, tempdir):
+    # The same analysis the binder does, with every intermediate file kept in
+    # tempdir.
+    path = page.path
+
+    page.is_bitonal(tempdir)
+    page.get_dpi()
+    page.get_size()
+
+    if page.grayscale and not page.bitonal:
+      imaging.convert(page.path, os.path.join(tempdir, 'grayscale.tif'), mode='L', format='TIFF')
+      page.path = os.path.join(tempdir, 'grayscale.tif')
+
+    output = os.path.join(tempdir, 'page.' + options['output_format'])
+
+    started = time.time()
+
+    if options['output_format'] == 'djvu':
+      self.encode_djvu(page, options, output)
+    else:
+      self.encode_pdf(page, options, output)
+
+    elapsed = time.time() - started
+
+    options['cancel_token'].check()
+
+    image = self.render(output, options, size, tempdir)
+
+    if image.isNull():
+      raise ValueError('The encoded page could not be rendered.')
+
+    self.emit(SIGNAL('encodedPage(QString, QImage, QSize, int, double)'), path, image, QSize(page.width, page.height), os.path.getsize(output), elapsed)
+
+  def encode_djvu(self, page, options, output):
+    encoder = DjVuEncoder(options)
+
+    if page.bitonal:
+      if options['bitonal_encoder'] == 'minidjvu':
+        encoder._minidjvu([page.path], output, page.dpi)
+      else:
+        encoder._cjb2(page.path, output, page.dpi)
+    else:
+      getattr(encoder, '_' + options['color_encoder'])(page.path, output, page.dpi)
+
+  def encode_pdf(self, page, options, output):
+    # pdfbeads only works on whole books; its settings are the native
+    # writer's, so the native writer stands in for it.
+    book = organizer.Book()
+    book.pages = [page]
+
+    PDFEncoder(options)._native(book, output)
+
+  def render(self, filename, options, size, tempdir):
+    # Rendered at twice the size of the preview pane, enough to zoom in on
+    # compression artifacts.
+    width, height = 2 * size[0], 2 * size[1]
+    token = options['cancel_token']
+
+    if options['output_format'] == 'djvu':
+      target = os.path.join(tempdir, 'render.pnm')
+      utils.run(['ddjvu', '-format=pnm', '-page=1', '-size={0}x{1}'.format(width, height), filename, target], token=token)
+    elif utils.is_executable('pdftoppm'):
+      target = os.path.join(tempdir, 'render.png')
+      utils.run(['pdftoppm', '-f', '1', '-l', '1', '-png', '-singlefile', '-scale-to-x', width, '-scale-to-y', '-1', filename, target[:-4]], token=token)
+    else:
+      target = os.path.join(tempdir, 'render.png')
+      utils.run(['convert', '-density', '150', filename + '[0]', '-resize', '{0}x{1}'.format(width, height), target], token=token)
+
+    return QImage(target)
@@ -0,0 +1,180 @@
+import os, json
+
+# A .bindery file is a header line followed by one line per page that has
+# cached results. The header holds everything needed to show the project,
+# the page order, the per-page overrides and the book options, plus where
+# each page's line starts, so that opening a project reads a single line and
+# the cached results are only parsed when a bind asks for them.
+FORMAT = 'bindery-project'
+VERSION = 1
+
+def fingerprint(path):
+  # Size and modification time: cheap enough to check for every page of a
+  # large book, and they change whenever the scan is edited or replaced.
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return None
+
+  return [stat.st_size, stat.st_mtime]
+
+class ProjectError(Exception):
+  pass
+
+class Project(object):
+  def __init__(self, filename=None):
+    self.filename = filename
+    self.options = {}
+    self.pages = []
+
+    # Byte offsets of the cached lines, relative to the end of the header.
+    self.index = {}
+    self.start = 0
+
+    # Records that have been read or updated since the project was opened.
+    self.records = {}
+
+    if filename is not None:
+      self.load(filename)
+
+  def absolute(self, path):
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(self.filename)), path))
+
+  def relative(self, path, filename):
+    # Relative to the project file, so that a book can be moved together with
+    # its scans.
+    try:
+      return os.path.relpath(path, os.path.dirname(os.path.abspath(filename)))
+    except ValueError:
+      # Another drive on Windows.
+      return path
+
+  def load(self, filename):
+    try:
+      with open(filename, 'rb') as handle:
+        header = json.loads(handle.readline().decode('utf8'))
+        self.start = handle.tell()
+    except (IOError, OSError, ValueError) as message:
+      raise ProjectError('{0} could not be read: {1}'.format(filename, message))
+
+    if header.get('format') != FORMAT:
+      raise ProjectError('{0} is not a Bindery project.'.format(filename))
+
+    if header.get('version', 0) > VERSION:
+      raise ProjectError('{0} was saved by a newer version of Bindery.'.format(filename))
+
+    self.filename = filename
+    self.options = header.get('options', {})
+    self.records = {}
+
+    self.pages = []
+    self.index = {}
+
+    for page in header.get('pages', []):
+      page = dict(page)
+      page['path'] = self.absolute(page['path'])
+      self.pages.append(page)
+
+    for path, offset in header.get('index', {}).items():
+      self.index[self.absolute(path)] = offset
+
+  def read(self, path):
+    # The line of a single page, straight from the file.
+    with open(self.filename, 'rb') as handle:
+      handle.seek(self.start + self.index[path])
+
+      return handle.readline()
+
+  def record(self, path):
+    # What is known about an image, or None if nothing is or the image has
+    # changed since.
+    if path not in self.records:
+      if path not in self.index:
+        return None
+
+      try:
+        record = json.loads(self.read(path).decode('utf8'))
+      except (IOError, OSError, ValueError):
+        record = None
+
+      self.records[path] = record
+
+    record = self.records[path]
+
+    if record is None or record.get('fingerprint') != fingerprint(path):
+      return None
+
+    return record
+
+  def update(self, path, **fields):
+    record = dict(self.record(path) or {})
+    record.update(fields)
+    record['fingerprint'] = fingerprint(path)
+
+    self.records[path] = record
+
+  def save(self, filename=None):
+    filename = filename or self.filename
+
+    if filename is None:
+      raise ProjectError('The project has not been given a file name.')
+
+    lines = []
+    index = {}
+    offset = 0
+
+    for page in self.pages:
+      path = page['path']
+
+      if path in index:
+        continue
+
+      if path in self.records:
+        if self.records[path] is None:
+          continue
+
+        line = (json.dumps(self.records[path], separators=(',', ':')) + '\n').encode('utf8')
+      elif path in self.index:
+        # Never looked at, so copied over without being parsed.
+        try:
+          line = self.read(path)
+        except (IOError, OSError):
+          continue
+      else:
+        continue
+
+      index[self.relative(path, filename)] = offset
+      lines.append(line)
+      offset += len(line)
+
+    pages = []
+
+    for page in self.pages:
+      page = dict(page)
+      page['path'] = self.relative(page['path'], filename)
+      pages.append(page)
+
+    header = {
+      'format': FORMAT,
+      'version': VERSION,
+      'options': self.options,
+      'pages': pages,
+      'index': index
+    }
+
+    # Written next to the project and moved over it, so that a failed save
+    # leaves the old file as it was.
+    temporary = filename + '.part'
+
+    try:
+      with open(temporary, 'wb') as handle:
+        handle.write((json.dumps(header, separators=(',', ':')) + '\n').encode('utf8'))
+
+        for line in lines:
+          handle.write(line)
+
+      os.replace(temporary, filename)
+    except (IOError, OSError) as message:
+      raise ProjectError('{0} could not be saved: {1}'.format(filename, message))
+
+    self.load(filename)
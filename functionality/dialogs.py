@@ -3,12 +3,14 @@ import os
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+from importer import NaturalListItem
+
 class Dialogs(QMainWindow):
   def error(self, message):
     QMessageBox.critical(self, '', message, QMessageBox.Ok, QMessageBox.Ok)
 
-    if self.binder.isRunning():
-      self.binder.stop()
+    if self.binder.isRunning() or str(self.ui.startButton.text()) == 'Stop':
+      self.stopBinding()
   
   
   
@@ -24,15 +26,43 @@ class Dialogs(QMainWindow):
       self.projectFiles.ui.inputDirectory.setText(directory)
       
       self.settings.setValue('startup/input_directory', directory)
-
-      for filename in os.listdir(directory):
-        item = QListWidgetItem(os.path.split(filename)[-1])
-        item.setStatusTip(os.path.join(directory, filename))
-        
-        if os.path.splitext(os.path.split(filename)[-1])[-1].lower() not in ['.jpg', '.jpeg', '.bmp', '.png', '.tif', '.tiff']:
-          item.setFlags(Qt.NoItemFlags)
-
-        self.projectFiles.ui.offProjectList.addItem(item)
+      
+      self.scanInputDirectory()
+  
+  
+  
+  def scanInputDirectory(self):
+    # Lists the input directory on the importer's thread; the files arrive in
+    # projectFilesFound().
+    directory = str(self.projectFiles.ui.inputDirectory.text())
+    
+    self.folderImporter.cancel()
+    self.projectFiles.ui.offProjectList.clear()
+    
+    if directory and os.path.isdir(directory):
+      self.folderImporter.scan([directory], self.projectFiles.ui.includeSubfolders.isChecked())
+  
+  
+  
+  def projectFilesFound(self, generation, batch):
+    if generation != self.folderImporter.generation:
+      return
+    
+    files = self.projectFiles.ui.offProjectList
+    
+    # Sorted once per batch rather than once per item.
+    files.setSortingEnabled(False)
+    
+    for path, name, image in batch:
+      item = NaturalListItem(name)
+      item.setStatusTip(path)
+      
+      if not image:
+        item.setFlags(Qt.NoItemFlags)
+      
+      files.addItem(item)
+    
+    files.setSortingEnabled(True)
   
   
   
@@ -67,20 +97,11 @@ class Dialogs(QMainWindow):
   
   
   def addFiles(self):
-    for filename in QFileDialog.getOpenFileNames(
+    self.pageImporter.scan(QFileDialog.getOpenFileNames(
       self,
       'Add files to project',
       self.settings.value('startup/input_directory', QDir.homePath()).toString()
-    ):
-      self.addFile(filename)
-    
-    for widget in [self.ui.startButton, self.ui.startBindingMenuItem]:
-      widget.setEnabled(self.ui.pageList.count() > 0)
-  
-    if self.ui.pageList.count() > 0:
-      self.hideBackground()
-      
-      self.thumbnailer.start()
+    ))
   
   
   
@@ -89,5 +110,5 @@ class Dialogs(QMainWindow):
     
     if output:
       handle = open(output, 'w')
-      handle.write(self.ui.debugLog.plainText())
+      handle.write(str(self.ui.debugLog.toPlainText()))
       handle.close()
@@ -1,15 +1,141 @@
-import linecache, traceback
+import logging, logging.handlers, collections, linecache, traceback
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+class LogBuffer(logging.Handler):
+  # Keeps the most recent records, and the ones the debug log has not shown
+  # yet. Records may come from any thread; the view picks them up in batches.
+  def __init__(self, limit):
+    logging.Handler.__init__(self)
+
+    self.records = collections.deque(maxlen=limit)
+    self.pending = collections.deque(maxlen=limit)
+
+  def emit(self, record):
+    # Formatted here, so that the view does not format on the GUI thread what
+    # it may never show.
+    record.text = self.format(record)
+
+    self.records.append(record)
+    self.pending.append(record)
+
+  def take(self):
+    self.acquire()
+
+    try:
+      records = list(self.pending)
+      self.pending.clear()
+    finally:
+      self.release()
+
+    return records
+
+  def all(self):
+    self.acquire()
+
+    try:
+      return list(self.records)
+    finally:
+      self.release()
+
+  def clear(self):
+    self.acquire()
+
+    try:
+      self.records.clear()
+      self.pending.clear()
+    finally:
+      self.release()
+
 class Error(QMainWindow):
-  def write(self, message):
-    self.ui.debugLog.setHtml(self.ui.debugLog.toHtml() + message)
-  
+  # Records kept, both in the buffer and as lines of the debug log.
+  logLimit = 5000
+
+  # The entries of the level box, in order.
+  logLevels = [logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR]
+
+  logColors = {
+    logging.DEBUG: QColor(128, 128, 128),
+    logging.WARNING: QColor(170, 100, 0),
+    logging.ERROR: QColor(200, 0, 0)
+  }
+
+  def setupLog(self, filename=None):
+    formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s', '%H:%M:%S')
+
+    self.logBuffer = LogBuffer(self.logLimit)
+    self.logBuffer.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    root.addHandler(self.logBuffer)
+
+    if filename:
+      handler = logging.handlers.RotatingFileHandler(filename, maxBytes=1024 * 1024, backupCount=3, encoding='utf8')
+      handler.setFormatter(formatter)
+      root.addHandler(handler)
+
+    self.ui.debugLog.document().setMaximumBlockCount(self.logLimit)
+
+    self.logTimer = QTimer(self)
+    self.logTimer.setInterval(100)
+    self.connect(self.logTimer, SIGNAL('timeout()'), self.flushLog)
+    self.logTimer.start()
+
+    self.connect(self.ui.logLevel, SIGNAL('currentIndexChanged(int)'), self.logLevelChanged)
+
+  def write(self, message, level=logging.INFO):
+    logging.getLogger('bindery').log(level, message)
+
+  def logLevel(self):
+    return self.logLevels[max(0, self.ui.logLevel.currentIndex())]
+
+  def flushLog(self):
+    level = self.logLevel()
+    self.appendLog([record for record in self.logBuffer.take() if record.levelno >= level])
+
+  def appendLog(self, records):
+    if not records:
+      return
+
+    scrollBar = self.ui.debugLog.verticalScrollBar()
+    following = scrollBar.value() == scrollBar.maximum()
+
+    cursor = QTextCursor(self.ui.debugLog.document())
+    cursor.movePosition(QTextCursor.End)
+    cursor.beginEditBlock()
+
+    for record in records:
+      if not self.ui.debugLog.document().isEmpty():
+        cursor.insertBlock()
+
+      format = QTextCharFormat()
+      format.setForeground(self.logColors.get(record.levelno, QColor(0, 0, 0)))
+
+      cursor.insertText(record.text, format)
+
+    cursor.endEditBlock()
+
+    if following:
+      scrollBar.setValue(scrollBar.maximum())
+
+  def logLevelChanged(self, index):
+    # The buffer still has everything, so the log can be rebuilt for the new
+    # level.
+    level = self.logLevel()
+
+    self.logBuffer.take()
+    self.ui.debugLog.clear()
+    self.appendLog([record for record in self.logBuffer.all() if record.levelno >= level])
+
+  def clearLog(self):
+    self.logBuffer.clear()
+    self.ui.debugLog.clear()
+
   def handleError(self, etype, value, trace):
-    exception = ['<b>Traceback (most recent call last):</b>']
-    
+    exception = ['Traceback (most recent call last):']
+
     while trace is not None:
       f = trace.tb_frame
       lineno = trace.tb_lineno
@@ -17,15 +143,15 @@ class Error(QMainWindow):
       filename = co.co_filename
       name = co.co_name
       exception += ['  File "%s", line %d, in %s' % (filename, lineno, name)]
-      
+
       linecache.checkcache(filename)
       line = linecache.getline(filename, lineno, f.f_globals)
-      
+
       if line:
         exception.append('    ' + line.strip())
-      
+
       trace = trace.tb_next
-    
-    exception += traceback.format_exception_only(etype, value)
-    
-    self.ui.debugLog.setHtml(self.ui.debugLog.toHtml() + '<pre>' + '<br />'.join(exception) + '</pre>')
+
+    exception += [line.rstrip('\n') for line in traceback.format_exception_only(etype, value)]
+
+    self.write('\n'.join(exception), logging.ERROR)
@@ -0,0 +1,223 @@
+import os
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+try:
+  from djvubind import imaging, ocrcache
+except:
+  from binding.djvubind import imaging, ocrcache
+
+from binding.project import Project, ProjectError
+from ui.BookListWidget import BookPage
+
+class Projects(QMainWindow):
+  # The widgets a project remembers, in the order they are restored: the
+  # output format rewrites the output file name and the OCR language the OCR
+  # options, so those come first.
+  projectWidgets = [
+    'outputFormat', 'outputFile',
+    'bookTitle', 'bookAuthor', 'bookSubject', 'bookKeywords',
+    'enableOCR', 'ocrEngine', 'ocrLanguage', 'ocrOptions',
+    'djvuBitonalEncoder', 'djvuColorEncoder', 'djvuIndirect',
+    'c44Options', 'cjb2Options', 'cpaldjvuOptions', 'csepdjvuOptions', 'minidjvuOptions',
+    'pdfPageLayout', 'pdfForegroundEncoder', 'pdfBackgroundEncoder',
+    'jbig2DictionarySize', 'binarizationThreshold', 'maxIndexedColors', 'pdfWriter', 'pdfLinearize'
+  ]
+
+
+
+  def bookOptions(self):
+    options = {}
+
+    for name in self.projectWidgets:
+      widget = getattr(self.ui, name)
+
+      if isinstance(widget, QLineEdit):
+        options[name] = str(widget.text())
+      elif isinstance(widget, QComboBox):
+        options[name] = str(widget.currentText())
+      elif isinstance(widget, QAbstractButton):
+        options[name] = widget.isChecked()
+      else:
+        options[name] = widget.value()
+
+    return options
+
+
+
+  def setBookOptions(self, options):
+    # Values that no longer fit (an OCR engine that is not installed here,
+    # say) are left as they are.
+    for name in self.projectWidgets:
+      if name not in options:
+        continue
+
+      widget = getattr(self.ui, name)
+      value = options[name]
+
+      if isinstance(widget, QLineEdit):
+        widget.setText(value)
+      elif isinstance(widget, QComboBox):
+        index = widget.findText(value)
+
+        if index >= 0:
+          widget.setCurrentIndex(index)
+      elif isinstance(widget, QAbstractButton):
+        widget.setChecked(bool(value))
+      else:
+        widget.setValue(value)
+
+
+
+  def projectChanged(self):
+    self.ui.saveMenuItem.setEnabled(self.project.filename is not None)
+
+    if self.project.filename is not None:
+      self.setWindowTitle('{0} - {1}'.format(os.path.basename(self.project.filename), self.full_name))
+    else:
+      self.setWindowTitle(self.full_name)
+
+
+
+  def openProject(self):
+    if self.binder.isRunning():
+      QMessageBox.warning(self, 'Bindery', 'A project cannot be opened while a book is binding.', QMessageBox.Ok, QMessageBox.Ok)
+      return False
+
+    filename = str(QFileDialog.getOpenFileName(
+      self,
+      'Open project',
+      self.settings.value('startup/project_directory', QDir.homePath()).toString(),
+      'Bindery Project (*.bindery)'
+    ))
+
+    if not filename:
+      return False
+
+    try:
+      project = Project(filename)
+    except ProjectError as message:
+      QMessageBox.warning(self, 'Bindery', str(message), QMessageBox.Ok, QMessageBox.Ok)
+      return False
+
+    self.settings.setValue('startup/project_directory', os.path.dirname(filename))
+
+    # Only the header has been read; the images are looked at when they are
+    # shown or bound.
+    pages = []
+
+    for entry in project.pages:
+      page = BookPage(entry.get('label', ''), entry['path'])
+      page.title = entry.get('title')
+      page.grayscale = entry.get('grayscale', False)
+      pages.append(page)
+
+    self.ui.pageList.takeItems(range(self.ui.pageList.count()))
+    self.ui.pageList.addItems(pages)
+
+    self.setBookOptions(project.options)
+
+    self.project = project
+    self.projectChanged()
+
+    for widget in [self.ui.startButton, self.ui.startBindingMenuItem]:
+      widget.setEnabled(self.ui.pageList.count() > 0)
+
+    self.hideBackground()
+    self.itemSelectionChanged()
+
+    return True
+
+
+
+  def saveProject(self):
+    if self.project.filename is None:
+      return self.saveProjectAs()
+
+    return self.writeProject(self.project.filename)
+
+
+
+  def saveProjectAs(self):
+    filename = str(QFileDialog.getSaveFileName(
+      self,
+      'Save project',
+      os.path.join(str(self.settings.value('startup/project_directory', QDir.homePath()).toString()), 'Book.bindery'),
+      'Bindery Project (*.bindery)'
+    ))
+
+    if not filename:
+      return False
+
+    if not filename.endswith('.bindery'):
+      filename += '.bindery'
+
+    self.settings.setValue('startup/project_directory', os.path.dirname(filename))
+
+    return self.writeProject(filename)
+
+
+
+  def writeProject(self, filename):
+    self.project.pages = [{
+      'path': page.path,
+      'label': page.label,
+      'title': page.title,
+      'grayscale': page.grayscale
+    } for page in self.ui.pageList.pages()]
+
+    self.project.options = self.bookOptions()
+
+    try:
+      self.project.save(filename)
+    except ProjectError as message:
+      QMessageBox.warning(self, 'Bindery', str(message), QMessageBox.Ok, QMessageBox.Ok)
+      return False
+
+    self.projectChanged()
+
+    return True
+
+
+
+  def useProjectResults(self, pages, options):
+    # Gives the pages about to be bound what the project knows about their
+    # images, as long as the images are unchanged: probe results always, OCR
+    # boxes when they were made by the same engine with the same options.
+    engine = options['ocr_engine']
+
+    for page in pages:
+      record = self.project.record(page.path)
+
+      if record is None:
+        continue
+
+      if 'probe' in record:
+        imaging.remember(page.path, record['probe'])
+
+      ocr = record.get('ocr')
+
+      if options['ocr'] and ocr and ocr.get('boxes') and ocr['engine'] == engine and ocr['options'] == options[engine + '_options']:
+        page.cached_boxing = ocrcache.expand(ocr['boxes'])
+
+
+
+  def keepProjectResults(self, sources, pages, options):
+    # The binder worked on copies whose paths may point at temporary files by
+    # now, so the results are filed under the paths the pages came from.
+    engine = options['ocr_engine']
+
+    for path, page in zip(sources, pages):
+      fields = {}
+
+      try:
+        fields['probe'] = imaging.probe(path)
+      except Exception:
+        pass
+
+      if options['ocr'] and page.boxing:
+        fields['ocr'] = {'engine': engine, 'options': options[engine + '_options'], 'boxes': ocrcache.compact(page.boxing)}
+
+      if fields:
+        self.project.update(path, **fields)
@@ -1,11 +1,13 @@
-import sys, os, time, glob, re, tempfile
+import sys, os, time, glob, re, tempfile, platform, copy, logging
 
 try:
-  from djvubind import utils
+  from djvubind import dependencies, utils
 except:
-  from binding.djvubind import utils
+  from binding.djvubind import dependencies, utils
 
-from ui.BookListWidget import BookListWidget, BookListWidgetItem
+from ui.BookListWidget import BookListWidget, BookPage
+
+import importer
 
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
@@ -23,6 +25,13 @@ except:
 def all_same(items):
   return all(x == items[0] for x in items)
 
+def command_line_value(name, default=None):
+  for argument in sys.argv:
+    if argument.startswith(name + '='):
+      return argument.split('=', 1)[1]
+
+  return default
+
 
 
 class Bindery(QMainWindow):
@@ -77,11 +86,19 @@ class Bindery(QMainWindow):
     ocr_engines = [str(self.ui.ocrEngine.itemText(index)) for index in range(self.ui.ocrEngine.count())]
     installed_ocr_engines = []
     
-    if not utils.is_executable('identify'):
-      if platform.system() == 'Windows':
-        os.environ['PATH'] = os.path.abspath('bin\\') + ';' + os.environ['PATH']
-      else:
-        self.error('Bindery requires a few packages in order to function properly, namely imagemagick, djvulibre, jbig2 and pdfbeads. Check the documentation for instructions on how to install them.')
+    # Locates every tool (or reloads them from the cache of an earlier run) so
+    # that the encoders and OCR engines never search PATH themselves.
+    if platform.system() == 'Windows' and not utils.is_executable('identify'):
+      os.environ['PATH'] = os.path.abspath('bin\\') + ';' + os.environ['PATH']
+    
+    tools = dependencies.resolve()
+    
+    for tool in sorted(tools.values(), key=lambda tool: tool.name):
+      if tool.path is not None:
+        self.write('{0}: {1} ({2})'.format(tool.name, tool.path, tool.version or 'unknown version'))
+    
+    if tools['identify'].path is None:
+      self.error('Bindery requires a few packages in order to function properly, namely imagemagick, djvulibre, jbig2 and pdfbeads. Check the documentation for instructions on how to install them.')
     
     for index, engine in enumerate(ocr_engines):
       if utils.is_executable(engine.lower()):
@@ -92,19 +109,52 @@ class Bindery(QMainWindow):
     if not installed_ocr_engines:
       self.ui.ocrTab.setEnabled(False)
     
-    if not utils.is_executable('pdfbeads'):
+    # Without pdfbeads the native PDF writer is used, which only needs ImageMagick.
+    if not utils.is_executable('pdfbeads') and not utils.is_executable('convert'):
       self.ui.outputFormat.model().itemFromIndex(self.ui.outputFormat.model().index(1, self.ui.outputFormat.modelColumn(), self.ui.outputFormat.rootModelIndex())).setEnabled(False)
 
 
 
-  def previewPage(self, image):
-    if self.ui.pagePreview.scene():
-      self.ui.pagePreview.scene().clear()
-      self.ui.pagePreview.scene().addPixmap(QPixmap().fromImage(image))
-    else:
-      scene = QGraphicsScene()
-      scene.addPixmap(QPixmap().fromImage(image))
-      self.ui.pagePreview.setScene(scene)
+  def previewPage(self, path, image, original):
+    self.ui.pagePreview.setPage(path, image, original)
+
+
+
+  def previewLevel(self, path, level, directory):
+    self.ui.pagePreview.addLevel(path, level, directory)
+
+
+
+  def previewEncoding(self):
+    if len(self.selected) != 1:
+      return
+
+    self.encodedPath = self.selected[0].path
+
+    self.ui.encodedPreviewInfo.setText('Encoding...')
+    self.previewEncoder.encode(self.selected[0], self.bindingOptions(), [self.ui.pagePreview.size().width(), self.ui.pagePreview.size().height()])
+
+
+
+  def encodedPage(self, path, image, original, size, elapsed):
+    if str(path) != self.encodedPath:
+      return
+
+    self.ui.encodedPreview.show()
+    self.ui.encodedPreview.setPage(path, image, original)
+
+    self.ui.encodedPreviewInfo.setText('{format}: {size:.1f} KB, {ratio:.1f}% of the original, encoded in {elapsed:.2f} s'.format(
+      format=str(self.ui.outputFormat.currentText()),
+      size=size / 1024.0,
+      ratio=100.0 * size / max(1, os.path.getsize(self.encodedPath)),
+      elapsed=elapsed
+    ))
+
+
+
+  def encodedPreviewError(self, message):
+    self.ui.encodedPreviewInfo.setText('The page could not be encoded; see the debug log.')
+    self.write('Preview encoding failed:\n{0}'.format(message), logging.ERROR)
 
 
 
@@ -122,15 +172,28 @@ class Bindery(QMainWindow):
       if len(self.selected) == 1:
         row = self.ui.pageList.row(self.selected[0])
 
+        # An encoded preview is only shown next to the page it was made from.
+        if self.selected[0].path != self.encodedPath:
+          self.encodedPath = None
+          self.ui.encodedPreview.hide()
+          self.ui.encodedPreviewInfo.setText('')
+
         self.ui.moveToTopButton.setEnabled(row != 0)
         self.ui.moveUpButton.setEnabled(row != 0)
 
         self.ui.moveToBottomButton.setEnabled(row != self.ui.pageList.count() - 1)
         self.ui.moveDownButton.setEnabled(row != self.ui.pageList.count() - 1)
 
-        self.previewer.image = self.selected[0].path
-        self.previewer.size = [self.ui.pagePreview.size().width(), self.ui.pagePreview.size().width()]
-        self.previewer.start()
+        # Nearest pages first, so that stepping through the book in either
+        # direction finds them decoded.
+        neighbours = []
+
+        for distance in range(1, self.previewer.prefetch + 1):
+          for other in [row + distance, row - distance]:
+            if 0 <= other < self.ui.pageList.count():
+              neighbours.append(self.ui.pageList.item(other).path)
+
+        self.previewer.show(self.selected[0].path, [self.ui.pagePreview.size().width(), self.ui.pagePreview.size().height()], neighbours)
     else:
       self.ui.pageTab.setEnabled(False)
 
@@ -146,9 +209,8 @@ class Bindery(QMainWindow):
 
 
 
-  def makeIcon(self, index, icon):
-    item = self.ui.pageList.item(index)
-    item.setIcon(QIcon(QPixmap.fromImage(icon)))
+  def makeIcon(self, path, icon):
+    self.ui.pageList.pageModel.setIcon(path, icon)
 
 
 
@@ -166,14 +228,14 @@ class Bindery(QMainWindow):
       self.ui.pageList.setStyleSheet('')
     else:
       self.ui.pageList.setStyleSheet(
-        '''QListWidget {
+        '''QListView {
           background-image: url(':/icons/go-down-big.png');
           background-position: center;
           background-repeat: no-repeat;
           background-color: white;
         }
 
-        QListWidget:hover {
+        QListView:hover {
           background-image: url(':/icons/go-down-big-hover.png');
           background-position: center;
           background-repeat: no-repeat;
@@ -197,33 +259,42 @@ class Bindery(QMainWindow):
 
 
   def addFile(self, filename, index=None, title=None):
-    filename = str(filename)
+    return len(self.addPages([filename], index, [title])) > 0
+
 
-    if os.path.splitext(os.path.split(filename)[-1])[-1] in ['.jpg', '.jpeg', '.bmp', '.png', '.tif', '.tiff']:
-      item = BookListWidgetItem(os.path.split(filename)[-1] if not title else title, filename)
 
-      if filename not in [str(self.ui.pageList.item(i).path) for i in range(self.ui.pageList.count())]:
-        if index:
-          self.ui.pageList.insertItem(index, item)
-        else:
-          self.ui.pageList.addItem(item)
+  def addPages(self, filenames, index=None, titles=None, sniff=True):
+    # Adds images as one block, skipping other files and pages that are
+    # already in the book, and returns the pages that were added.
+    pages = []
 
-        return True
+    for number, filename in enumerate(filenames):
+      filename = str(filename)
+      title = titles[number] if titles else None
 
-    return False
+      if not sniff or importer.is_image(filename):
+        pages.append(BookPage(os.path.split(filename)[-1] if not title else title, filename))
+
+    return self.ui.pageList.insertItems(index, pages)
 
 
 
   def filesDropped(self, files):
-    for filename in files:
-      self.addFile(filename)
+    # Folders are imported with everything in them.
+    self.pageImporter.scan(files, True)
+
+
+
+  def pagesFound(self, generation, batch):
+    images = [(path, name) for path, name, image in batch if image]
+
+    self.addPages([path for path, name in images], titles=[name for path, name in images], sniff=False)
 
     for widget in [self.ui.startButton, self.ui.startBindingMenuItem]:
       widget.setEnabled(self.ui.pageList.count() > 0)
 
     if self.ui.pageList.count() > 0:
       self.hideBackground()
-      self.thumbnailer.start()
 
 
 
@@ -252,25 +323,24 @@ class Bindery(QMainWindow):
     else:
       self.projectFiles.close()
 
+      pages = []
+
       for i in range(self.projectFiles.ui.inProjectList.count()):
         orig = self.projectFiles.ui.inProjectList.item(i)
-        item = BookListWidgetItem(orig.text(), orig.statusTip())
+        pages.append(BookPage(orig.text(), orig.statusTip()))
 
-        if str(orig.text()) not in [self.ui.pageList.item(i).filename for i in range(self.ui.pageList.count())]:
-          self.ui.pageList.addItem(item)
+      self.ui.pageList.addItems(pages)
 
     for widget in [self.ui.startButton, self.ui.startBindingMenuItem]:
       widget.setEnabled(self.ui.pageList.count() > 0)
 
     if self.ui.pageList.count() > 0:
       self.hideBackground()
-      self.thumbnailer.start()
 
 
 
   def removeFiles(self):
-    for item in self.ui.pageList.selectedItems():
-      self.ui.pageList.takeItem(self.ui.pageList.row(item))
+    self.ui.pageList.takeItems(self.ui.pageList.selectedRows())
 
     for widget in [self.ui.startButton, self.ui.startBindingMenuItem]:
       widget.setEnabled(self.ui.pageList.count() > 0)
@@ -279,53 +349,53 @@ class Bindery(QMainWindow):
 
 
   def reloadThumbnails(self):
-    self.thumbnailer.die = False
-    self.thumbnailer.start()
+    self.thumbnailer.clear()
+    self.ui.pageList.pageModel.resetIcons()
 
 
   def togglePreviews(self):
     self.previews = not self.previews
 
-    if not self.previews:
-      self.ui.actionReload_Thumbnails.setEnabled(False)
+    self.ui.actionReload_Thumbnails.setEnabled(self.previews)
 
-      self.thumbnailer.die = True
+    self.thumbnailer.clear()
+    self.ui.pageList.pageModel.setPreviews(self.previews)
 
-      while self.thumbnailer.isRunning():
-        time.wait(0.1)
 
-      for i in range(self.ui.pageList.count()):
-        self.ui.pageList.item(i).removeIcon()
 
-      self.thumbnailer.start()
-    else:
-      for i in range(self.ui.pageList.count()):
-        self.ui.pageList.item(i).setSizeHint(QSize(72, 72))
-        self.ui.pageList.item(i).resetIcon()
+  def updateProgress(self, value, message):
+    self.ui.progressBar.setValue(value)
+    self.ui.progressBar.setFormat('{0} - %p%'.format(message))
 
-      self.ui.actionReload_Thumbnails.setEnabled(True)
-      self.reloadThumbnails()
 
 
+  def encoderEvent(self, event):
+    if event.kind in ['warning', 'error']:
+      self.write(event.message, logging.WARNING if event.kind == 'warning' else logging.ERROR)
+    elif event.duration is not None:
+      self.write('{0}: {1:.2f}s'.format(event.page, event.duration), logging.DEBUG)
+
 
-  def updateProgress(self, value, message):
-    self.ui.progressBar.setValue(value)
-    self.ui.progressBar.setFormat('{0} - %p%'.format(message))
 
+  def toolReport(self, table):
+    self.write('External tools\n{0}'.format(table))
 
 
-  def updateBackground(self, item, color):
-    self.ui.pageList.item(item).setBackground(color)
+
+  def updateBackgrounds(self, colors):
+    self.ui.pageList.setBackgrounds(colors)
 
 
 
   def clearDebugLog(self):
     if QMessageBox.question(self, 'Bindery', 'Are you sure you want to clear the debug log?', QMessageBox.Yes, QMessageBox.No) == QMessageBox.Yes:
-      self.ui.debugLog.clear()
+      self.clearLog()
 
 
 
   def finishedBinding(self):
+    self.keepProjectResults(self.sources, self.pages, self.options)
+
     self.ui.progressBar.reset()
 
     self.ui.startButton.setText('Start')
@@ -338,8 +408,55 @@ class Bindery(QMainWindow):
     else:
       QMessageBox.information(self, 'Bindery', 'Your book has finished binding.', QMessageBox.Ok, QMessageBox.Ok)
 
-    for i in range(self.ui.pageList.count()):
-      self.ui.pageList.item(i).setBackground(QColor(0, 0, 0, 0))
+    self.ui.pageList.clearBackgrounds()
+
+
+  def bindingOptions(self):
+    options = {
+      'output_file':       str(self.ui.outputFile.text()),
+      'ocr':               (self.ui.enableOCR.checkState() == Qt.Checked),
+      'ocr_engine':        str(self.ui.ocrEngine.currentText()).lower(),
+      'output_format':     str(self.ui.outputFormat.currentText()).lower(),
+      'tesseract_options': str(self.ui.ocrOptions.text()),
+      'cuneiform_options': str(self.ui.ocrOptions.text()),
+      'color_encoder':     str(self.ui.djvuColorEncoder.currentText()),
+      'c44_options':       str(self.ui.c44Options.text()),
+      'cjb2_options':      str(self.ui.cjb2Options.text()),
+      'cpaldjvu_options':  str(self.ui.cpaldjvuOptions.text()),
+      'csepdjvu_options':  str(self.ui.csepdjvuOptions.text()),
+      'minidjvu_options':  str(self.ui.minidjvuOptions.text()),
+      'numbering_type':    [],
+      'numbering_start':   [],
+      'title':             str(self.ui.bookTitle.text()),
+      'author':            str(self.ui.bookAuthor.text()),
+      'subject':           str(self.ui.bookSubject.text()),
+      'keywords':          str(self.ui.bookKeywords.text()),
+      'event_log':         command_line_value('--event-log'),
+      'tool_report':       command_line_value('--tool-report'),
+      'trace_file':        command_line_value('--trace')
+    }
+
+    if options['output_format'] == 'djvu':
+      options['bitonal_encoder'] = str(self.ui.djvuBitonalEncoder.currentText())
+      options['djvu_output'] = 'indirect' if self.ui.djvuIndirect.checkState() == Qt.Checked else 'bundled'
+    elif options['output_format'] == 'pdf':
+      options['background_encoder'] = re.sub(r'\s+\(.*?\)', '', str(self.ui.pdfBackgroundEncoder.currentText()))
+      options['page_layout'] = str(self.ui.pdfPageLayout.currentText()).replace(' ', '')
+      options['foreground_encoder'] = str(self.ui.pdfForegroundEncoder.currentText())
+      options['pages_per_dict'] = self.ui.jbig2DictionarySize.value()
+      options['binarization_threshold'] = self.ui.binarizationThreshold.value()
+      options['max_indexed_colors'] = self.ui.maxIndexedColors.value()
+      options['linearize'] = (self.ui.pdfLinearize.checkState() == Qt.Checked)
+
+      # The built-in writer also stands in for pdfbeads where it is not
+      # installed.
+      if str(self.ui.pdfWriter.currentText()) == 'pdfbeads' and utils.is_executable('pdfbeads'):
+        options['pdf_engine'] = 'pdfbeads'
+      else:
+        options['pdf_engine'] = 'native'
+
+    return options
+
 
 
   def toggleBinding(self):
@@ -348,56 +465,36 @@ class Bindery(QMainWindow):
         if not self.showSaveDialog():
           return False
 
-      self.pages = [self.ui.pageList.item(i) for i in range(self.ui.pageList.count())]
+      # The binder rewrites page paths (grayscale copies), so it gets copies.
+      self.sources = [page.path for page in self.ui.pageList.pages()]
+      self.pages = [copy.copy(page) for page in self.ui.pageList.pages()]
 
       self.ui.startButton.setText('Stop')
       self.ui.startButton.setIcon(self.QIconFromTheme('media-playback-stop'))
       self.ui.startBindingMenuItem.setIcon(self.QIconFromTheme('media-playback-stop'))
 
-      self.options = {
-        'output_file':       str(self.ui.outputFile.text()),
-        'ocr':               (self.ui.enableOCR.checkState() == Qt.Checked),
-        'ocr_engine':        str(self.ui.ocrEngine.currentText()).lower(),
-        'output_format':     str(self.ui.outputFormat.currentText()).lower(),
-        'tesseract_options': str(self.ui.ocrOptions.text()),
-        'cuneiform_options': str(self.ui.ocrOptions.text()),
-        'color_encoder':     str(self.ui.djvuColorEncoder.currentText()),
-        'c44_options':       str(self.ui.c44Options.text()),
-        'cjb2_options':      str(self.ui.cjb2Options.text()),
-        'cpaldjvu_options':  str(self.ui.cpaldjvuOptions.text()),
-        'csepdjvu_options':  str(self.ui.csepdjvuOptions.text()),
-        'minidjvu_options':  str(self.ui.minidjvuOptions.text()),
-        'numbering_type':    [],
-        'numbering_start':   [],
-        'title':             str(self.ui.bookTitle.text()),
-        'author':            str(self.ui.bookAuthor.text()),
-        'subject':           str(self.ui.bookSubject.text()),
-        'keywords':          str(self.ui.bookKeywords.text())
-      }
-
-      if self.options['output_format'] == 'djvu':
-        self.options['bitonal_encoder'] = str(self.ui.djvuBitonalEncoder.currentText())
-      elif self.options['output_format'] == 'pdf':
-        self.options['background_encoder'] = re.sub(r'\s+\(.*?\)', '', str(self.ui.pdfBackgroundEncoder.currentText()))
-        self.options['page_layout'] = str(self.ui.pdfPageLayout.currentText()).replace(' ', '')
-        self.options['foreground_encoder'] = str(self.ui.pdfForegroundEncoder.currentText())
-        self.options['pages_per_dict'] = self.ui.jbig2DictionarySize.value()
-        self.options['binarization_threshold'] = self.ui.binarizationThreshold.value()
-        self.options['max_indexed_colors'] = self.ui.maxIndexedColors.value()
+      self.options = self.bindingOptions()
 
       if os.path.isfile(self.options['output_file']):
         os.remove(self.options['output_file'])
 
+      self.useProjectResults(self.pages, self.options)
+
       self.binder.initialize(self.pages, self.options)
       self.binder.start()
     else:
-      self.binder.die = True
-      self.binder.terminate()
-      self.ui.progressBar.reset()
+      self.stopBinding()
+
 
-      self.ui.startButton.setText('Start')
-      self.ui.startButton.setIcon(self.QIconFromTheme('media-playback-start'))
-      self.ui.startBindingMenuItem.setIcon(self.QIconFromTheme('media-playback-start'))
 
-      for i in range(self.ui.pageList.count()):
-        self.ui.pageList.item(i).setBackground(QColor(0, 0, 0, 0))
+  def stopBinding(self):
+    # Kills the running tools and waits for the binder to clean up after
+    # itself, so that a new bind can start right away.
+    self.binder.stop()
+    self.ui.progressBar.reset()
+
+    self.ui.startButton.setText('Start')
+    self.ui.startButton.setIcon(self.QIconFromTheme('media-playback-start'))
+    self.ui.startBindingMenuItem.setIcon(self.QIconFromTheme('media-playback-start'))
+
+    self.ui.pageList.clearBackgrounds()
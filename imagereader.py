@@ -0,0 +1,135 @@
+import struct
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+# Decoding a scan only at the resolution it is going to be shown at. A 600 dpi
+# colour page is well over 100 MB of pixels, while a thumbnail or a preview
+# that fits the window needs a tiny fraction of that.
+
+def exif_thumbnail(path):
+  # The JPEG thumbnail a camera or scanner may embed in the EXIF block of a
+  # JPEG file, as raw JPEG data, or None.
+  with open(path, 'rb') as handle:
+    data = handle.read(2 + 2 * 65538)
+
+  if data[:2] != b'\xff\xd8':
+    return None
+
+  offset = 2
+
+  while offset + 4 <= len(data):
+    if data[offset:offset + 1] != b'\xff':
+      return None
+
+    marker = data[offset + 1:offset + 2]
+    length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+
+    if marker == b'\xe1' and data[offset + 4:offset + 10] == b'Exif\x00\x00':
+      return ifd1_thumbnail(data[offset + 10:offset + 2 + length])
+    elif marker in [b'\xda', b'\xd9']:
+      return None
+
+    offset += 2 + length
+
+  return None
+
+def ifd1_thumbnail(tiff):
+  # EXIF data is a small TIFF file; the thumbnail is referenced by the
+  # JPEGInterchangeFormat(Length) tags of its second IFD.
+  endian = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+
+  if endian is None:
+    return None
+
+  short = lambda offset: struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+  integer = lambda offset: struct.unpack(endian + 'I', tiff[offset:offset + 4])[0]
+
+  try:
+    ifd0 = integer(4)
+    ifd1 = integer(ifd0 + 2 + 12 * short(ifd0))
+
+    if ifd1 == 0:
+      return None
+
+    entries = {}
+
+    for index in range(short(ifd1)):
+      entry = ifd1 + 2 + 12 * index
+      entries[short(entry)] = integer(entry + 8) if short(entry + 2) == 4 else short(entry + 8)
+  except struct.error:
+    return None
+
+  start, length = entries.get(0x201), entries.get(0x202)
+
+  if not start or not length or start + length > len(tiff):
+    return None
+
+  return tiff[start:start + length]
+
+def same_shape(size, other):
+  return abs(float(size.width()) / size.height() - float(other.width()) / other.height()) < 0.02
+
+def read(path, width, height):
+  # Returns (image, size): the image decoded at roughly the smallest
+  # resolution that still fills width x height, and the full size of the
+  # original. The result may be larger than asked for; it is never scaled up.
+  reader = QImageReader(path)
+  original = reader.size()
+
+  if not original.isValid() or original.isEmpty():
+    image = QImage(path)
+    return image, image.size()
+
+  target = original.scaled(width, height, Qt.KeepAspectRatio)
+
+  if target.width() >= original.width():
+    return reader.read(), original
+
+  format = reader.format().data().decode('ascii', 'replace').lower()
+
+  if format in ['jpg', 'jpeg']:
+    data = exif_thumbnail(path)
+
+    if data is not None:
+      image = QImage.fromData(data)
+
+      if not image.isNull() and image.width() >= target.width() and same_shape(image.size(), original):
+        return image, original
+
+  # Pyramidal TIFFs store reduced-resolution copies as further images.
+  if format in ['tif', 'tiff'] and reader.imageCount() > 1:
+    best = None
+
+    for index in range(1, reader.imageCount()):
+      if not reader.jumpToImage(index):
+        break
+
+      size = reader.size()
+
+      if size.width() >= target.width() and same_shape(size, original) and (best is None or size.width() < best[1].width()):
+        best = (index, size)
+
+    if best is not None:
+      reader = QImageReader(path)
+      reader.jumpToImage(best[0])
+      image = reader.read()
+
+      if not image.isNull():
+        return image, original
+
+    reader = QImageReader(path)
+
+  # The JPEG plugin turns a scaled size into DCT scaling, decoding at 1/2,
+  # 1/4 or 1/8 of the resolution directly; other formats are scaled while
+  # being read instead of being held at full size by the caller.
+  reader.setScaledSize(target)
+  image = reader.read()
+
+  if image.isNull():
+    image = QImage(path)
+
+    if not image.isNull():
+      image = image.scaled(target, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+  return image, original
@@ -0,0 +1,142 @@
+import os, re, time, threading
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+
+# The first bytes of the image formats pages can be made of.
+SIGNATURES = [
+  b'\xff\xd8\xff',                # JPEG
+  b'\x89PNG\r\n\x1a\n',           # PNG
+  b'II*\x00', b'MM\x00*',         # TIFF
+  b'BM'                           # BMP
+]
+
+def natural_key(text):
+  # "page_2" sorts before "page_10"; digits and text alternate, so keys
+  # always compare like with like.
+  return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', text)]
+
+def path_key(name):
+  # The order scan() lists a relative path in: at every level the files come
+  # before the subdirectories, each in natural order, so "page_1" sorts
+  # before "a/page_1".
+  parts = re.split(r'[\\/]', name)
+
+  return [(1, natural_key(part), part) for part in parts[:-1]] + [(0, natural_key(parts[-1]), parts[-1])]
+
+def is_image(path):
+  # By content rather than by extension: scans are often named .TIF, .jpe or
+  # nothing at all, and other files in the folder may have any name.
+  try:
+    with open(path, 'rb') as handle:
+      head = handle.read(8)
+  except (IOError, OSError):
+    return False
+
+  return any(head.startswith(signature) for signature in SIGNATURES)
+
+def scan(directory, recursive=False):
+  # The files in a directory in natural order, followed by those of its
+  # subdirectories if asked for.
+  files = []
+  directories = []
+
+  try:
+    for entry in os.scandir(directory):
+      try:
+        if entry.is_file():
+          files.append(entry)
+        elif recursive and entry.is_dir(follow_symlinks=False):
+          directories.append(entry)
+      except OSError:
+        pass
+  except OSError:
+    return
+
+  for entry in sorted(files, key=lambda entry: natural_key(entry.name)):
+    yield entry.path
+
+  for entry in sorted(directories, key=lambda entry: natural_key(entry.name)):
+    for path in scan(entry.path, True):
+      yield path
+
+class NaturalListItem(QListWidgetItem):
+  # Keeps sorted list widgets in the order the files were found in.
+  def __lt__(self, other):
+    return path_key(str(self.text())) < path_key(str(other.text()))
+
+class Importer(QThread):
+  # Lists files off the GUI thread and hands them over in batches of
+  # (path, name, image) tuples, where name is the path relative to the folder
+  # that was asked for. Scans queue up behind each other until cancelled;
+  # batches carry the generation they were found in, so that receivers can
+  # drop the ones still on their way after a cancel().
+  batchSize = 256
+
+  # Seconds after which a batch is sent even if it is not full.
+  interval = 0.1
+
+  def __init__(self, parent = None):
+    super(Importer, self).__init__(parent)
+
+    self.jobs = []
+    self.generation = 0
+    self.running = False
+    self.lock = threading.Lock()
+
+  def scan(self, paths, recursive=False):
+    with self.lock:
+      self.jobs.append(([str(path) for path in paths], recursive, self.generation))
+
+      if self.running:
+        return
+
+      self.running = True
+
+    self.wait()
+    self.start()
+
+  def cancel(self):
+    with self.lock:
+      self.jobs = []
+      self.generation += 1
+
+  def stop(self):
+    self.cancel()
+    self.wait()
+
+  def walk(self, paths, recursive):
+    for path in paths:
+      if os.path.isdir(path):
+        for filename in scan(path, recursive):
+          yield filename, os.path.relpath(filename, path)
+      else:
+        yield path, os.path.basename(path)
+
+  def run(self):
+    while True:
+      with self.lock:
+        if not self.jobs:
+          self.running = False
+          break
+
+        paths, recursive, generation = self.jobs.pop(0)
+
+      batch = []
+      sent = time.time()
+
+      for path, name in self.walk(paths, recursive):
+        if self.generation != generation:
+          batch = []
+          break
+
+        batch.append((path, name, is_image(path)))
+
+        if len(batch) >= self.batchSize or time.time() - sent > self.interval:
+          self.emit(SIGNAL('found(int, PyQt_PyObject)'), generation, batch)
+
+          batch = []
+          sent = time.time()
+
+      if batch:
+        self.emit(SIGNAL('found(int, PyQt_PyObject)'), generation, batch)
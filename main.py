@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import sys, os, warnings, glob
+import sys, os, warnings, glob, multiprocessing
 
 with warnings.catch_warnings():
   warnings.simplefilter('ignore')
@@ -17,13 +17,16 @@ except:
 
 from thumbnailer import Thumbnailer
 from previewer import Previewer
+from importer import Importer
 
 from binding.binder import Binder
-from functionality import sorting, dialogs, error
+from binding.preview import PreviewEncoder
+from binding.project import Project
+from functionality import sorting, dialogs, error, projects
 
 from ui import gui, project_files, resources_rc, BookListWidget, ImageViewerWidget
 
-class Bindery(sorting.Sorting, dialogs.Dialogs, error.Error, functions.Bindery, QMainWindow):
+class Bindery(sorting.Sorting, dialogs.Dialogs, error.Error, projects.Projects, functions.Bindery, QMainWindow):
   name = 'Bindery'
   version = '2.7.5'
   caption = ''
@@ -38,14 +41,24 @@ class Bindery(sorting.Sorting, dialogs.Dialogs, error.Error, functions.Bindery,
     self.ui = gui.Ui_MainWindow()
     self.ui.setupUi(self)
     
+    self.setupLog(functions.command_line_value('--log-file'))
+    
     self.setWindowTitle(self.full_name)
     self.previews = True
     
+    # Unsaved until Save As; it still keeps the results of earlier binds.
+    self.project = Project()
+    
+    # The page the encoded preview was made from; it is hidden for others.
+    self.encodedPath = None
+    self.ui.encodedPreview.hide()
+    
     self.projectFiles = QDialog(self)
     self.projectFiles.ui = project_files.Ui_ProjectFilesDialog()
     self.projectFiles.ui.setupUi(self.projectFiles)
 
     self.projectFiles.ui.browseButton1.clicked.connect(self.showFileDialog)
+    self.projectFiles.ui.includeSubfolders.toggled.connect(self.scanInputDirectory)
     self.projectFiles.ui.browseButton2.clicked.connect(self.showSaveDialog)
     self.projectFiles.ui.addToProjectButton.clicked.connect(self.addToProject)
     self.projectFiles.ui.removeFromProjectButton.clicked.connect(self.removeFromProject)
@@ -97,17 +110,29 @@ class Bindery(sorting.Sorting, dialogs.Dialogs, error.Error, functions.Bindery,
     self.ui.removePageMenuItem.setEnabled(False)
     
     
-    self.thumbnailer = Thumbnailer(self.ui.pageList)
+    self.thumbnailer = Thumbnailer()
     self.previewer = Previewer()
+    self.previewEncoder = PreviewEncoder()
+    self.pageImporter = Importer()
+    self.folderImporter = Importer()
     self.binder = Binder()
     
-    self.connect(self.thumbnailer, SIGNAL('makeIcon(int, QImage)'), self.makeIcon)
-    self.connect(self.previewer, SIGNAL('previewPage(QImage)'), self.previewPage)    
-    
-    self.connect(self.binder, SIGNAL('updateProgress(int, QString)'), self.updateProgress)
-    self.connect(self.binder, SIGNAL('updateBackground(int, QColor)'), self.updateBackground)
+    self.connect(self.ui.pageList.pageModel, SIGNAL('iconRequested(QString)'), self.thumbnailer.request)
+    self.connect(self.thumbnailer, SIGNAL('makeIcon(QString, QImage)'), self.makeIcon)
+    self.connect(self.previewer, SIGNAL('previewPage(QString, QImage, QSize)'), self.previewPage)
+    self.connect(self.previewer, SIGNAL('levelReady(QString, int, QString)'), self.previewLevel)    
+    self.connect(self.ui.pagePreview, SIGNAL('levelWanted(QString, int)'), self.previewer.want, Qt.QueuedConnection)
+    self.connect(self.previewEncoder, SIGNAL('encodedPage(QString, QImage, QSize, int, double)'), self.encodedPage)
+    self.connect(self.previewEncoder, SIGNAL('error(QString)'), self.encodedPreviewError)
+    self.connect(self.pageImporter, SIGNAL('found(int, PyQt_PyObject)'), self.pagesFound)
+    self.connect(self.folderImporter, SIGNAL('found(int, PyQt_PyObject)'), self.projectFilesFound)
+    
+    self.connect(self.binder.progress, SIGNAL('updateProgress(int, QString)'), self.updateProgress)
+    self.connect(self.binder.progress, SIGNAL('updateBackgrounds(PyQt_PyObject)'), self.updateBackgrounds)
     self.connect(self.binder, SIGNAL('finishedBinding'), self.finishedBinding)
     self.connect(self.binder, SIGNAL('error(QString)'), self.error)
+    self.connect(self.binder, SIGNAL('encoderEvent(PyQt_PyObject)'), self.encoderEvent)
+    self.connect(self.binder, SIGNAL('toolReport(QString)'), self.toolReport)
     
     self.checkDependencies()
     
@@ -122,7 +147,6 @@ class Bindery(sorting.Sorting, dialogs.Dialogs, error.Error, functions.Bindery,
     
     self.itemSelectionChanged()
     self.hideBackground()
-    self.thumbnailer.start()
   
   def closeEvent(self, event):
     if self.binder.isRunning():
@@ -130,6 +154,15 @@ class Bindery(sorting.Sorting, dialogs.Dialogs, error.Error, functions.Bindery,
         event.accept()
       else:
         event.ignore()
+    
+    if event.isAccepted():
+      if self.binder.isRunning():
+        self.binder.stop()
+      
+      self.pageImporter.stop()
+      self.folderImporter.stop()
+      self.thumbnailer.stop()
+      self.previewEncoder.stop()
   
   def QIconFromTheme(self, name):
     if QIcon.hasThemeIcon(name):
@@ -138,6 +171,10 @@ class Bindery(sorting.Sorting, dialogs.Dialogs, error.Error, functions.Bindery,
       return QIcon(':/icons/{0}.png'.format(name))
 
 if __name__ == '__main__':
+  # The image workers start this script again in the frozen Windows build;
+  # there they have to be told apart from the application before it starts.
+  multiprocessing.freeze_support()
+  
   app = QApplication(sys.argv)
   
   bindery = Bindery()
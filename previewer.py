@@ -1,12 +1,316 @@
+import os, math, atexit, shutil, hashlib, tempfile, threading, collections
+
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+import imagereader
+
+TILE = 256
+
+def levels(width, height):
+  # Level n holds the page at 1/2^n of its resolution; the last level is the
+  # first one that fits in a couple of tiles.
+  count = 1
+
+  while max(width, height) > 2 * TILE * 2 ** (count - 1):
+    count += 1
+
+  return count
+
+def level_size(size, level):
+  factor = 2 ** level
+
+  return QSize(int(math.ceil(float(size.width()) / factor)), int(math.ceil(float(size.height()) / factor)))
+
+class PreviewCache(object):
+  # Pane-sized decodes of the pages viewed or prefetched recently, bounded by
+  # the memory their pixels take.
+  def __init__(self, limit=96 * 1024 * 1024):
+    self.limit = limit
+    self.used = 0
+    self.images = collections.OrderedDict()
+    self.lock = threading.Lock()
+
+  def key(self, path, size):
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      mtime = None
+
+    return (path, mtime, size[0], size[1])
+
+  def get(self, key):
+    with self.lock:
+      if key not in self.images:
+        return None
+
+      entry = self.images.pop(key)
+      self.images[key] = entry
+
+      return entry
+
+  def put(self, key, image, original):
+    cost = image.byteCount()
+
+    with self.lock:
+      if key in self.images:
+        self.used -= self.images.pop(key)[0].byteCount()
+
+      self.images[key] = (image, original)
+      self.used += cost
+
+      while self.used > self.limit and len(self.images) > 1:
+        self.used -= self.images.popitem(last=False)[1][0].byteCount()
+
+  def clear(self):
+    with self.lock:
+      self.images.clear()
+      self.used = 0
+
 class Previewer(QThread):
+  # Pages this far before and after the selected one are decoded ahead.
+  prefetch = 2
+
+  # Bytes of tiles kept on disk; the levels used least recently go first.
+  tileLimit = 256 * 1024 * 1024
+
+  # Bytes of decoded pixels kept between levels of the same page.
+  decodeLimit = 64 * 1024 * 1024
+
   def __init__(self, parent = None):
     super(Previewer, self).__init__(parent)
-    
+
     self.image = None
     self.size = [None, None]
+    self.neighbours = []
+    self.fresh = False
+    self.wanted = []
+    self.original = QSize()
+
+    self.cache = PreviewCache()
+    self.lock = threading.Lock()
+    self.running = False
+
+    # The finest decode of the page on show, as (key, level, image), so that
+    # coarser levels are halved from it instead of decoding the page again.
+    self.decoded = None
+
+    # Tiles live for the session only; pages that are viewed again reuse
+    # them.
+    self.directory = tempfile.mkdtemp(prefix='bindery-tiles-')
+    self.used = 0
+    atexit.register(shutil.rmtree, self.directory, True)
+
+  def show(self, path, size, neighbours=()):
+    # Replaces whatever was asked for before; work for an earlier page stops
+    # at its next check of superseded().
+    with self.lock:
+      if path != self.image:
+        self.wanted = []
+        self.original = QSize()
+
+      self.image = path
+      self.size = list(size)
+      self.neighbours = list(neighbours)
+      self.fresh = True
+
+    self.start()
+
+  def want(self, path, level):
+    # Asked for by the viewer when it is zoomed in past what it has; levels
+    # are only cut once somebody looks at them.
+    path = str(path)
+
+    with self.lock:
+      if path != self.image or level in self.wanted:
+        return
+
+      self.wanted.append(level)
+
+    self.start()
+
+  def start(self):
+    with self.lock:
+      if self.running:
+        # The loop in run() picks up the new page.
+        return
+
+      self.running = True
+
+    self.wait()
+
+    super(Previewer, self).start()
+
+  def superseded(self, path):
+    return self.image != path
+
+  def load(self, path, size):
+    key = self.cache.key(path, size)
+    entry = self.cache.get(key)
+
+    if entry is None:
+      entry = imagereader.read(path, *size)
+
+      if not entry[0].isNull():
+        self.cache.put(key, *entry)
+
+    return entry
 
   def run(self):
-    self.emit(SIGNAL('previewPage(QImage)'), QImage(self.image))
+    while True:
+      with self.lock:
+        path, size, neighbours, fresh = self.image, list(self.size), list(self.neighbours), self.fresh
+        self.fresh = False
+
+      if fresh:
+        # The decode kept for another page is of no more use.
+        if self.decoded is not None and self.decoded[0] != self.key(path):
+          self.decoded = None
+
+        # Decoded at the size of the preview pane first, so that the page
+        # shows up at once; the original size is sent along so that the
+        # viewer can keep working in page pixels.
+        image, original = self.load(path, size)
+
+        with self.lock:
+          if not self.superseded(path):
+            self.original = original
+
+        self.emit(SIGNAL('previewPage(QString, QImage, QSize)'), path, image, original)
+
+        # Then the pages the user is likely to look at next.
+        for neighbour in neighbours:
+          if self.superseded(path):
+            break
+
+          self.load(neighbour, size)
+
+      while not self.superseded(path):
+        with self.lock:
+          if not self.wanted or not self.original.isValid():
+            break
+
+          level, original = self.wanted.pop(0), QSize(self.original)
+
+        self.level(path, original, level)
+
+      with self.lock:
+        if not self.fresh and (not self.wanted or not self.original.isValid()):
+          self.running = False
+          break
+
+  def key(self, path):
+    try:
+      mtime = os.stat(path).st_mtime
+    except OSError:
+      return None
+
+    return hashlib.md5('{0}:{1}'.format(os.path.abspath(path), mtime).encode('utf8')).hexdigest()
+
+  def decode(self, path, key, original, level):
+    # The page at the size of a level: halved from the kept decode when that
+    # is finer, decoded from the file (at a reduced size where the format
+    # allows it) otherwise.
+    if self.decoded is not None and self.decoded[0] == key and self.decoded[1] <= level:
+      have, image = self.decoded[1], self.decoded[2]
+    else:
+      target = level_size(original, level)
+      image = imagereader.read(path, target.width(), target.height())[0]
+
+      if image.isNull():
+        return None
+
+      if image.size() != target:
+        image = image.scaled(target, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+      have = level
+
+      # Kept for the coarser levels, halved until it is small enough to be
+      # held on to.
+      kept, at = image, have
+
+      while kept.byteCount() > self.decodeLimit:
+        at += 1
+        kept = kept.scaled(level_size(original, at), Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+      self.decoded = (key, at, kept)
+
+    while have < level:
+      have += 1
+      image = image.scaled(level_size(original, have), Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+    return image
+
+  def level(self, path, original, level):
+    # Cuts one level into tiles, unless an earlier look at the page already
+    # did, and announces it once all of its tiles are on disk.
+    key = self.key(path)
+
+    if key is None:
+      return
+
+    level = max(0, min(level, levels(original.width(), original.height()) - 1))
+    directory = os.path.join(self.directory, key, str(level))
+    done = os.path.join(directory, 'done')
+
+    if os.path.exists(done):
+      os.utime(done, None)
+    else:
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+      image = self.decode(path, key, original, level)
+
+      if image is None:
+        return
+
+      size = image.size()
+      written = 0
+
+      for y in range(0, size.height(), TILE):
+        for x in range(0, size.width(), TILE):
+          if self.superseded(path):
+            return
+
+          filename = os.path.join(directory, '{0}_{1}.png'.format(y // TILE, x // TILE))
+          image.copy(x, y, min(TILE, size.width() - x), min(TILE, size.height() - y)).save(filename, 'PNG', 80)
+          written += os.path.getsize(filename)
+
+      del image
+
+      open(done, 'w').close()
+
+      self.used += written
+
+      if self.used > self.tileLimit:
+        self.prune()
+
+    self.emit(SIGNAL('levelReady(QString, int, QString)'), path, level, directory)
+
+  def prune(self):
+    # Removes the levels used least recently, by the time of their 'done'
+    # marker, until the tiles fit in nine tenths of the limit.
+    entries = []
+
+    for directory, folders, files in os.walk(self.directory):
+      if 'done' not in files:
+        continue
+
+      size = 0
+
+      for name in files:
+        try:
+          size += os.path.getsize(os.path.join(directory, name))
+        except OSError:
+          pass
+
+      entries.append((os.stat(os.path.join(directory, 'done')).st_mtime, size, directory))
+
+    self.used = sum(entry[1] for entry in entries)
+
+    for mtime, size, directory in sorted(entries):
+      if self.used <= self.tileLimit * 9 // 10:
+        break
+
+      shutil.rmtree(directory, True)
+      self.used -= size
@@ -0,0 +1,63 @@
+#! /usr/bin/env python
+#
+# Checks that a book written by the native PDF writer comes out of the
+# linearize step as a valid linearized file, the way qpdf sees it.
+#
+#   python -m pytest -q tests
+#
+# Skipped when qpdf is not installed.
+
+import os, sys, shutil, subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+from binding.encoders import pdfwriter
+
+pytestmark = pytest.mark.skipif(shutil.which('qpdf') is None, reason='qpdf is not installed')
+
+def write_book(directory, pages=3):
+  path = os.path.join(directory, 'book.pdf')
+  writer = pdfwriter.PDFWriter(path)
+
+  for number in range(pages):
+    image = os.path.join(directory, '{0}.pgm'.format(number))
+    width, height = 120, 160
+
+    # Grey bars, different on every page, so that no two pages are alike.
+    with open(image, 'wb') as handle:
+      handle.write('P5\n{0} {1}\n255\n'.format(width, height).encode('ascii'))
+      handle.write(bytes((x * (number + 1)) % 256 for y in range(height) for x in range(width)))
+
+    writer.add_page(pdfwriter.pnm_image(image), 300, words=[('Page', 10, 10, 60, 30)] if number == 0 else None)
+
+  writer.close({'Title': 'Linearization test'})
+
+  return path
+
+def linearize(path):
+  target = path + '.linearized'
+  status = subprocess.call(['qpdf', '--linearize', path, target])
+
+  # 3 means that qpdf succeeded with warnings.
+  assert status in (0, 3)
+
+  return target
+
+def test_linearized_book_passes_qpdf_check(tmpdir):
+  book = linearize(write_book(str(tmpdir)))
+
+  process = subprocess.Popen(['qpdf', '--check-linearization', book], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+  output = process.communicate()[0]
+
+  assert process.returncode == 0, output
+  assert b'no linearization errors' in output
+
+def test_is_linearized(tmpdir):
+  book = write_book(str(tmpdir))
+
+  assert not pdfwriter.is_linearized(book)
+  assert pdfwriter.is_linearized(linearize(book))
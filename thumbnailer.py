@@ -1,29 +1,149 @@
+import os, hashlib, threading
+
+from concurrent.futures import ThreadPoolExecutor
+
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+import imagereader
+
+class ThumbnailCache(object):
+  # Thumbnails shared with other desktop applications, following the
+  # freedesktop.org thumbnail specification: a 128px PNG named after the MD5
+  # of the file's URI, valid while its Thumb::MTime matches the file.
+  size = 128
+
+  def __init__(self, directory=None):
+    if directory is None:
+      base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+      directory = os.path.join(base, 'thumbnails', 'normal')
+
+    self.directory = directory
+
+  def uri(self, path):
+    return QUrl.fromLocalFile(os.path.abspath(path)).toEncoded().data()
+
+  def filename(self, path):
+    return os.path.join(self.directory, hashlib.md5(self.uri(path)).hexdigest() + '.png')
+
+  def load(self, path, mtime):
+    filename = self.filename(path)
+
+    if not os.path.isfile(filename):
+      return None
+
+    image = QImage(filename)
+
+    if image.isNull() or str(image.text('Thumb::MTime')) != str(int(mtime)):
+      return None
+
+    return image
+
+  def save(self, path, mtime, image):
+    image = QImage(image)
+    image.setText('Thumb::URI', self.uri(path).decode('utf8'))
+    image.setText('Thumb::MTime', str(int(mtime)))
+    image.setText('Software', 'Bindery')
+
+    filename = self.filename(path)
+    temp = '{0}.{1}.tmp'.format(filename, threading.current_thread().ident)
+
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory, 0o700)
+
+      # Written under a temporary name so that other readers never see a
+      # half-written file.
+      if image.save(temp, 'PNG'):
+        os.chmod(temp, 0o600)
+        os.rename(temp, filename)
+    except OSError:
+      pass
+
+def thumbnail(path, cache, size=72):
+  # Runs on a pool thread; QImage (unlike QPixmap) may be used off the GUI
+  # thread.
+  try:
+    mtime = os.stat(path).st_mtime
+  except OSError:
+    return None
+
+  image = cache.load(path, mtime)
+
+  if image is None:
+    image = imagereader.read(path, 2 * cache.size, 2 * cache.size)[0]
+
+    if image.isNull():
+      return None
+
+    image = image.scaled(cache.size, cache.size, aspectRatioMode=Qt.KeepAspectRatio, transformMode=Qt.SmoothTransformation)
+
+    cache.save(path, mtime, image)
+
+  return image.scaled(size, size, aspectRatioMode=Qt.KeepAspectRatio, transformMode=Qt.SmoothTransformation)
+
 class Thumbnailer(QThread):
-  def __init__(self, ListWidget, parent = None):
+  # Makes thumbnails for the paths the page list asks for. Requests are
+  # served newest first: they come from rows the view is painting, so the
+  # latest ones are on screen.
+  def __init__(self, parent = None):
     super(Thumbnailer, self).__init__(parent)
-    
-    self.widget = ListWidget
-    self.running = False
+
     self.die = False
-  
+
+    self.cache = ThumbnailCache()
+    self.workers = max(1, QThread.idealThreadCount())
+
+    self.condition = threading.Condition()
+    self.requests = []
+
+  def request(self, path):
+    path = str(path)
+
+    with self.condition:
+      if path in self.requests:
+        self.requests.remove(path)
+
+      self.requests.append(path)
+      self.condition.notify()
+
+    if not self.isRunning():
+      self.die = False
+      self.start()
+
+  def clear(self):
+    with self.condition:
+      self.requests = []
+
+  def stop(self):
+    with self.condition:
+      self.die = True
+      self.condition.notify()
+
+    self.wait()
+
   def run(self):
-    self.running = True
-    
-    for i in range(self.widget.count()):
-      item = self.widget.item(i)
-      
-      if item.defaultIcon and not self.die:
-        icon = QImage(item.path).scaled(800, 600, aspectRatioMode=Qt.KeepAspectRatio).scaled(72, 72, aspectRatioMode=Qt.KeepAspectRatio, transformMode = Qt.SmoothTransformation)
-        
-        self.emit(SIGNAL('makeIcon(int, QImage)'), i, icon)
-        item.defaultIcon = False
-      elif self.die:
-        for j in range(self.widget.count()):
-          self.widget.item(j).removeIcon()
-        
-        break
-    
-    self.running = False
+    pool = ThreadPoolExecutor(self.workers)
+
+    try:
+      while True:
+        with self.condition:
+          while not self.requests and not self.die:
+            self.condition.wait()
+
+          if self.die:
+            break
+
+          # Small batches, so that newer requests overtake older ones.
+          batch = self.requests[-2 * self.workers:][::-1]
+          del self.requests[-2 * self.workers:]
+
+        futures = [(path, pool.submit(thumbnail, path, self.cache)) for path in batch]
+
+        for path, future in futures:
+          icon = future.result()
+
+          if icon is not None:
+            self.emit(SIGNAL('makeIcon(QString, QImage)'), path, icon)
+    finally:
+      pool.shutdown()
@@ -13,10 +13,197 @@ def QIconFromTheme(name):
   else:
     return QIcon(':/icons/{0}.png'.format(name))
 
-class BookListWidget(QListWidget):
+class BookPage(organizer.Page):
+  # A page of the book as listed in the main window. Pages are plain objects;
+  # everything the view shows for them comes from BookListModel.
+  def __init__(self, text='', filepath=''):
+    organizer.Page.__init__(self, str(filepath))
+
+    self.number = 0
+    self.filename = os.path.split(self.path)[-1]
+    self.label = str(text) or self.filename
+    self.background = None
+
+class BookListModel(QAbstractListModel):
+  # Holds the pages in order plus a path -> row index, so that duplicate
+  # checks and lookups do not scan the whole book. Icons are only created
+  # when the view asks for a row it is about to paint, and only the most
+  # recently used ones are kept.
+  cachedIcons = 512
+
+  def __init__(self, parent = None):
+    super(BookListModel, self).__init__(parent)
+
+    self.pages = []
+    self.rows = {}
+    self.icons = collections.OrderedDict()
+    self.requested = set()
+    self.previews = True
+    self.placeholder = QIconFromTheme('image-loading')
+
+  def reindex(self, start=0):
+    for row in range(start, len(self.pages)):
+      self.rows[self.pages[row].path] = row
+
+  def rowCount(self, parent=QModelIndex()):
+    return 0 if parent.isValid() else len(self.pages)
+
+  def data(self, index, role=Qt.DisplayRole):
+    if not index.isValid() or index.row() >= len(self.pages):
+      return None
+
+    page = self.pages[index.row()]
+
+    if role == Qt.DisplayRole:
+      return page.label
+    elif role == Qt.ToolTipRole:
+      return page.path
+    elif role == Qt.BackgroundRole:
+      return page.background
+    elif role == Qt.SizeHintRole:
+      return QSize(72, 72) if self.previews else QSize(-1, 20)
+    elif role == Qt.DecorationRole and self.previews:
+      return self.icon(page.path)
+
+    return None
+
+  def icon(self, path):
+    if path in self.icons:
+      icon = self.icons.pop(path)
+      self.icons[path] = icon
+
+      return icon
+
+    if path not in self.requested:
+      self.requested.add(path)
+      self.emit(SIGNAL('iconRequested(QString)'), path)
+
+    return self.placeholder
+
+  def setIcon(self, path, image):
+    path = str(path)
+    self.requested.discard(path)
+
+    if path not in self.rows:
+      return
+
+    self.icons[path] = QIcon(QPixmap.fromImage(image))
+
+    while len(self.icons) > self.cachedIcons:
+      self.icons.popitem(last=False)
+
+    index = self.index(self.rows[path])
+    self.emit(SIGNAL('dataChanged(QModelIndex, QModelIndex)'), index, index)
+
+  def resetIcons(self):
+    self.icons.clear()
+    self.requested.clear()
+    self.refresh()
+
+  def setPreviews(self, previews):
+    self.previews = previews
+    self.resetIcons()
+
+    # Row heights change with the previews.
+    self.emit(SIGNAL('layoutChanged()'))
+
+  def setBackground(self, row, color):
+    if 0 <= row < len(self.pages):
+      self.pages[row].background = color
+
+      index = self.index(row)
+      self.emit(SIGNAL('dataChanged(QModelIndex, QModelIndex)'), index, index)
+
+  def setBackgrounds(self, colors):
+    # One change covering all the rows, however many there are.
+    rows = [row for row in colors if 0 <= row < len(self.pages)]
+
+    if not rows:
+      return
+
+    for row in rows:
+      self.pages[row].background = colors[row]
+
+    self.emit(SIGNAL('dataChanged(QModelIndex, QModelIndex)'), self.index(min(rows)), self.index(max(rows)))
+
+  def clearBackgrounds(self):
+    for page in self.pages:
+      page.background = None
+
+    self.refresh()
+
+  def refresh(self):
+    if self.pages:
+      self.emit(SIGNAL('dataChanged(QModelIndex, QModelIndex)'), self.index(0), self.index(len(self.pages) - 1))
+
+  def contains(self, path):
+    return os.path.abspath(str(path)) in self.rows
+
+  def insertPages(self, row, pages):
+    # Inserts the pages that are not in the book yet as one block and returns
+    # them.
+    fresh = []
+    paths = set()
+
+    for page in pages:
+      if page.path not in self.rows and page.path not in paths:
+        fresh.append(page)
+        paths.add(page.path)
+
+    if not fresh:
+      return fresh
+
+    row = len(self.pages) if row is None or row < 0 or row > len(self.pages) else row
+
+    self.beginInsertRows(QModelIndex(), row, row + len(fresh) - 1)
+    self.pages[row:row] = fresh
+    self.reindex(row)
+    self.endInsertRows()
+
+    return fresh
+
+  def takePages(self, rows):
+    # Removes the given rows, one contiguous block at a time starting from
+    # the end, and returns the pages in their original order.
+    rows = sorted(set(row for row in rows if 0 <= row < len(self.pages)))
+    taken = []
+
+    while rows:
+      last = rows.pop()
+      first = last
+
+      while rows and rows[-1] == first - 1:
+        first = rows.pop()
+
+      self.beginRemoveRows(QModelIndex(), first, last)
+      block = self.pages[first:last + 1]
+      del self.pages[first:last + 1]
+
+      for page in block:
+        del self.rows[page.path]
+        self.icons.pop(page.path, None)
+        self.requested.discard(page.path)
+
+      self.endRemoveRows()
+      taken[0:0] = block
+
+    self.reindex()
+
+    return taken
+
+  def removeRows(self, row, count, parent=QModelIndex()):
+    if parent.isValid() or count <= 0:
+      return False
+
+    return len(self.takePages(range(row, row + count))) == count
+
+class BookListWidget(QListView):
   def __init__(self, type, parent = None):
     super(BookListWidget, self).__init__(parent)
-    
+
+    self.pageModel = BookListModel(self)
+    self.setModel(self.pageModel)
+
     self.setSelectionMode(QAbstractItemView.ExtendedSelection)
     self.setDragEnabled(False)
     #self.setDragDropMode(QAbstractItemView.InternalMove)
@@ -25,6 +212,69 @@ class BookListWidget(QListWidget):
     self.setAlternatingRowColors(True)
     self.setIconSize(QSize(72, 72))
 
+  def selectionChanged(self, selected, deselected):
+    super(BookListWidget, self).selectionChanged(selected, deselected)
+    self.emit(SIGNAL('itemSelectionChanged()'))
+
+  # The part of the QListWidget interface used by the main window, working on
+  # BookPage objects instead of items.
+
+  def count(self):
+    return len(self.pageModel.pages)
+
+  def item(self, row):
+    return self.pageModel.pages[row] if 0 <= row < len(self.pageModel.pages) else None
+
+  def row(self, page):
+    return self.pageModel.rows.get(page.path, -1) if page is not None else -1
+
+  def pages(self):
+    return list(self.pageModel.pages)
+
+  def selectedRows(self):
+    return sorted(index.row() for index in self.selectionModel().selectedIndexes())
+
+  def selectedItems(self):
+    return [self.pageModel.pages[row] for row in self.selectedRows()]
+
+  def currentItem(self):
+    return self.item(self.currentIndex().row())
+
+  def setCurrentRow(self, row):
+    self.setCurrentIndex(self.pageModel.index(row))
+
+  def contains(self, path):
+    return self.pageModel.contains(path)
+
+  def insertItems(self, row, pages):
+    return self.pageModel.insertPages(row, pages)
+
+  def addItems(self, pages):
+    return self.pageModel.insertPages(None, pages)
+
+  def insertItem(self, row, page):
+    self.pageModel.insertPages(row, [page])
+
+  def addItem(self, page):
+    self.pageModel.insertPages(None, [page])
+
+  def takeItems(self, rows):
+    return self.pageModel.takePages(rows)
+
+  def takeItem(self, row):
+    taken = self.pageModel.takePages([row])
+
+    return taken[0] if taken else None
+
+  def setBackground(self, row, color):
+    self.pageModel.setBackground(row, color)
+
+  def setBackgrounds(self, colors):
+    self.pageModel.setBackgrounds(colors)
+
+  def clearBackgrounds(self):
+    self.pageModel.clearBackgrounds()
+
   def dragEnterEvent(self, event):
     if event.mimeData().hasUrls:
       event.accept()
@@ -48,9 +298,9 @@ class BookListWidget(QListWidget):
     elif event.mimeData().hasUrls:
       event.setDropAction(Qt.CopyAction)
       event.accept()
-      
+
       links = []
-      
+
       for url in event.mimeData().urls():
         links.append(str(url.toLocalFile()))
       if platform.system() == 'Windows':
@@ -59,27 +309,3 @@ class BookListWidget(QListWidget):
         self.emit(SIGNAL('dropped(QStringList)'), links)
     else:
       event.ignore()
-
-
-class BookListWidgetItem(QListWidgetItem, organizer.Page):
-  def __init__(self, text='', filepath='', parent=None):    
-    QListWidgetItem.__init__(self)
-    organizer.Page.__init__(self, str(filepath))
-    
-    self.defaultIcon = True
-    self.number = 0
-    
-    self.filename = os.path.split(self.path)[-1]
-    
-    self.setText(text)
-    self.setSizeHint(QSize(72, 72))
-    self.resetIcon()
-  
-  def resetIcon(self):
-    self.setIcon(QIconFromTheme('image-loading'))
-    self.defaultIcon = True
-  
-  def removeIcon(self):
-    self.setSizeHint(QSize(-1, 20))
-    self.setIcon(QIcon())
-    self.defaultIcon = True
@@ -1,89 +1,187 @@
+import os, math, collections
+
 from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 
+TILE = 256
+
+class TileCache(object):
+  # The most recently drawn tiles, as pixmaps ready to paint.
+  def __init__(self, limit=256):
+    self.limit = limit
+    self.tiles = collections.OrderedDict()
+
+  def get(self, key, filename):
+    if key in self.tiles:
+      pixmap = self.tiles.pop(key)
+      self.tiles[key] = pixmap
+
+      return pixmap
+
+    if not os.path.isfile(filename):
+      return None
+
+    pixmap = QPixmap(filename)
+
+    if pixmap.isNull():
+      return None
+
+    self.tiles[key] = pixmap
+
+    while len(self.tiles) > self.limit:
+      self.tiles.popitem(last=False)
+
+    return pixmap
+
+  def clear(self):
+    self.tiles.clear()
+
+class TiledPageItem(QGraphicsItem):
+  # A page in page pixels. The small preview is always drawn first; tiles of
+  # the pyramid level closest to the current zoom are drawn over it once the
+  # Previewer has produced them. Levels are asked for through request() the
+  # first time the zoom needs more detail than the preview has.
+  def __init__(self, path, preview, size, cache, request = None, parent = None):
+    super(TiledPageItem, self).__init__(parent)
+
+    self.path = path
+    self.preview = QPixmap.fromImage(preview)
+    self.size = size
+    self.cache = cache
+    self.request = request
+    self.levels = {}
+    self.requested = set()
+
+    self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+  def boundingRect(self):
+    return QRectF(0, 0, self.size.width(), self.size.height())
+
+  def addLevel(self, level, directory):
+    self.levels[level] = directory
+    self.update()
+
+  def level(self, scale):
+    # The coarsest level that still has at least one source pixel per screen
+    # pixel, or the closest one that is ready.
+    wanted = int(math.floor(math.log(1.0 / scale, 2))) if scale < 1 else 0
+
+    # The preview is enough until the zoom goes past its resolution.
+    sharper = self.preview.isNull() or self.size.width() > self.preview.width() * 2 ** wanted
+
+    if sharper and wanted not in self.levels and wanted not in self.requested and self.request is not None:
+      self.requested.add(wanted)
+      self.request(wanted)
+
+    finer = [level for level in self.levels if level <= wanted]
+    coarser = [level for level in self.levels if level > wanted]
+
+    if finer:
+      return max(finer)
+    elif coarser:
+      return min(coarser)
+
+    return None
+
+  def paint(self, painter, option, widget = None):
+    bounds = self.boundingRect()
+    exposed = option.exposedRect.intersected(bounds)
+
+    if exposed.isEmpty():
+      return
+
+    painter.setClipRect(bounds)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+
+    if not self.preview.isNull():
+      ratio = float(self.preview.width()) / bounds.width()
+      source = QRectF(exposed.x() * ratio, exposed.y() * ratio, exposed.width() * ratio, exposed.height() * ratio)
+      painter.drawPixmap(exposed, self.preview, source)
+
+    level = self.level(option.levelOfDetailFromTransform(painter.worldTransform()))
+
+    if level is None:
+      return
+
+    span = TILE * 2 ** level
+
+    for y in range(int(exposed.top() // span), int(math.ceil(exposed.bottom() / span))):
+      for x in range(int(exposed.left() // span), int(math.ceil(exposed.right() / span))):
+        pixmap = self.cache.get((self.path, level, x, y), os.path.join(self.levels[level], '{0}_{1}.png'.format(y, x)))
+
+        if pixmap is not None:
+          target = QRectF(x * span, y * span, pixmap.width() * 2 ** level, pixmap.height() * 2 ** level)
+          painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+
 class ImageViewerWidget(QGraphicsView):
+  minimumZoom = 0.25
+  maximumZoom = 4.0
+
   def __init__(self, type, parent = None):
     super(ImageViewerWidget, self).__init__(parent)
-    
+
     self.lastClick = None
-    
+    self.page = None
+    self.cache = TileCache()
+
+    self.setScene(QGraphicsScene(self))
     self.setCursor(Qt.OpenHandCursor)
-    self.setCenter(QPointF(0, 0))
     self.setMouseTracking(True)
 
-  def setCenter(self, centerPoint):
-    visibleArea = self.mapToScene(self.rect()).boundingRect()
-    sceneBounds = self.sceneRect()
-   
-    boundX = visibleArea.width() / 2.0
-    boundY = visibleArea.height() / 2.0
-    boundWidth = sceneBounds.width() - 2.0 * boundX
-    boundHeight = sceneBounds.height() - 2.0 * boundY
-   
-    bounds = QRectF(boundX, boundY, boundWidth, boundHeight)
-   
-    if bounds.contains(centerPoint):
-      self.currentCenter = centerPoint
-    else:
-      if visibleArea.contains(sceneBounds):
-        self.currentCenter = sceneBounds.center()
-      else:
-        self.currentCenter = centerPoint
-   
-        if centerPoint.x() > bounds.x() + bounds.width():
-          self.currentCenter.setX(bounds.x() + bounds.width())
-        elif centerPoint.x() < bounds.x():
-          self.currentCenter.setX(bounds.x())
-   
-        if centerPoint.y() > bounds.y() + bounds.height():
-          self.currentCenter.setY(bounds.y() + bounds.height())
-        elif centerPoint.y() < bounds.y():
-          self.currentCenter.setY(bounds.y())
-   
-    self.centerOn(self.currentCenter)
-  
+    # Zoom around the mouse pointer and only repaint what changed.
+    self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+    self.setResizeAnchor(QGraphicsView.AnchorViewCenter)
+    self.setViewportUpdateMode(QGraphicsView.SmartViewportUpdate)
+    self.setOptimizationFlags(QGraphicsView.DontSavePainterState | QGraphicsView.DontAdjustForAntialiasing)
+
+  def setPage(self, path, preview, size):
+    self.scene().clear()
+    self.cache.clear()
+
+    self.page = TiledPageItem(str(path), preview, size, self.cache, lambda level, path=str(path): self.emit(SIGNAL('levelWanted(QString, int)'), path, level))
+
+    self.scene().addItem(self.page)
+    self.scene().setSceneRect(self.page.boundingRect())
+    self.fitInView(self.page, Qt.KeepAspectRatio)
+
+  def addLevel(self, path, level, directory):
+    if self.page is not None and self.page.path == str(path):
+      self.page.addLevel(level, str(directory))
+
+  def fitZoom(self):
+    if self.page is None:
+      return 1.0
+
+    bounds = self.page.boundingRect()
+
+    return min(self.viewport().width() / bounds.width(), self.viewport().height() / bounds.height())
+
   def wheelEvent(self, event):
-    pointBeforeScale = QPointF(self.mapToScene(event.pos()))
-    screenCenter = self.currentCenter
-    scaleFactor = 1.10
-    
-    if event.delta() > 0:
-      self.scale(scaleFactor, scaleFactor)
-    else:
-      self.scale(1.0 / scaleFactor, 1.0 / scaleFactor)
-   
-    pointAfterScale = self.mapToScene(event.pos())
-    offset = pointBeforeScale - pointAfterScale
-    newCenter = screenCenter + offset
-    
-    self.setCenter(newCenter)
-  
-  def pointWheelEvent(self, point):
-    pointBeforeScale = QPointF(self.mapToScene(point))
-    screenCenter = self.currentCenter
-    scaleFactor = 1.10
-    
-    pointAfterScale = self.mapToScene(point)
-    offset = pointBeforeScale - pointAfterScale
-    newCenter = screenCenter + offset
-    
-    self.setCenter(newCenter)
-  
+    if self.page is None:
+      return
+
+    # Proportional to the wheel movement, so that touchpads zoom smoothly
+    # while a mouse wheel notch is about 20%.
+    zoom = self.transform().m11()
+    target = zoom * 1.0015 ** event.delta()
+    target = max(self.fitZoom() * self.minimumZoom, min(self.maximumZoom, target))
+
+    self.scale(target / zoom, target / zoom)
+
   def mousePressEvent(self, event):
     self.lastClick = event.pos()
     self.setCursor(Qt.ClosedHandCursor)
-  
+
   def mouseReleaseEvent(self, event):
     self.setCursor(Qt.OpenHandCursor)
     self.lastClick = None
-  
+
   def mouseMoveEvent(self, event):
     if self.lastClick != None:
-      delta = QPointF(self.mapToScene(self.lastClick) - self.mapToScene(event.pos()))
+      delta = event.pos() - self.lastClick
       self.lastClick = event.pos()
 
-      self.setCenter(self.currentCenter + delta)
-
-  
-  def resizeEvent(self, event):
-    self.setCenter(self.mapToScene(self.rect()).boundingRect().center())
+      # Scrolling moves the already rendered viewport contents instead of
+      # recomputing the view transform.
+      self.horizontalScrollBar().setValue(self.horizontalScrollBar().value() - delta.x())
+      self.verticalScrollBar().setValue(self.verticalScrollBar().value() - delta.y())
@@ -115,12 +115,33 @@ class Ui_MainWindow(object):
     self.label.setAlignment(QtCore.Qt.AlignCenter)
     self.label.setObjectName(_fromUtf8("label"))
     self.verticalLayout1.addWidget(self.label)
+    self.previewLayout = QtGui.QHBoxLayout()
+    self.previewLayout.setObjectName(_fromUtf8("previewLayout"))
     self.pagePreview = ImageViewerWidget(self.singlePageFrame)
     self.pagePreview.setStyleSheet(_fromUtf8("QGraphicsView {\n"
 "  background-color: rgb(240, 240, 240);\n"
 "}"))
     self.pagePreview.setObjectName(_fromUtf8("pagePreview"))
-    self.verticalLayout1.addWidget(self.pagePreview)
+    self.previewLayout.addWidget(self.pagePreview)
+    self.encodedPreview = ImageViewerWidget(self.singlePageFrame)
+    self.encodedPreview.setStyleSheet(_fromUtf8("QGraphicsView {\n"
+"  background-color: rgb(240, 240, 240);\n"
+"}"))
+    self.encodedPreview.setObjectName(_fromUtf8("encodedPreview"))
+    self.previewLayout.addWidget(self.encodedPreview)
+    self.verticalLayout1.addLayout(self.previewLayout)
+    self.encodedPreviewLayout = QtGui.QHBoxLayout()
+    self.encodedPreviewLayout.setObjectName(_fromUtf8("encodedPreviewLayout"))
+    self.encodePreviewButton = QtGui.QPushButton(self.singlePageFrame)
+    self.encodePreviewButton.setObjectName(_fromUtf8("encodePreviewButton"))
+    self.encodedPreviewLayout.addWidget(self.encodePreviewButton)
+    self.encodedPreviewInfo = QtGui.QLabel(self.singlePageFrame)
+    self.encodedPreviewInfo.setText(_fromUtf8(""))
+    self.encodedPreviewInfo.setObjectName(_fromUtf8("encodedPreviewInfo"))
+    self.encodedPreviewLayout.addWidget(self.encodedPreviewInfo)
+    spacerItem0 = QtGui.QSpacerItem(40, 20, QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Minimum)
+    self.encodedPreviewLayout.addItem(spacerItem0)
+    self.verticalLayout1.addLayout(self.encodedPreviewLayout)
     self.horizontalLayout1 = QtGui.QHBoxLayout()
     self.horizontalLayout1.setObjectName(_fromUtf8("horizontalLayout1"))
     spacerItem1 = QtGui.QSpacerItem(40, 20, QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Minimum)
@@ -388,6 +409,9 @@ class Ui_MainWindow(object):
     self.minidjvuOptions.setCursorPosition(27)
     self.minidjvuOptions.setObjectName(_fromUtf8("minidjvuOptions"))
     self.formLayout.setWidget(6, QtGui.QFormLayout.FieldRole, self.minidjvuOptions)
+    self.djvuIndirect = QtGui.QCheckBox(self.page)
+    self.djvuIndirect.setObjectName(_fromUtf8("djvuIndirect"))
+    self.formLayout.setWidget(7, QtGui.QFormLayout.FieldRole, self.djvuIndirect)
     self.stackedWidget.addWidget(self.page)
     self.page_2 = QtGui.QWidget()
     self.page_2.setObjectName(_fromUtf8("page_2"))
@@ -448,6 +472,17 @@ class Ui_MainWindow(object):
     self.maxIndexedColors.setProperty("value", 4)
     self.maxIndexedColors.setObjectName(_fromUtf8("maxIndexedColors"))
     self.formLayout_4.setWidget(5, QtGui.QFormLayout.FieldRole, self.maxIndexedColors)
+    self.pdfWriterLabel = QtGui.QLabel(self.page_2)
+    self.pdfWriterLabel.setObjectName(_fromUtf8("pdfWriterLabel"))
+    self.formLayout_4.setWidget(6, QtGui.QFormLayout.LabelRole, self.pdfWriterLabel)
+    self.pdfWriter = QtGui.QComboBox(self.page_2)
+    self.pdfWriter.setObjectName(_fromUtf8("pdfWriter"))
+    self.pdfWriter.addItem(_fromUtf8(""))
+    self.pdfWriter.addItem(_fromUtf8(""))
+    self.formLayout_4.setWidget(6, QtGui.QFormLayout.FieldRole, self.pdfWriter)
+    self.pdfLinearize = QtGui.QCheckBox(self.page_2)
+    self.pdfLinearize.setObjectName(_fromUtf8("pdfLinearize"))
+    self.formLayout_4.setWidget(7, QtGui.QFormLayout.FieldRole, self.pdfLinearize)
     self.stackedWidget.addWidget(self.page_2)
     self.gridLayout_4.addWidget(self.stackedWidget, 0, 0, 1, 1)
     self.tabWidget.addTab(self.encodingTab, _fromUtf8(""))
@@ -462,15 +497,22 @@ class Ui_MainWindow(object):
 "}"))
     self.debugLog.setLineWrapMode(QtGui.QTextEdit.NoWrap)
     self.debugLog.setObjectName(_fromUtf8("debugLog"))
-    self.gridLayout_5.addWidget(self.debugLog, 0, 0, 1, 3)
+    self.gridLayout_5.addWidget(self.debugLog, 0, 0, 1, 4)
     self.clearLogButton = QtGui.QPushButton(self.debugTab)
     self.clearLogButton.setObjectName(_fromUtf8("clearLogButton"))
     self.gridLayout_5.addWidget(self.clearLogButton, 1, 0, 1, 1)
+    self.logLevel = QtGui.QComboBox(self.debugTab)
+    self.logLevel.setObjectName(_fromUtf8("logLevel"))
+    self.logLevel.addItem(_fromUtf8(""))
+    self.logLevel.addItem(_fromUtf8(""))
+    self.logLevel.addItem(_fromUtf8(""))
+    self.logLevel.addItem(_fromUtf8(""))
+    self.gridLayout_5.addWidget(self.logLevel, 1, 1, 1, 1)
     spacerItem4 = QtGui.QSpacerItem(220, 20, QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Minimum)
-    self.gridLayout_5.addItem(spacerItem4, 1, 1, 1, 1)
+    self.gridLayout_5.addItem(spacerItem4, 1, 2, 1, 1)
     self.saveLogButton = QtGui.QPushButton(self.debugTab)
     self.saveLogButton.setObjectName(_fromUtf8("saveLogButton"))
-    self.gridLayout_5.addWidget(self.saveLogButton, 1, 2, 1, 1)
+    self.gridLayout_5.addWidget(self.saveLogButton, 1, 3, 1, 1)
     self.tabWidget.addTab(self.debugTab, _fromUtf8(""))
     self.verticalLayout.addWidget(self.tabWidget)
     self.horizontalLayout_7 = QtGui.QHBoxLayout()
@@ -634,6 +676,7 @@ class Ui_MainWindow(object):
     self.tabWidget.setCurrentIndex(1)
     self.outputFormat.setCurrentIndex(0)
     self.ocrLanguage.setCurrentIndex(5)
+    self.logLevel.setCurrentIndex(1)
     self.stackedWidget_2.setCurrentIndex(0)
     self.stackedWidget.setCurrentIndex(0)
     QtCore.QObject.connect(self.addPageButton, QtCore.SIGNAL(_fromUtf8("clicked()")), MainWindow.addFiles)
@@ -645,6 +688,7 @@ class Ui_MainWindow(object):
     QtCore.QObject.connect(self.filePreviewsMenuItem, QtCore.SIGNAL(_fromUtf8("toggled(bool)")), MainWindow.togglePreviews)
     QtCore.QObject.connect(self.addPageMenuItem, QtCore.SIGNAL(_fromUtf8("triggered()")), MainWindow.addFiles)
     QtCore.QObject.connect(self.moveDownButton, QtCore.SIGNAL(_fromUtf8("clicked()")), MainWindow.moveItemDown)
+    QtCore.QObject.connect(self.encodePreviewButton, QtCore.SIGNAL(_fromUtf8("clicked()")), MainWindow.previewEncoding)
     QtCore.QObject.connect(self.moveToTopButton, QtCore.SIGNAL(_fromUtf8("clicked()")), MainWindow.moveItemToTop)
     QtCore.QObject.connect(self.moveUpButton, QtCore.SIGNAL(_fromUtf8("clicked()")), MainWindow.moveItemUp)
     QtCore.QObject.connect(self.enableOCR, QtCore.SIGNAL(_fromUtf8("toggled(bool)")), self.frame.setEnabled)
@@ -660,7 +704,9 @@ class Ui_MainWindow(object):
     QtCore.QObject.connect(self.actionAbout_Qt4, QtCore.SIGNAL(_fromUtf8("triggered()")), MainWindow.aboutQt)
     QtCore.QObject.connect(self.aboutMenuItem, QtCore.SIGNAL(_fromUtf8("triggered()")), MainWindow.aboutBindery)
     QtCore.QObject.connect(self.helpMenuItem, QtCore.SIGNAL(_fromUtf8("triggered()")), MainWindow.notImplemented)
-    QtCore.QObject.connect(self.saveAsMenuItem, QtCore.SIGNAL(_fromUtf8("activated()")), MainWindow.notImplemented)
+    QtCore.QObject.connect(self.openMenuItem, QtCore.SIGNAL(_fromUtf8("triggered()")), MainWindow.openProject)
+    QtCore.QObject.connect(self.saveMenuItem, QtCore.SIGNAL(_fromUtf8("triggered()")), MainWindow.saveProject)
+    QtCore.QObject.connect(self.saveAsMenuItem, QtCore.SIGNAL(_fromUtf8("triggered()")), MainWindow.saveProjectAs)
     QtCore.QObject.connect(self.actionReload_Thumbnails, QtCore.SIGNAL(_fromUtf8("triggered()")), MainWindow.reloadThumbnails)
     QtCore.QMetaObject.connectSlotsByName(MainWindow)
 
@@ -670,6 +716,7 @@ class Ui_MainWindow(object):
     self.addPageButton.setText(QtGui.QApplication.translate("MainWindow", "Add page", None, QtGui.QApplication.UnicodeUTF8))
     self.removePageButton.setText(QtGui.QApplication.translate("MainWindow", "Remove page", None, QtGui.QApplication.UnicodeUTF8))
     self.label.setText(QtGui.QApplication.translate("MainWindow", "Page Preview", None, QtGui.QApplication.UnicodeUTF8))
+    self.encodePreviewButton.setText(QtGui.QApplication.translate("MainWindow", "Preview encoding", None, QtGui.QApplication.UnicodeUTF8))
     self.moveToTopButton.setText(QtGui.QApplication.translate("MainWindow", "Very Top", None, QtGui.QApplication.UnicodeUTF8))
     self.moveUpButton.setText(QtGui.QApplication.translate("MainWindow", "Move Up", None, QtGui.QApplication.UnicodeUTF8))
     self.moveDownButton.setText(QtGui.QApplication.translate("MainWindow", "Move Down", None, QtGui.QApplication.UnicodeUTF8))
@@ -751,6 +798,7 @@ class Ui_MainWindow(object):
     self.csepdjvuOptionsLabel.setText(QtGui.QApplication.translate("MainWindow", "csepdjvu Options", None, QtGui.QApplication.UnicodeUTF8))
     self.minidjvuOptionsLabel.setText(QtGui.QApplication.translate("MainWindow", "minidjvu Options", None, QtGui.QApplication.UnicodeUTF8))
     self.minidjvuOptions.setText(QtGui.QApplication.translate("MainWindow", "--match -pages-per-dict 100", None, QtGui.QApplication.UnicodeUTF8))
+    self.djvuIndirect.setText(QtGui.QApplication.translate("MainWindow", "One file per page (indirect)", None, QtGui.QApplication.UnicodeUTF8))
     self.label_14.setText(QtGui.QApplication.translate("MainWindow", "Page Layout", None, QtGui.QApplication.UnicodeUTF8))
     self.pdfPageLayout.setItemText(0, QtGui.QApplication.translate("MainWindow", "Single Page", None, QtGui.QApplication.UnicodeUTF8))
     self.pdfPageLayout.setItemText(1, QtGui.QApplication.translate("MainWindow", "One Column", None, QtGui.QApplication.UnicodeUTF8))
@@ -768,9 +816,17 @@ class Ui_MainWindow(object):
     self.label_10.setText(QtGui.QApplication.translate("MainWindow", "JBIG2 Dictionary Size", None, QtGui.QApplication.UnicodeUTF8))
     self.label_11.setText(QtGui.QApplication.translate("MainWindow", "Binarization Threshold", None, QtGui.QApplication.UnicodeUTF8))
     self.label_12.setText(QtGui.QApplication.translate("MainWindow", "Maximum Indexed Colors", None, QtGui.QApplication.UnicodeUTF8))
+    self.pdfWriterLabel.setText(QtGui.QApplication.translate("MainWindow", "PDF Writer", None, QtGui.QApplication.UnicodeUTF8))
+    self.pdfWriter.setItemText(0, QtGui.QApplication.translate("MainWindow", "pdfbeads", None, QtGui.QApplication.UnicodeUTF8))
+    self.pdfWriter.setItemText(1, QtGui.QApplication.translate("MainWindow", "Built-in", None, QtGui.QApplication.UnicodeUTF8))
+    self.pdfLinearize.setText(QtGui.QApplication.translate("MainWindow", "Optimize for fast web view", None, QtGui.QApplication.UnicodeUTF8))
     self.tabWidget.setTabText(self.tabWidget.indexOf(self.encodingTab), QtGui.QApplication.translate("MainWindow", "Encoding Options", None, QtGui.QApplication.UnicodeUTF8))
     self.clearLogButton.setText(QtGui.QApplication.translate("MainWindow", "Clear log", None, QtGui.QApplication.UnicodeUTF8))
     self.saveLogButton.setText(QtGui.QApplication.translate("MainWindow", "Save log", None, QtGui.QApplication.UnicodeUTF8))
+    self.logLevel.setItemText(0, QtGui.QApplication.translate("MainWindow", "All messages", None, QtGui.QApplication.UnicodeUTF8))
+    self.logLevel.setItemText(1, QtGui.QApplication.translate("MainWindow", "Information", None, QtGui.QApplication.UnicodeUTF8))
+    self.logLevel.setItemText(2, QtGui.QApplication.translate("MainWindow", "Warnings", None, QtGui.QApplication.UnicodeUTF8))
+    self.logLevel.setItemText(3, QtGui.QApplication.translate("MainWindow", "Errors", None, QtGui.QApplication.UnicodeUTF8))
     self.tabWidget.setTabText(self.tabWidget.indexOf(self.debugTab), QtGui.QApplication.translate("MainWindow", "Debug Log", None, QtGui.QApplication.UnicodeUTF8))
     self.progressBar.setFormat(QtGui.QApplication.translate("MainWindow", "%p%", None, QtGui.QApplication.UnicodeUTF8))
     self.startButton.setText(QtGui.QApplication.translate("MainWindow", "Start", None, QtGui.QApplication.UnicodeUTF8))
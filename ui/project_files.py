@@ -42,6 +42,9 @@ class Ui_ProjectFilesDialog(object):
     self.inputDirectory.setEnabled(True)
     self.inputDirectory.setObjectName(_fromUtf8("inputDirectory"))
     self.hboxlayout.addWidget(self.inputDirectory)
+    self.includeSubfolders = QtGui.QCheckBox(self.groupBox_2)
+    self.includeSubfolders.setObjectName(_fromUtf8("includeSubfolders"))
+    self.hboxlayout.addWidget(self.includeSubfolders)
     self.browseButton1 = QtGui.QPushButton(self.groupBox_2)
     self.browseButton1.setObjectName(_fromUtf8("browseButton1"))
     self.hboxlayout.addWidget(self.browseButton1)
@@ -140,6 +143,7 @@ class Ui_ProjectFilesDialog(object):
   def retranslateUi(self, ProjectFilesDialog):
     ProjectFilesDialog.setWindowTitle(QtGui.QApplication.translate("ProjectFilesDialog", "Project Files", None, QtGui.QApplication.UnicodeUTF8))
     self.groupBox_2.setTitle(QtGui.QApplication.translate("ProjectFilesDialog", "Input Directory", None, QtGui.QApplication.UnicodeUTF8))
+    self.includeSubfolders.setText(QtGui.QApplication.translate("ProjectFilesDialog", "Include subfolders", None, QtGui.QApplication.UnicodeUTF8))
     self.browseButton1.setText(QtGui.QApplication.translate("ProjectFilesDialog", "Browse", None, QtGui.QApplication.UnicodeUTF8))
     self.groupBox.setTitle(QtGui.QApplication.translate("ProjectFilesDialog", "Output File", None, QtGui.QApplication.UnicodeUTF8))
     self.browseButton2.setText(QtGui.QApplication.translate("ProjectFilesDialog", "Browse", None, QtGui.QApplication.UnicodeUTF8))